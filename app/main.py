@@ -1,11 +1,29 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import admin_ai
 from app.routes import chat
 from app.routes import custom_test
 from app.config import settings
+from app.database import engine
+from app.services.audit_log import audit_writer
+from app.services.readiness import readiness
 
-app = FastAPI(title="TestPilot AI Engine")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so /ready can report progress meanwhile
+    if settings.warmup_enabled:
+        readiness.start()
+    yield
+    await readiness.stop()
+    # Write out audit rows still buffered in memory
+    await audit_writer.close()
+    await engine.dispose()
+
+
+app = FastAPI(title="TestPilot AI Engine", lifespan=lifespan)
 
 cors_origins = [origin.strip() for origin in settings.cors_origins.split(",")]
 app.add_middleware(
@@ -26,4 +44,12 @@ async def root():
 
 @app.get("/health-check")
 async def health():
-    return {"model": "gemma2", "ollama_status": "ready"}
\ No newline at end of file
+    model = settings.groq_model if settings.llm_provider == "groq" else settings.llm_model
+    return {"model": model, "ollama_status": readiness.components["llm"]["status"]}
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until every component has been warmed up."""
+    if not settings.warmup_enabled:
+        return {"ready": True, "components": {}}
+    return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
\ No newline at end of file
@@ -1,50 +1,105 @@
 import os
 import shutil
+import uuid
+from contextlib import aclosing
+from typing import Optional
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from app.services.rag_service import process_pdf_to_vector_db
-from app.services.rag_service import search_in_vector_db
-from app.services.rag_service import reset_vector_db
-from app.services.rag_service import get_all_topics
+from fastapi.responses import StreamingResponse
+from app.services.rag_service import asearch_in_vector_db
+from app.services.rag_service import retrieval_cache, query_embedding_cache, embedding_cache, numpy_index
+from app.services.rag_service import query_batcher
+from app.services.rag_service import reset_vector_db, topic_catalog
 from app.services.llm_service import generate_test_from_chunks
 from app.services.llm_service import generate_bulk_questions
+from app.services.llm_service import stream_bulk_questions
+from app.services.llm_service import QuestionSchema
+from app.services.executor import run_blocking
+from app.services.answer_cache import answer_cache
+from app.services.context_builder import context_stats
+from app.services.custom_test_service import context_cache as custom_test_context_cache
+from app.services.full_test_planner import QuestionDeduper, chunk_vectors, diverse_batches, full_test_stats
+from app.services.question_bank import question_bank
+from app.services.topic_digests import topic_digests
+from app.services.ingestion_jobs import ingestion_jobs, IngestionQueueFull
+from app.database import pool_stats
+from app.services.audit_log import audit_writer
+from app.services.auth_service import auth_cache_stats, invalidate_auth_cache
 from app.config import settings
 
 router = APIRouter(prefix="/admin/ai", tags=["Admin AI"])
 
 os.makedirs(settings.upload_dir, exist_ok=True)
 
-@router.post("/upload-manual")
+@router.post("/upload-manual", status_code=202)
 async def upload_manual(
     file: UploadFile = File(...),
-    topic: str = Form(...)
+    topic: str = Form(...),
+    replace: bool = Form(False)
 ):
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF")
 
-    # Build file path
-    file_path = os.path.join(settings.upload_dir, file.filename)
+    # One directory per job keeps the original filename as the chunk source
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(settings.upload_dir, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    file_path = os.path.join(job_dir, os.path.basename(file.filename))
 
     try:
         with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+            await run_blocking(shutil.copyfileobj, file.file, buffer)
 
-        num_chunks = process_pdf_to_vector_db(file_path, topic)
-
-        return {
-            "message": f"Archivo '{file.filename}' procesado con éxito",
-            "topic": topic,
-            "chunks_created": num_chunks
-        }
+        job = await ingestion_jobs.submit(
+            file_path,
+            file.filename,
+            topic,
+            job_id=job_id,
+            replace_source=replace
+        )
+    except IngestionQueueFull:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=503, detail="La cola de ingesta está llena, inténtalo más tarde")
     except Exception as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+
+    return {
+        "message": f"Archivo '{file.filename}' en cola para procesar",
+        "topic": topic,
+        "job_id": job.id,
+        "status": job.status
+    }
+
+
+@router.get("/jobs")
+async def list_jobs():
+    jobs = await run_blocking(ingestion_jobs.list)
+    return {"jobs": [job.model_dump(exclude={"file_path"}) for job in jobs]}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await run_blocking(ingestion_jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo de ingesta no encontrado")
+    return job.model_dump(exclude={"file_path"})
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancels a queued or running ingestion job. For an interrupted job,
+    removes the chunks it had already written.
+    """
+    job = await ingestion_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo de ingesta no encontrado")
+    return job.model_dump(exclude={"file_path"})
             
 @router.get("/test-search")
 async def test_search(query: str, topic: str):
     try:
-        results = search_in_vector_db(query, topic)
+        results = await asearch_in_vector_db(query, topic)
         
         # Data formatting for json response
         formatted_results = [
@@ -64,13 +119,22 @@ async def test_search(query: str, topic: str):
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.delete("/reset-db")
-async def reset_db():
+async def reset_db(topic: Optional[str] = None):
     try:
-        reset_vector_db()
+        await run_blocking(reset_vector_db, topic)
+        await run_blocking(topic_digests.drop, topic)
+        if topic:
+            return {"message": f"Tema '{topic}' eliminado de la base de datos vectorial"}
         return {"message": "Base de datos vectorial reseteada con éxito"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.delete("/auth-cache")
+async def clear_auth_cache(token: Optional[str] = None):
+    """Call after revoking or reissuing a token so it stops being accepted from cache."""
+    invalidate_auth_cache(token)
+    return {"message": "Caché de autenticación invalidada"}
+
 @router.get("/topics")
 async def get_topics():
     """
@@ -78,61 +142,312 @@ async def get_topics():
     Useful for synchronizing topics with other services.
     """
     try:
-        topics = get_all_topics()
+        catalog = await run_blocking(topic_catalog.topics)
+        topics = sorted(catalog)
         return {
             "topics": topics,
-            "total": len(topics)
+            "total": len(topics),
+            "details": {topic: catalog[topic] for topic in topics},
+            # Topics whose last ingestion was cut short and may be partially indexed
+            "incomplete": await run_blocking(ingestion_jobs.incomplete_topics)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/topics/{topic}/digests")
+async def get_topic_digests(topic: str):
+    """Section digests of a topic, as used by the generation endpoints with use_digests."""
+    sections = await run_blocking(topic_digests.get, topic)
+    return {
+        "topic": topic,
+        "total": len(sections),
+        "sections": [
+            {"section": key, "source": entry["source"], "pages": entry["pages"], "digest": entry["digest"]}
+            for key, entry in sorted(sections.items())
+        ]
+    }
+
+
+@router.post("/topics/{topic}/digests", status_code=202)
+async def rebuild_topic_digests(topic: str):
+    """Rebuilds in the background the digests of the sections whose chunks changed."""
+    topic_digests.schedule_refresh(topic)
+    return {"message": f"Regenerando resúmenes del tema '{topic}'", "topic": topic}
     
+@router.get("/metrics")
+async def get_metrics():
+    """Cache and generation counters for monitoring."""
+    return {
+        "retrieval_cache": retrieval_cache.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "query_batcher": query_batcher.stats(),
+        "numpy_index": numpy_index.stats() if settings.vector_backend == "numpy" else None,
+        "answer_cache": answer_cache.stats(),
+        "question_bank": await run_blocking(question_bank.stats),
+        "topic_digests": topic_digests.stats(),
+        "context": context_stats.stats(),
+        "full_test": full_test_stats.stats(),
+        "custom_test_context": custom_test_context_cache.stats(),
+        "audit_log": audit_writer.stats(),
+        "auth_cache": auth_cache_stats(),
+        "database_pool": pool_stats()
+    }
+    
+async def _load_digests(topic: str, use_digests: Optional[bool], limit: int = None):
+    """The topic's digests when requested (or on by default) and already built, else []."""
+    if use_digests is None:
+        use_digests = settings.topic_digests_default
+    if not use_digests:
+        return []
+    return await topic_digests.documents(topic, limit)
+
+
 @router.get("/generate-question")
-async def get_test_question(topic: str):
-    # Get relevant chunks from vector DB
-    chunks = search_in_vector_db(query="conceptos principales y normas", topic=topic, k=10)
+async def get_test_question(topic: str, use_digests: Optional[bool] = None):
+    # Serve a pre-generated question when the bank has one; it refills itself in the background.
+    # The bank is built from chunks, so an explicit request for digests bypasses it
+    if settings.question_bank_enabled and not use_digests:
+        question = await question_bank.pop(topic)
+        if question:
+            return question
+
+    # A few section digests when available, else relevant chunks from vector DB
+    chunks = await _load_digests(topic, use_digests, settings.topic_digests_per_prompt)
+    if not chunks:
+        chunks = await asearch_in_vector_db(query="conceptos principales y normas", topic=topic, k=10)
     
     if not chunks:
         return {"error": "No se encontró contenido para este tema"}
     
     # Generate question using LLM
-    question_data = generate_test_from_chunks(chunks, topic)
+    question_data = await generate_test_from_chunks(chunks, topic)
     
     return question_data
 
+import asyncio
+import json
 import random
 
-@router.get("/generate-full-test")
-async def get_full_test(topic: str, num_questions: int = 10):
-    # high k to get full context
-    all_chunks = search_in_vector_db(query="normas generales", topic=topic, k=100)
+
+def _extract_questions(batch_result):
+    if isinstance(batch_result, dict):
+        return batch_result.get("preguntas", [])
+    return batch_result.preguntas
+
+
+async def _generate_batch(batch_chunks, topic: str, count: int, limiter: asyncio.Semaphore):
+    """Generates one batch, retrying up to full_test_batch_retries times."""
+    last_error = None
+    for _ in range(settings.full_test_batch_retries + 1):
+        try:
+            async with limiter:
+                batch_result = await generate_bulk_questions(batch_chunks, topic, count)
+            return _extract_questions(batch_result)
+        except Exception as e:
+            last_error = e
+    raise last_error
+
+
+async def _load_full_test_chunks(topic: str, use_digests: Optional[bool] = None):
+    """Returns (chunks, chunks per batch): section digests when available, else raw chunks."""
+    digests = await _load_digests(topic, use_digests)
+    if digests:
+        return digests, settings.topic_digests_per_prompt
+
+    # high k to get full context; kept in relevance order for the batch planner
+    all_chunks = await asearch_in_vector_db(query="normas generales", topic=topic, k=100)
     
-    total_available = len(all_chunks)
-    if total_available == 0:
+    if not all_chunks:
         raise HTTPException(status_code=404, detail="No hay datos para este tema")
 
-    random.shuffle(all_chunks)
+    return all_chunks, 10
 
-    full_test = []
+
+async def _plan_batches(all_chunks, num_questions: int, per_batch: int = 10, topic: str = None):
+    """
+    Splits the test into (chunks, question_count) batches of up to `per_batch`
+    chunks. Batches get disjoint chunk sets from different parts of the
+    material (see diverse_batches); the chunks no batch got are returned as a
+    reserve for regenerating duplicates.
+    """
     # Adjustable number of questions per batch
     questions_per_batch = 5
     
     # Calculate number of batches needed
     batches = (num_questions // questions_per_batch) + (1 if num_questions % questions_per_batch != 0 else 0)
 
-    for i in range(batches):
-        # Circular indexing to avoid index errors
-        start_idx = (i * 5) % total_available
-        batch_chunks = all_chunks[start_idx : start_idx + 10]
-        
-        if not batch_chunks:
-             batch_chunks = all_chunks[:10]
+    vectors = await run_blocking(chunk_vectors, all_chunks, topic)
+    groups, reserve = diverse_batches(vectors, batches, per_batch)
 
-        current_count = min(questions_per_batch, num_questions - len(full_test))
-        batch_result = generate_bulk_questions(batch_chunks, topic, current_count)
-        
-        if isinstance(batch_result, dict):
-            full_test.extend(batch_result.get("preguntas", []))
+    jobs = []
+    for i, group in enumerate(groups):
+        current_count = min(questions_per_batch, num_questions - i * questions_per_batch)
+        jobs.append(([all_chunks[j] for j in group], current_count))
+    return jobs, [all_chunks[j] for j in reserve]
+
+
+def _take_chunks(reserve: list, all_chunks, per_batch: int):
+    """Next chunks for a regeneration: unused ones first, then a random sample."""
+    if reserve:
+        batch = reserve[:per_batch]
+        del reserve[:per_batch]
+        return batch
+    return random.sample(all_chunks, min(per_batch, len(all_chunks)))
+
+
+@router.get("/generate-full-test")
+async def get_full_test(topic: str, num_questions: int = 10, use_digests: Optional[bool] = None):
+    all_chunks, per_batch = await _load_full_test_chunks(topic, use_digests)
+    jobs, reserve = await _plan_batches(all_chunks, num_questions, per_batch, topic)
+
+    # Per-request limit; the process-wide limit is applied inside llm_service
+    limiter = asyncio.Semaphore(settings.full_test_batch_concurrency)
+    results = await asyncio.gather(
+        *[_generate_batch(batch_chunks, topic, count, limiter) for batch_chunks, count in jobs],
+        return_exceptions=True
+    )
+
+    deduper = QuestionDeduper(settings.full_test_dedupe_threshold)
+    full_test = []
+    failed_batches = []
+    generated = duplicates = 0
+    llm_calls = len(jobs)
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            failed_batches.append({"batch": i, "questions": jobs[i][1], "error": str(result)})
         else:
-            full_test.extend(batch_result.preguntas)
+            kept, dropped = await run_blocking(deduper.filter, result)
+            full_test.extend(kept)
+            generated += len(result)
+            duplicates += dropped
+
+    # Only the questions lost to duplicates are asked for again, from chunks no batch has seen
+    missing = num_questions - len(full_test) - sum(f["questions"] for f in failed_batches)
+    for _ in range(settings.full_test_regeneration_rounds):
+        if missing <= 0:
+            break
+        llm_calls += 1
+        try:
+            result = await _generate_batch(_take_chunks(reserve, all_chunks, per_batch), topic, missing, limiter)
+        except Exception:
+            break
+        kept, dropped = await run_blocking(deduper.filter, result)
+        kept = kept[:missing]
+        full_test.extend(kept)
+        generated += len(result)
+        duplicates += dropped
+        missing -= len(kept)
+
+    full_test_stats.record(llm_calls, generated, duplicates, len(full_test))
+    if not full_test and failed_batches:
+        raise HTTPException(status_code=502, detail=f"Error generando el test: {failed_batches[0]['error']}")
+
+    response = {"topic": topic, "total_questions": len(full_test), "test": full_test}
+    if failed_batches:
+        response["failed_batches"] = failed_batches
+    if duplicates:
+        response["duplicates_removed"] = duplicates
+    return response
+
+
+def _ndjson(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+async def _regenerate_question(all_chunks, topic: str, per_batch: int = 10, reserve: list = None):
+    batch_chunks = _take_chunks(reserve if reserve is not None else [], all_chunks, per_batch)
+    try:
+        question = await generate_test_from_chunks(batch_chunks, topic)
+        return QuestionSchema.model_validate(question).model_dump()
+    except Exception:
+        return None
+
+
+async def _stream_full_test(all_chunks, jobs, topic: str, num_questions: int, per_batch: int = 10, reserve: list = None):
+    """
+    NDJSON stream: one `question` line per valid question as soon as its batch
+    produces it, then a `done` line. Invalid questions and near-duplicates of
+    one already sent are dropped and regenerated one at a time.
+    """
+    queue = asyncio.Queue()
+    limiter = asyncio.Semaphore(settings.full_test_batch_concurrency)
+    deduper = QuestionDeduper(settings.full_test_dedupe_threshold)
+
+    async def run_batch(index, batch_chunks, count):
+        try:
+            async with limiter, aclosing(stream_bulk_questions(batch_chunks, topic, count)) as questions:
+                async for question in questions:
+                    await queue.put(("question", index, question))
+        except Exception as e:
+            await queue.put(("error", index, str(e)))
+        finally:
+            await queue.put(("end", index, None))
+
+    async def is_new(question):
+        kept, _ = await run_blocking(deduper.filter, [question])
+        return bool(kept)
+
+    tasks = [asyncio.create_task(run_batch(i, c, n)) for i, (c, n) in enumerate(jobs)]
+    valid = 0
+    dropped = 0
+    duplicates = 0
+    generated = 0
+    llm_calls = len(jobs)
+    failed_batches = []
+    try:
+        pending = len(tasks)
+        while pending:
+            kind, index, payload = await queue.get()
+            if kind == "end":
+                pending -= 1
+            elif kind == "error":
+                failed_batches.append({"batch": index, "error": payload})
+            elif payload is None:
+                dropped += 1
+            elif valid < num_questions:
+                generated += 1
+                if not await is_new(payload):
+                    duplicates += 1
+                    continue
+                valid += 1
+                yield _ndjson({"type": "question", "batch": index, "question": payload})
+
+        failures = 0
+        while valid < num_questions and failures < settings.stream_max_regenerations:
+            llm_calls += 1
+            question = await _regenerate_question(all_chunks, topic, per_batch, reserve)
+            if question is None:
+                failures += 1
+                continue
+            generated += 1
+            if not await is_new(question):
+                duplicates += 1
+                failures += 1
+                continue
+            valid += 1
+            yield _ndjson({"type": "question", "batch": None, "question": question})
+
+        full_test_stats.record(llm_calls, generated, duplicates, valid)
+        yield _ndjson({
+            "type": "done",
+            "topic": topic,
+            "total_questions": valid,
+            "dropped": dropped,
+            "duplicates": duplicates,
+            "failed_batches": failed_batches
+        })
+    finally:
+        for task in tasks:
+            task.cancel()
+
 
-    return {"topic": topic, "total_questions": len(full_test), "test": full_test}
\ No newline at end of file
+@router.get("/generate-full-test/stream")
+async def stream_full_test(topic: str, num_questions: int = 10, use_digests: Optional[bool] = None):
+    all_chunks, per_batch = await _load_full_test_chunks(topic, use_digests)
+    jobs, reserve = await _plan_batches(all_chunks, num_questions, per_batch, topic)
+    return StreamingResponse(
+        _stream_full_test(all_chunks, jobs, topic, num_questions, per_batch, reserve),
+        media_type="application/x-ndjson"
+    )
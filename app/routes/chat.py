@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException
+import json
+from contextlib import aclosing
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Literal, List
-from app.services.rag_service import search_in_vector_db
-from app.services.llm_service import chat_with_tutor
+from app.config import settings
+from app.services.rag_service import aembed_query, asearch_by_vector, content_fingerprint
+from app.services.llm_service import chat_with_tutor, stream_chat_with_tutor
+from app.services.answer_cache import answer_cache
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
@@ -18,15 +23,90 @@ class ChatRequest(BaseModel):
     tone: Literal["formal", "informal", "conciso", "detallado"] = "formal"
     user_name: Optional[str] = None
     history: Optional[List[ChatMessage]] = None
+    stream: bool = False
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _chunk_sources(chunks):
+    return [
+        {
+            "source": c.metadata.get("source"),
+            "page": c.metadata.get("page"),
+            "topic": c.metadata.get("topic")
+        } for c in chunks
+    ]
+
+
+async def _stream_answer(http_request: Request, request: ChatRequest, chunks, history_dicts, on_complete=None):
+    """
+    SSE stream: one `token` event per fragment, then a `done` event with the sources.
+    The upstream generation is closed as soon as the client goes away.
+    """
+    tokens = stream_chat_with_tutor(request.question, chunks, request.tone, request.user_name, history_dicts)
+    answer = []
+    async with aclosing(tokens):
+        try:
+            async for token in tokens:
+                if await http_request.is_disconnected():
+                    return
+                answer.append(token)
+                yield _sse("token", {"content": token})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+    if on_complete:
+        on_complete("".join(answer))
+    yield _sse("done", {"question": request.question, "sources": _chunk_sources(chunks)})
+
+
+async def _stream_cached(request: ChatRequest, cached: dict):
+    yield _sse("token", {"content": cached["response"]})
+    yield _sse("done", {"question": request.question, "sources": cached["sources"], "cached": True})
 
 
 @router.post("/")
-async def chat(request: ChatRequest):
-    chunks = search_in_vector_db(query=request.question, topic=request.topic, k=6)
-    
+async def chat(request: ChatRequest, http_request: Request):
+    # Answers that depend on the conversation history are never cached
+    use_cache = settings.answer_cache_enabled and not request.history
+    # The fingerprint moves when any worker ingests into the topic, retiring older answers
+    bucket = (request.topic, content_fingerprint(request.topic), request.tone, request.user_name) if use_cache else None
+
+    # The query embedding is computed once and reused for cache lookup and retrieval
+    embedding = await aembed_query(request.question)
+    generation = answer_cache.generation
+
+    if use_cache:
+        cached = answer_cache.lookup(bucket, embedding)
+        if cached:
+            if request.stream:
+                return StreamingResponse(_stream_cached(request, cached), media_type="text/event-stream")
+            return {"question": request.question, "response": cached["response"], "cached": True}
+
+    chunks = await asearch_by_vector(embedding, request.topic, 6)
+
     if not chunks:
         raise HTTPException(status_code=404, detail="No hay material para este tema")
-    
+
     history_dicts = [msg.model_dump() for msg in request.history] if request.history else None
-    response = chat_with_tutor(request.question, chunks, request.tone, request.user_name, history_dicts)
+
+    def remember(answer: str):
+        if use_cache and answer:
+            answer_cache.store(
+                bucket, embedding,
+                {"response": answer, "sources": _chunk_sources(chunks)},
+                generation=generation
+            )
+
+    if request.stream:
+        return StreamingResponse(
+            _stream_answer(http_request, request, chunks, history_dicts, on_complete=remember),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    response = await chat_with_tutor(request.question, chunks, request.tone, request.user_name, history_dicts)
+    remember(response)
     return {"question": request.question, "response": response}
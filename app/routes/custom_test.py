@@ -1,10 +1,13 @@
+import json
+from contextlib import aclosing
 from fastapi import APIRouter, Header, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.services.auth_service import create_user_token, verify_token, check_rate_limit
-from app.services.custom_test_service import generate_custom_test
+from app.services.custom_test_service import generate_custom_test, stream_custom_test
 
 router = APIRouter(prefix="/custom-test", tags=["Custom Test"])
 
@@ -19,8 +22,8 @@ class GenerateRequest(BaseModel):
 
 
 @router.post("/auth")
-async def authenticate(request: AuthRequest, db: Session = Depends(get_db)):
-    token = create_user_token(db, request.full_name, request.dni)
+async def authenticate(request: AuthRequest, db: AsyncSession = Depends(get_db)):
+    token = await create_user_token(db, request.full_name, request.dni)
     return {"token": token}
 
 
@@ -28,15 +31,43 @@ async def authenticate(request: AuthRequest, db: Session = Depends(get_db)):
 async def generate_test(
     request: GenerateRequest,
     x_auth_token: str = Header(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = verify_token(db, x_auth_token)
-    check_rate_limit(db, user["token_id"])
+    user = await verify_token(db, x_auth_token)
+    await check_rate_limit(user["token_id"])
 
     profile = request.student_stats if request.student_stats else {}
 
     try:
-        result = generate_custom_test(profile)
+        result = await generate_custom_test(profile)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+
+async def _stream_questions(profile: dict):
+    """NDJSON stream: one `question` line per valid question, then a `done` line."""
+    total = 0
+    try:
+        async with aclosing(stream_custom_test(profile)) as questions:
+            async for question in questions:
+                total += 1
+                yield json.dumps({"type": "question", "question": question}, ensure_ascii=False) + "\n"
+    except Exception as e:
+        yield json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+    yield json.dumps({"type": "done", "total_questions": total}) + "\n"
+
+
+@router.post("/generate/stream")
+async def generate_test_stream(
+    request: GenerateRequest,
+    x_auth_token: str = Header(...),
+    db: AsyncSession = Depends(get_db)
+):
+    user = await verify_token(db, x_auth_token)
+    await check_rate_limit(user["token_id"])
+
+    profile = request.student_stats if request.student_stats else {}
+
+    return StreamingResponse(_stream_questions(profile), media_type="application/x-ndjson")
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+from app.config import settings
+from app.services.rag_service import on_topic_invalidated
+
+
+class SemanticAnswerCache:
+    """
+    Caches tutor answers by question embedding. A lookup hits when a cached
+    question in the same (topic, content fingerprint, tone, user_name) bucket
+    is at least `threshold` cosine-similar to the new one. Entries expire
+    after `ttl` seconds and the least recently used ones are evicted beyond
+    `max_entries`. The fingerprint comes from the shared topic catalog, so an
+    upload in any worker retires older answers; `invalidate_topic` only frees
+    them early in the worker that ran the ingestion.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl: float):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Bumped on every invalidation so answers computed before it are not stored
+        self.generation = 0
+        # (bucket, entry_id) -> entry, in LRU order across all buckets
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expired(self, entry, now: float) -> bool:
+        return self.ttl > 0 and now - entry["created_at"] > self.ttl
+
+    def lookup(self, bucket: tuple, embedding):
+        """Returns the best cached entry above the threshold, or None."""
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for key in list(self._entries):
+                entry = self._entries[key]
+                if self._expired(entry, now):
+                    del self._entries[key]
+                    continue
+                if key[0] != bucket:
+                    continue
+                score = float(np.dot(entry["vector"], query))
+                if score >= best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            entry = self._entries[best_key]
+            return {**entry["value"], "similarity": best_score}
+
+    def store(self, bucket: tuple, embedding, value: dict, generation: int = None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            key = (bucket, self._next_id)
+            self._next_id += 1
+            self._entries[key] = {
+                "vector": self._normalize(embedding),
+                "value": value,
+                "created_at": time.monotonic()
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_topic(self, topic: str = None):
+        """Drops answers for `topic` and cross-topic answers; topic=None clears everything."""
+        with self._lock:
+            self.generation += 1
+            if topic is None:
+                self._entries.clear()
+                return
+            for key in list(self._entries):
+                bucket_topic = key[0][0]
+                if bucket_topic is None or bucket_topic == topic:
+                    del self._entries[key]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+answer_cache = SemanticAnswerCache(
+    threshold=settings.answer_cache_threshold,
+    max_entries=settings.answer_cache_max_entries,
+    ttl=settings.answer_cache_ttl_seconds
+)
+
+on_topic_invalidated(answer_cache.invalidate_topic)
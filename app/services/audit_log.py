@@ -0,0 +1,157 @@
+"""
+Batched audit trail of AI requests in MySQL, plus its retention job.
+
+The rate limiter no longer reads ai_requests, so rows are only an audit
+record: they are buffered in memory and written in batches by a background
+task instead of with one INSERT and commit per request.
+
+The rollup folds rows older than AUDIT_RETENTION_DAYS into per-day counts in
+ai_requests_daily and deletes them, so ai_requests only holds recent
+traffic. Run it from cron on a single host:
+
+Usage:
+    python -m app.services.audit_log rollup
+"""
+import asyncio
+import datetime
+import sys
+import time
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import SessionLocal
+
+
+class AuditWriter:
+    """Buffers (token_id, created_at) rows and inserts them in batches."""
+
+    def __init__(self, session_factory, batch_size: int, flush_seconds: float, max_pending: int = 10000):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        # Rows kept while the database is unreachable; the oldest are dropped beyond this
+        self.max_pending = max_pending
+        self._pending = []
+        self._task = None
+        self._wakeup = None
+        self._metrics = {"rows_written": 0, "batches": 0, "write_errors": 0, "rows_dropped": 0}
+
+    def record(self, token_id: int):
+        self._pending.append({"token_id": token_id, "now": datetime.datetime.now()})
+        if len(self._pending) > self.max_pending:
+            self._pending.pop(0)
+            self._metrics["rows_dropped"] += 1
+        self._ensure_task()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def _write(self, rows):
+        async with self.session_factory() as db:
+            await db.execute(
+                text("INSERT INTO ai_requests (token_id, created_at) VALUES (:token_id, :now)"),
+                rows
+            )
+            await db.commit()
+
+    async def flush(self):
+        while self._pending:
+            rows = self._pending[:self.batch_size]
+            del self._pending[:len(rows)]
+            try:
+                await self._write(rows)
+            except Exception:
+                # Put the batch back and retry on the next cycle
+                self._pending[:0] = rows
+                self._metrics["write_errors"] += 1
+                return
+            except BaseException:
+                # Cancelled mid-write (e.g. by close()): keep the batch for the next flush
+                self._pending[:0] = rows
+                raise
+            self._metrics["rows_written"] += len(rows)
+            self._metrics["batches"] += 1
+
+    async def close(self):
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            # Let a write in progress unwind and hand its batch back before the final flush
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {**self._metrics, "pending": len(self._pending)}
+
+
+def _upsert_daily(dialect: str) -> str:
+    if dialect == "mysql":
+        return (
+            "INSERT INTO ai_requests_daily (token_id, day, requests) VALUES (:token_id, :day, :requests) "
+            "ON DUPLICATE KEY UPDATE requests = requests + VALUES(requests)"
+        )
+    return (
+        "INSERT INTO ai_requests_daily (token_id, day, requests) VALUES (:token_id, :day, :requests) "
+        "ON CONFLICT (token_id, day) DO UPDATE SET requests = requests + excluded.requests"
+    )
+
+
+async def rollup_ai_requests(session_factory, retention_days: int) -> dict:
+    """
+    Moves ai_requests rows older than `retention_days` into daily counts in
+    ai_requests_daily (created if missing) within one transaction.
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=retention_days)
+    async with session_factory() as db:
+        await db.execute(text(
+            "CREATE TABLE IF NOT EXISTS ai_requests_daily ("
+            "token_id INT NOT NULL, day DATE NOT NULL, requests INT NOT NULL, "
+            "PRIMARY KEY (token_id, day))"
+        ))
+        rows = (await db.execute(
+            text(
+                "SELECT token_id, DATE(created_at) AS day, COUNT(*) FROM ai_requests "
+                "WHERE created_at < :cutoff GROUP BY token_id, DATE(created_at)"
+            ),
+            {"cutoff": cutoff}
+        )).fetchall()
+        if rows:
+            await db.execute(
+                text(_upsert_daily(db.bind.dialect.name)),
+                [{"token_id": r[0], "day": r[1], "requests": r[2]} for r in rows]
+            )
+        deleted = (await db.execute(
+            text("DELETE FROM ai_requests WHERE created_at < :cutoff"),
+            {"cutoff": cutoff}
+        )).rowcount
+        await db.commit()
+    return {"days_rolled_up": len(rows), "rows_deleted": deleted}
+
+
+audit_writer = AuditWriter(SessionLocal, settings.audit_batch_size, settings.audit_flush_seconds)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rollup"]:
+        print("Uso: python -m app.services.audit_log rollup")
+        sys.exit(1)
+    start = time.perf_counter()
+    result = asyncio.run(rollup_ai_requests(SessionLocal, settings.audit_retention_days))
+    print(
+        f"Consolidados {result['rows_deleted']} registros en {result['days_rolled_up']} filas diarias "
+        f"({time.perf_counter() - start:.1f}s)"
+    )
@@ -1,45 +1,85 @@
 import secrets
-import datetime
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
+from app.config import settings
+from app.services.audit_log import audit_writer
+from app.services.cache import TTLCache
+from app.services.executor import run_blocking
+from app.services.rate_limiter import rate_limiter
+
+# token -> principal dict, and DNI -> token. Unknown tokens and DNIs are kept
+# apart in short-lived caches so a flood of bad guesses cannot evict the
+# entries of real users.
+principal_cache = TTLCache(maxsize=settings.auth_cache_size, ttl=settings.auth_cache_ttl_seconds)
+user_token_cache = TTLCache(maxsize=settings.auth_cache_size, ttl=settings.auth_cache_ttl_seconds)
+invalid_token_cache = TTLCache(maxsize=settings.auth_cache_size, ttl=settings.auth_negative_cache_ttl_seconds)
+unknown_dni_cache = TTLCache(maxsize=settings.auth_cache_size, ttl=settings.auth_negative_cache_ttl_seconds)
+
+
+def _unknown_dni():
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="No se encontró un usuario con ese DNI"
+    )
+
+
+def _invalid_token():
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid authentication token"
+    )
 
 
-def create_user_token(db: Session, full_name: str, dni: str) -> str:
-    result = db.execute(
+async def create_user_token(db: AsyncSession, full_name: str, dni: str) -> str:
+    token = user_token_cache.get(dni)
+    if token is not None:
+        return token
+    if unknown_dni_cache.get(dni):
+        raise _unknown_dni()
+
+    generation = user_token_cache.generation
+    result = await db.execute(
         text("SELECT id FROM User WHERE dni = :dni"),
         {"dni": dni}
     )
     user = result.fetchone()
 
     if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No se encontró un usuario con ese DNI"
-        )
+        unknown_dni_cache.set(dni, True)
+        raise _unknown_dni()
 
     user_id = user[0]
 
-    result = db.execute(
+    result = await db.execute(
         text("SELECT token FROM ai_tokens WHERE user_id = :user_id"),
         {"user_id": user_id}
     )
     existing = result.fetchone()
 
     if existing:
+        user_token_cache.set(dni, existing[0], generation=generation)
         return existing[0]
 
     token = secrets.token_hex(16)
-    db.execute(
+    await db.execute(
         text("INSERT INTO ai_tokens (user_id, token) VALUES (:user_id, :token)"),
         {"user_id": user_id, "token": token}
     )
-    db.commit()
+    await db.commit()
+    user_token_cache.set(dni, token, generation=generation)
     return token
 
 
-def verify_token(db: Session, token: str):
-    result = db.execute(
+async def verify_token(db: AsyncSession, token: str):
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return dict(principal)
+    if invalid_token_cache.get(token):
+        raise _invalid_token()
+
+    generation = principal_cache.generation
+    result = await db.execute(
         text("""
             SELECT ai_tokens.id, ai_tokens.user_id, User.firstName, User.lastName, User.dni, User.email
             FROM ai_tokens
@@ -51,12 +91,10 @@ def verify_token(db: Session, token: str):
     row = result.fetchone()
 
     if not row:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication token"
-        )
+        invalid_token_cache.set(token, True)
+        raise _invalid_token()
 
-    return {
+    principal = {
         "token_id": row[0],
         "user_id": row[1],
         "firstName": row[2],
@@ -64,25 +102,59 @@ def verify_token(db: Session, token: str):
         "dni": row[4],
         "email": row[5]
     }
+    principal_cache.set(token, principal, generation=generation)
+    return dict(principal)
+
+
+def invalidate_auth_cache(token: str = None):
+    """
+    Forgets a revoked or reissued token, or every cached entry when `token`
+    is None. Only this process is affected; other workers drop their copy
+    when the TTL expires.
+    """
+    if token is None:
+        principal_cache.invalidate()
+        invalid_token_cache.invalidate()
+        user_token_cache.invalidate()
+        unknown_dni_cache.invalidate()
+        return
+    principal_cache.pop(token)
+    invalid_token_cache.pop(token)
+    # The DNI cache is keyed the other way round; it is cheap to refill
+    user_token_cache.invalidate()
+
+
+def auth_cache_stats() -> dict:
+    return {
+        "principals": principal_cache.stats(),
+        "user_tokens": user_token_cache.stats(),
+        "rejected_tokens": invalid_token_cache.stats(),
+        "unknown_dnis": unknown_dni_cache.stats()
+    }
 
 
-def check_rate_limit(db: Session, token_id: int):
-    one_hour_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
+def _describe_window(seconds: int) -> str:
+    if seconds == 3600:
+        return "hour"
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600} hours"
+    if seconds % 60 == 0:
+        return f"{seconds // 60} minutes"
+    return f"{seconds} seconds"
 
-    result = db.execute(
-        text("SELECT COUNT(*) FROM ai_requests WHERE token_id = :token_id AND created_at > :since"),
-        {"token_id": token_id, "since": one_hour_ago}
-    )
-    count = result.scalar()
 
-    if count >= 5:
+async def check_rate_limit(token_id: int):
+    # The shared backend touches a SQLite file, so keep it off the event loop
+    if rate_limiter.shared:
+        allowed = await run_blocking(rate_limiter.hit, token_id)
+    else:
+        allowed = rate_limiter.hit(token_id)
+    if not allowed:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="Rate limit exceeded. Maximum 5 requests per hour."
+            detail=(
+                f"Rate limit exceeded. Maximum {rate_limiter.limit} requests "
+                f"per {_describe_window(int(rate_limiter.window))}."
+            )
         )
-
-    db.execute(
-        text("INSERT INTO ai_requests (token_id, created_at) VALUES (:token_id, :now)"),
-        {"token_id": token_id, "now": datetime.datetime.now()}
-    )
-    db.commit()
+    audit_writer.record(token_id)
@@ -0,0 +1,150 @@
+import logging
+import threading
+from typing import List
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; the LLM's tokenizer is not available in-process."""
+    return int(len(text) / settings.context_chars_per_token + 0.5)
+
+
+class _Segment:
+    """A run of text from one page, built from one or more overlapping chunks."""
+
+    def __init__(self, chunk, rank: int):
+        self.text = chunk.page_content
+        self.start = chunk.metadata.get("start_index")
+        self.rank = rank
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+    def absorb(self, chunk, rank: int) -> bool:
+        """Appends `chunk` if it overlaps or touches this segment; False if there is a gap."""
+        start = chunk.metadata["start_index"]
+        if start > self.end:
+            return False
+        overlap = self.end - start
+        text = chunk.page_content
+        if overlap >= len(text):
+            # Fully contained in what we already have
+            self.rank = min(self.rank, rank)
+            return True
+        if overlap and self.text[-overlap:] != text[:overlap]:
+            # Offsets disagree with the text (e.g. different revisions): keep both
+            return False
+        self.text += text[overlap:]
+        self.rank = min(self.rank, rank)
+        return True
+
+
+def _merge(chunks) -> List[_Segment]:
+    """
+    Groups chunks by page, sorts them by start_index and joins neighbours,
+    dropping the text repeated by chunk_overlap. start_index is relative to
+    the page because pages are split one at a time during ingestion. Chunks
+    without position metadata are kept as they are.
+    """
+    pages = {}
+    segments = []
+    seen = set()
+    for rank, chunk in enumerate(chunks):
+        metadata = chunk.metadata or {}
+        if metadata.get("start_index") is None:
+            if chunk.page_content not in seen:
+                seen.add(chunk.page_content)
+                segments.append(_Segment(chunk, rank))
+            continue
+        key = (metadata.get("source"), metadata.get("topic"), metadata.get("page"))
+        pages.setdefault(key, []).append((rank, chunk))
+
+    for members in pages.values():
+        members.sort(key=lambda pair: pair[1].metadata["start_index"])
+        current = None
+        for rank, chunk in members:
+            if current is None or not current.absorb(chunk, rank):
+                current = _Segment(chunk, rank)
+                segments.append(current)
+
+    # Most relevant first: a merged segment ranks as its best chunk
+    segments.sort(key=lambda segment: segment.rank)
+    return segments
+
+
+def merge_chunks(chunks) -> str:
+    """Joins chunks with overlaps removed, in the order given; no budget and no stats."""
+    return "\n\n".join(segment.text for segment in _merge(chunks))
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    limit = int(max_tokens * settings.context_chars_per_token)
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit]
+
+
+class ContextStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {"contexts": 0, "chunks": 0, "segments": 0, "tokens_in": 0, "tokens_out": 0, "truncated": 0}
+
+    def record(self, chunks: int, segments: int, tokens_in: int, tokens_out: int, truncated: bool):
+        with self._lock:
+            self._metrics["contexts"] += 1
+            self._metrics["chunks"] += chunks
+            self._metrics["segments"] += segments
+            self._metrics["tokens_in"] += tokens_in
+            self._metrics["tokens_out"] += tokens_out
+            self._metrics["truncated"] += int(truncated)
+
+    def stats(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["tokens_saved"] = metrics["tokens_in"] - metrics["tokens_out"]
+        metrics["saved_ratio"] = round(metrics["tokens_saved"] / metrics["tokens_in"], 4) if metrics["tokens_in"] else 0.0
+        return metrics
+
+
+context_stats = ContextStats()
+
+
+def build_context(chunks, max_tokens: int = 0, label: str = "context") -> str:
+    """
+    Builds the prompt context from retrieved chunks, which are assumed to be
+    in relevance order. Overlapping chunks of the same page are merged, the
+    result is ordered by relevance and cut at `max_tokens` (0 = no limit):
+    whole segments are added while they fit and the first one that does not
+    is truncated at a word boundary.
+    """
+    chunks = list(chunks)
+    tokens_in = estimate_tokens("\n\n".join(c.page_content for c in chunks))
+    segments = _merge(chunks)
+
+    parts, used, truncated = [], 0, False
+    for segment in segments:
+        # Two tokens roughly account for the separator
+        cost = estimate_tokens(segment.text) + (2 if parts else 0)
+        if max_tokens and used + cost > max_tokens:
+            remaining = max_tokens - used - (2 if parts else 0)
+            if remaining > 0:
+                parts.append(_truncate(segment.text, remaining))
+            truncated = True
+            break
+        parts.append(segment.text)
+        used += cost
+
+    context = "\n\n".join(parts)
+    tokens_out = estimate_tokens(context)
+    context_stats.record(len(chunks), len(segments), tokens_in, tokens_out, truncated)
+    logger.info(
+        "%s: %d chunks -> %d segments, ~%d -> ~%d tokens (%d saved%s)",
+        label, len(chunks), len(segments), tokens_in, tokens_out,
+        tokens_in - tokens_out, ", truncated" if truncated else ""
+    )
+    return context
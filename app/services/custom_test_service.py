@@ -1,8 +1,19 @@
-from typing import List, Optional
-from pydantic import BaseModel, Field
+import asyncio
+import logging
+import re
+import unicodedata
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field, ValidationError
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from app.config import settings
+from app.services.cache import TTLCache
+from app.services.context_builder import build_context
+from app.services.executor import run_blocking, run_llm, stream_llm_items
+from app.services.llm_provider import get_shared_llm
+from app.services.rag_service import asearch_in_vector_db, on_topic_invalidated, topic_catalog
+
+logger = logging.getLogger(__name__)
 
 class CustomQuestionSchema(BaseModel):
     pregunta: str = Field(description="El enunciado de la pregunta de test")
@@ -13,52 +24,439 @@ class CustomQuestionSchema(BaseModel):
     dificultad: str = Field(description="Nivel de dificultad estimado: bajo, medio, alto")
 
 class CustomTestSchema(BaseModel):
-    preguntas: List[CustomQuestionSchema] = Field(description="Lista de 10 preguntas generadas")
+    preguntas: List[CustomQuestionSchema] = Field(description="Lista de preguntas generadas")
 
 def get_independent_llm():
-    if settings.llm_provider == "groq":
-        from langchain_groq import ChatGroq
-        return ChatGroq(
-            model=settings.groq_model,
-            api_key=settings.groq_api_key,
-            temperature=settings.llm_temperature
-        )
-    from langchain_ollama import ChatOllama
-    return ChatOllama(
-        model=settings.llm_model,
-        format="json",
-        temperature=settings.llm_temperature
-    )
-
-def generate_custom_test(student_profile: dict) -> dict:
-    llm = get_independent_llm()
-    parser = JsonOutputParser(pydantic_object=CustomTestSchema)
-    
-    prompt = ChatPromptTemplate.from_template(
-        """Eres un experto examinador de autoescuela en España.
-        Genera un test personalizado de EXACTAMENTE 10 preguntas para el carnet B.
-        
+    return get_shared_llm(json_mode=True)
+
+
+custom_test_parser = JsonOutputParser(pydantic_object=CustomTestSchema)
+
+CUSTOM_TEST_PROMPT = ChatPromptTemplate.from_template(
+    """Eres un experto examinador de autoescuela en España.
+        Genera EXACTAMENTE {count} preguntas de test para el carnet B sobre el tema "{topic}".
+
         PERFIL DEL ALUMNO:
         {profile}
-        
+
+        CONTEXTO (Manual de la DGT):
+        {context}
+
         INSTRUCCIONES:
-        1. Genera 10 preguntas únicas.
-        2. Céntrate en los temas donde el alumno tiene más fallos si se indican.
-        3. Si falta información, asume un perfil medio y genera un test equilibrado.
-        4. Opciones claras y concisas.
+        1. Basa cada pregunta en el contexto anterior; si no hay contexto, usa el temario oficial del carnet B.
+        2. Reparto de dificultad: {difficulty_plan}.
+        3. Preguntas únicas, sin repetir conceptos. Opciones claras y concisas.
+        4. El campo 'tema' es "{topic}" y 'dificultad' es uno de: bajo, medio, alto.
         5. Formato estrictamente JSON.
-        6. Incluye el campo 'tema' y 'dificultad' para cada pregunta.
-        
+
         {format_instructions}"""
-    )
-    
-    profile_str = str(student_profile)
-    
-    chain = prompt | llm | parser
-    
-    response = chain.invoke({
-        "profile": profile_str,
-        "format_instructions": parser.get_format_instructions()
-    })
-    
+).partial(format_instructions=custom_test_parser.get_format_instructions())
+
+LEVELS = ("bajo", "medio", "alto")
+LEVEL_ALIASES = {
+    "bajo": "bajo", "baja": "bajo", "facil": "bajo", "sencillo": "bajo", "low": "bajo", "easy": "bajo",
+    "medio": "medio", "media": "medio", "intermedio": "medio", "normal": "medio", "medium": "medio",
+    "alto": "alto", "alta": "alto", "dificil": "alto", "avanzado": "alto", "high": "alto", "hard": "alto"
+}
+
+
+def _normalize(text) -> str:
+    ascii_text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "_", ascii_text.lower()).strip("_")
+
+
+def normalize_difficulty(value) -> str:
+    return LEVEL_ALIASES.get(_normalize(value).split("_")[0], "medio")
+
+
+# Profile keys are free-form; these fragments identify what a value means
+WEAK_LIST_HINTS = ("debil", "weak", "reforzar", "mejorar")
+TOPIC_HINTS = ("tema", "topic")
+ERROR_KEYS = ("fallos", "errores", "errors", "mistakes", "incorrectas", "wrong")
+CORRECT_KEYS = ("aciertos", "correctas", "correct", "right")
+ERROR_RATE_KEYS = ("porcentaje_fallos", "tasa_fallos", "tasa_error", "error_rate")
+SCORE_KEYS = ("porcentaje_aciertos", "tasa_aciertos", "accuracy", "score", "nota")
+NAME_KEYS = ("tema", "topic", "nombre", "name")
+
+
+def _number(stats: dict, keys) -> Optional[float]:
+    for key in keys:
+        value = stats.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    return None
+
+
+def _topic_weight(value) -> Optional[float]:
+    """How weak the student is on one topic, from a count of errors or a dict of stats."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, dict):
+        return None
+    stats = {_normalize(k): v for k, v in value.items()}
+    errors = _number(stats, ERROR_KEYS)
+    correct = _number(stats, CORRECT_KEYS)
+    if errors is not None and correct is not None:
+        return errors / (errors + correct) if errors + correct else 0.0
+    rate = _number(stats, ERROR_RATE_KEYS)
+    if rate is not None:
+        return rate / 100 if rate > 1 else rate
+    score = _number(stats, SCORE_KEYS)
+    if score is not None:
+        # Percentages, or marks out of 10
+        scale = 100 if score > 10 else 10 if score > 1 else 1
+        return 1 - score / scale
+    return errors
+
+
+def _named_items(items):
+    """(topic, value) pairs from a list of names or of dicts carrying a name."""
+    for item in items:
+        if isinstance(item, str):
+            yield item, 1.0
+        elif isinstance(item, dict):
+            stats = {_normalize(k): v for k, v in item.items()}
+            name = next((stats[k] for k in NAME_KEYS if isinstance(stats.get(k), str)), None)
+            if name:
+                yield name, item
+
+
+def parse_weak_topics(profile: dict, max_topics: int = None) -> Dict[str, float]:
+    """
+    Reads the weak topics of a free-form student profile as {topic: weight},
+    weights adding up to 1, heaviest first. Understands lists of weak topics
+    ({"temas_debiles": ["señales", ...]}), error counts per topic
+    ({"fallos_por_tema": {"señales": 5}}) and per-topic stats with
+    errors/correct answers, error rates or scores ({"temas": {"señales":
+    {"aciertos": 8, "fallos": 2}}} or a list of {"tema": ..., ...}).
+    Returns {} when the profile says nothing about topics.
+    """
+    weights = {}
+    for key, value in (profile or {}).items():
+        key = _normalize(key)
+        is_weak_list = any(hint in key for hint in WEAK_LIST_HINTS)
+        if not is_weak_list and not any(hint in key for hint in TOPIC_HINTS):
+            continue
+        if isinstance(value, str):
+            pairs = [(name.strip(), 1.0) for name in value.split(",")]
+        elif isinstance(value, dict):
+            pairs = list(value.items())
+        elif isinstance(value, list):
+            pairs = list(_named_items(value))
+        else:
+            continue
+        for topic, raw in pairs:
+            weight = _topic_weight(raw)
+            if weight is None and is_weak_list:
+                weight = 1.0
+            if weight and weight > 0 and str(topic).strip():
+                topic = str(topic).strip()
+                weights[topic] = weights.get(topic, 0.0) + weight
+
+    ranked = sorted(weights.items(), key=lambda pair: -pair[1])[:max_topics]
+    total = sum(weight for _, weight in ranked)
+    return {topic: weight / total for topic, weight in ranked} if total else {}
+
+
+def allocate(weights: Dict[str, float], count: int) -> Dict[str, int]:
+    """Splits `count` by weight (largest remainder), at least one each while there are enough."""
+    topics = list(weights)[:count]
+    shares = {topic: 1 for topic in topics}
+    remaining = count - len(topics)
+    exact = {topic: weights[topic] * remaining for topic in topics}
+    for topic in topics:
+        shares[topic] += int(exact[topic])
+    leftover = count - sum(shares.values())
+    for topic in sorted(topics, key=lambda t: exact[t] - int(exact[t]), reverse=True)[:leftover]:
+        shares[topic] += 1
+    return shares
+
+
+def difficulty_sequence(count: int) -> List[str]:
+    """`count` levels following custom_test_difficulty_mix, interleaved so any slice is mixed."""
+    mix = {}
+    for part in settings.custom_test_difficulty_mix.split(","):
+        level, _, weight = part.partition(":")
+        mix[normalize_difficulty(level)] = float(weight or 1)
+    targets = allocate({level: mix.get(level, 0) / sum(mix.values()) for level in LEVELS if mix.get(level)}, count)
+    # Round-robin starting with the most common level
+    order = sorted(targets, key=lambda level: -targets[level])
+    sequence = []
+    while len(sequence) < count:
+        for level in order:
+            if targets[level] > 0:
+                targets[level] -= 1
+                sequence.append(level)
+    return sequence
+
+
+class Shard(BaseModel):
+    topic: str
+    catalog_topic: Optional[str] = None
+    weight: float
+    # False when the profile had no usable topics and the test is a balanced one
+    weak: bool = True
+    count: int
+    levels: List[str]
+
+
+async def plan_shards(student_profile: dict, count: int) -> List[Shard]:
+    """
+    Turns the profile into generation shards of at most custom_test_shard_size
+    questions. Weak topics are matched to the topics of the vector DB; with
+    no usable profile the test is spread evenly over the catalog topics.
+    """
+    catalog = await run_blocking(topic_catalog.topics)
+    weights = parse_weak_topics(student_profile, settings.custom_test_max_topics)
+    weak = bool(weights)
+    if not weights:
+        # No profile: a balanced test over the topics with the most material
+        biggest = sorted(catalog, key=lambda t: -catalog[t].get("chunks", 0))[:settings.custom_test_max_topics]
+        weights = {topic: 1 / len(biggest) for topic in biggest} or {"general": 1.0}
+
+    by_name = {_normalize(topic): topic for topic in catalog}
+    levels = difficulty_sequence(count)
+    shards = []
+    for topic, share in allocate(weights, count).items():
+        key = _normalize(topic)
+        # Exact match after normalizing, else a catalog topic containing the name (or the other way round)
+        catalog_topic = by_name.get(key) or next(
+            (name for norm, name in by_name.items() if key and (key in norm or norm in key)), None
+        )
+        for start in range(0, share, settings.custom_test_shard_size):
+            size = min(settings.custom_test_shard_size, share - start)
+            shards.append(Shard(
+                topic=topic, catalog_topic=catalog_topic, weight=weights[topic],
+                weak=weak, count=size, levels=levels[:size]
+            ))
+            levels = levels[size:]
+    return shards
+
+
+# Assembled context per topic, shared by every student; dropped when the topic changes
+context_cache = TTLCache(maxsize=settings.custom_test_context_cache_size, ttl=settings.custom_test_context_ttl_seconds)
+
+
+@on_topic_invalidated
+def _invalidate_context(topic: str = None):
+    if topic is None:
+        context_cache.invalidate()
+    else:
+        # Unmatched topics search every topic, so they may include this one too
+        context_cache.invalidate(lambda key: key[0] is None or key[0] == topic)
+
+
+async def topic_context(shard: Shard) -> str:
+    """Manual excerpts for a shard: its catalog topic, or a cross-topic search for unmatched names."""
+    key = (shard.catalog_topic, None if shard.catalog_topic else shard.topic)
+    cached = context_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = context_cache.generation
+    query = f"{shard.topic}: normas, cifras y excepciones"
+    chunks = await asearch_in_vector_db(query=query, topic=shard.catalog_topic, k=settings.custom_test_context_k)
+    context = build_context(chunks, settings.context_budget_question, "custom_test")
+    context_cache.set(key, context, generation=generation)
+    return context
+
+
+def _build_custom_chain(shard: Shard, context: str):
+    counts = {level: shard.levels.count(level) for level in LEVELS if level in shard.levels}
+    if shard.weak:
+        profile = f"Punto débil del alumno: {shard.topic} ({shard.weight:.0%} de sus fallos)."
+    else:
+        profile = "Sin datos del alumno: asume un perfil medio."
+    chain = CUSTOM_TEST_PROMPT | get_independent_llm() | custom_test_parser
+    inputs = {
+        "topic": shard.topic,
+        "profile": profile,
+        "context": context or "(sin contexto)",
+        "count": shard.count,
+        "difficulty_plan": ", ".join(f"{n} de dificultad {level}" for level, n in counts.items())
+    }
+    return chain, inputs
+
+
+def _validate(item, shard: Shard):
+    try:
+        question = CustomQuestionSchema.model_validate(item).model_dump()
+    except ValidationError:
+        return None
+    question["dificultad"] = normalize_difficulty(question["dificultad"])
+    question["tema"] = question["tema"] or shard.topic
+    return question
+
+
+def _pick(questions: list, shard: Shard) -> list:
+    """Keeps `shard.count` questions, preferring the difficulty levels the shard was asked for."""
+    wanted = list(shard.levels)
+    picked, rest = [], []
+    for question in questions:
+        if question["dificultad"] in wanted:
+            wanted.remove(question["dificultad"])
+            picked.append(question)
+        else:
+            rest.append(question)
+    return (picked + rest)[:shard.count]
+
+
+def _remaining(shard: Shard, questions: list) -> Shard:
+    """What is still missing from `shard`: its outstanding count and the difficulty levels not yet covered."""
+    levels = list(shard.levels)
+    for question in questions:
+        if question["dificultad"] in levels:
+            levels.remove(question["dificultad"])
+    count = shard.count - len(questions)
+    return shard.model_copy(update={"count": count, "levels": levels[:count]})
+
+
+async def _generate_shard(shard: Shard, limiter: asyncio.Semaphore) -> list:
+    """
+    Up to `shard.count` questions. A short or failed answer is topped up by
+    asking again for just the missing questions and levels, up to
+    custom_test_shard_retries times; raises only if nothing valid came back.
+    """
+    context = await topic_context(shard)
+    questions = []
+    last_error = None
+    for _ in range(settings.custom_test_shard_retries + 1):
+        pending = _remaining(shard, questions)
+        chain, inputs = _build_custom_chain(pending, context)
+        try:
+            async with limiter:
+                response = await run_llm(chain, inputs)
+            items = response.get("preguntas", []) if isinstance(response, dict) else response
+            valid = [q for q in (_validate(item, pending) for item in items or []) if q]
+            if valid:
+                questions.extend(_pick(valid, pending))
+            else:
+                last_error = ValueError("El modelo no devolvió preguntas válidas")
+        except Exception as e:
+            last_error = e
+        if len(questions) >= shard.count:
+            return questions
+    if not questions:
+        raise last_error
+    return questions
+
+
+def balance_by_difficulty(questions: list) -> list:
+    """Orders the test from easy to hard, alternating topics within each level."""
+    ordered = []
+    for level in LEVELS:
+        by_topic = {}
+        for question in questions:
+            if question["dificultad"] == level:
+                by_topic.setdefault(question["tema"], []).append(question)
+        queues = list(by_topic.values())
+        while any(queues):
+            for queue in queues:
+                if queue:
+                    ordered.append(queue.pop(0))
+    return ordered
+
+
+async def generate_custom_test(student_profile: dict, count: int = 10) -> dict:
+    """
+    Generates the test in shards running concurrently: each weak topic gets
+    a share of the questions proportional to its weight, grounded on that
+    topic's manual excerpts. A failed shard only loses its own questions;
+    questions a shard could not produce are listed in `failed_shards`.
+    """
+    shards = await plan_shards(student_profile, count)
+    limiter = asyncio.Semaphore(settings.custom_test_concurrency)
+    results = await asyncio.gather(*[_generate_shard(s, limiter) for s in shards], return_exceptions=True)
+
+    questions, failed = [], []
+    for shard, result in zip(shards, results):
+        if isinstance(result, Exception):
+            failed.append({"tema": shard.topic, "questions": shard.count, "error": str(result)})
+            continue
+        questions.extend(result)
+        if len(result) < shard.count:
+            failed.append({
+                "tema": shard.topic,
+                "questions": shard.count - len(result),
+                "error": "El modelo devolvió menos preguntas válidas de las pedidas"
+            })
+    if not questions:
+        raise RuntimeError(f"Error generando el test: {failed[0]['error']}")
+
+    response = {
+        "preguntas": balance_by_difficulty(questions),
+        "temas": [
+            {"tema": topic, "peso": round(weight, 3), "preguntas": sum(s.count for s in shards if s.topic == topic)}
+            for topic, weight in dict((s.topic, s.weight) for s in shards).items()
+        ]
+    }
+    if failed:
+        response["failed_shards"] = failed
     return response
+
+
+async def stream_custom_test(student_profile: dict, count: int = 10):
+    """
+    Yields valid CustomQuestionSchema dicts as the shards generate them.
+    Invalid questions are dropped and regenerated one at a time, giving up
+    after stream_max_regenerations failed attempts.
+    """
+    shards = await plan_shards(student_profile, count)
+    queue = asyncio.Queue()
+    limiter = asyncio.Semaphore(settings.custom_test_concurrency)
+    produced = {id(shard): [] for shard in shards}
+
+    async def run_shard(shard):
+        try:
+            context = await topic_context(shard)
+            chain, inputs = _build_custom_chain(shard, context)
+            async with limiter:
+                async for item in stream_llm_items(chain, inputs, CustomQuestionSchema):
+                    await queue.put((shard, item))
+        except Exception:
+            # Its questions are regenerated below
+            logger.warning("Custom test shard %r failed", shard.topic, exc_info=True)
+        finally:
+            await queue.put((shard, StopAsyncIteration))
+
+    tasks = [asyncio.create_task(run_shard(shard)) for shard in shards]
+    valid = 0
+    try:
+        pending = len(tasks)
+        while pending:
+            shard, item = await queue.get()
+            if item is StopAsyncIteration:
+                pending -= 1
+                continue
+            question = _validate(item, shard) if item is not None else None
+            if question is not None and valid < count and len(produced[id(shard)]) < shard.count:
+                produced[id(shard)].append(question)
+                valid += 1
+                yield question
+
+        failures = 0
+        while valid < count and failures < settings.stream_max_regenerations:
+            # Top up the shard furthest from its share, at a difficulty level it is still missing
+            shard = max(shards, key=lambda s: s.count - len(produced[id(s)]))
+            question = await _regenerate_question(_remaining(shard, produced[id(shard)]))
+            if question is None:
+                failures += 1
+                continue
+            produced[id(shard)].append(question)
+            valid += 1
+            yield question
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _regenerate_question(shard: Shard):
+    """One question for what is left of a shard (see _remaining), at the first level it lacks."""
+    single = shard.model_copy(update={"count": 1, "levels": shard.levels[:1] or ["medio"]})
+    try:
+        questions = await _generate_shard(single, asyncio.Semaphore(1))
+        return questions[0]
+    except Exception:
+        logger.warning("Regenerating a question of %r failed", shard.topic, exc_info=True)
+        return None
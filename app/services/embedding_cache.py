@@ -0,0 +1,247 @@
+import hashlib
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.services.query_batcher import embed_queries
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no cross-process lock, which is fine for a single worker
+    fcntl = None
+
+# Index header: total writes, capacity, dimension
+HEADER_FIELDS = 3
+HEADER_BYTES = HEADER_FIELDS * 8
+
+
+class MemmapEmbeddingCache:
+    """
+    Persistent embedding cache shared by every worker process on the host.
+
+    Vectors live in a memory-mapped `<name>.vectors` array of `max_entries`
+    rows; `<name>.index` maps each row to the 16-byte digest of the text it
+    holds, after a header with the counter of total writes, the capacity and
+    the vector dimension. Files written with another capacity or dimension
+    are ignored and recreated on the next write, never reinterpreted. Rows
+    are reused in ring order once the cache is full, evicting the oldest
+    entries.
+
+    Each process keeps an in-memory digest -> row map and catches up with
+    rows written by other processes by comparing the shared counter with the
+    last one it saw. Writers take a file lock; a row's digest is cleared
+    while its vector is rewritten and readers check it before and after
+    copying, so a row being overwritten is read as a miss.
+    """
+
+    def __init__(self, directory: str, model_name: str, max_entries: int, dtype: str = "float16"):
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.model_name = model_name
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)
+        base = os.path.join(directory, f"{slug}.{self.dtype.name}")
+        self.vectors_path = f"{base}.vectors"
+        self.index_path = f"{base}.index"
+        self.lock_path = f"{base}.lock"
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._vectors = None
+        self._keys = None
+        self._counter = None
+        self._seen = 0
+        self._rows = {}
+        self._row_keys = {}
+        self._lock = threading.Lock()
+
+    def digest(self, kind: str, text: str) -> bytes:
+        """Cache key of a text; `kind` separates query and document embeddings."""
+        return hashlib.sha256(f"{self.model_name}\x00{kind}\x00{text}".encode("utf-8")).digest()[:16]
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open(self) -> bool:
+        if self._vectors is not None:
+            return True
+        dim = self._stored_dim()
+        if dim is None:
+            return False
+        self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r+", shape=(self.max_entries, dim))
+        self._counter = np.memmap(self.index_path, dtype=np.uint64, mode="r+", shape=(1,))
+        self._keys = np.memmap(self.index_path, dtype=np.uint8, mode="r+", offset=HEADER_BYTES, shape=(self.max_entries, 16))
+        return True
+
+    def _close(self):
+        self._vectors = self._keys = self._counter = None
+        self._seen = 0
+        self._rows.clear()
+        self._row_keys.clear()
+
+    def _stored_dim(self):
+        """Dimension recorded in the index header, or None if the files are missing or don't match the settings."""
+        try:
+            header = np.fromfile(self.index_path, dtype=np.uint64, count=HEADER_FIELDS)
+            index_size = os.path.getsize(self.index_path)
+            vectors_size = os.path.getsize(self.vectors_path)
+        except OSError:
+            return None
+        if len(header) < HEADER_FIELDS:
+            return None
+        capacity, dim = int(header[1]), int(header[2])
+        if (capacity != self.max_entries or not dim
+                or index_size != HEADER_BYTES + capacity * 16
+                or vectors_size != capacity * dim * self.dtype.itemsize):
+            # Another capacity or an older layout
+            return None
+        return dim
+
+    def _create(self, dim: int):
+        # Written under temporary names so other processes never see half-created files;
+        # the index appears last and signals that the cache is ready
+        for path, size in ((self.vectors_path, self.max_entries * dim * self.dtype.itemsize),
+                           (self.index_path, HEADER_BYTES + self.max_entries * 16)):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.truncate(size)
+                if path == self.index_path:
+                    f.seek(0)
+                    f.write(np.array([0, self.max_entries, dim], dtype=np.uint64).tobytes())
+            os.replace(tmp_path, path)
+
+    def _sync(self):
+        """Picks up rows written by any process since the last sync."""
+        if not self._open():
+            return
+        total = int(self._counter[0])
+        if total == self._seen:
+            return
+        if total - self._seen >= self.max_entries:
+            self._rows.clear()
+            self._row_keys.clear()
+            start = max(total - self.max_entries, 0)
+        else:
+            start = self._seen
+        for position in range(start, total):
+            row = position % self.max_entries
+            previous = self._row_keys.get(row)
+            if previous is not None and self._rows.get(previous) == row:
+                del self._rows[previous]
+            key = self._keys[row].tobytes()
+            self._rows[key] = row
+            self._row_keys[row] = key
+        self._seen = total
+
+    def _read(self, key: bytes):
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        if self._keys[row].tobytes() == key:
+            vector = np.array(self._vectors[row], dtype=np.float32)
+            if self._keys[row].tobytes() == key:
+                return vector.tolist()
+        # The row was reused for another text
+        del self._rows[key]
+        return None
+
+    def get_many(self, keys: List[bytes]) -> dict:
+        """Returns {key: vector} for the keys that are cached."""
+        found = {}
+        with self._lock:
+            self._sync()
+            for key in keys:
+                vector = self._read(key) if self._vectors is not None else None
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    found[key] = vector
+        return found
+
+    def put_many(self, items: dict):
+        """Stores {key: vector}, evicting the oldest rows when full."""
+        if not items:
+            return
+        with self._lock, self._file_lock():
+            dim = len(next(iter(items.values())))
+            if not self._open() or self._vectors.shape[1] != dim:
+                # Missing, or written with another capacity or dimension: start over
+                self._close()
+                self._create(dim)
+                self._open()
+            self._sync()
+            empty = np.zeros(16, dtype=np.uint8)
+            total = int(self._counter[0])
+            for key, vector in items.items():
+                if key in self._rows and self._read(key) is not None:
+                    continue
+                row = total % self.max_entries
+                if total >= self.max_entries:
+                    self.evictions += 1
+                self._keys[row] = empty
+                self._vectors[row] = np.asarray(vector, dtype=self.dtype)
+                self._keys[row] = np.frombuffer(key, dtype=np.uint8)
+                total += 1
+                self._counter[0] = total
+            self._vectors.flush()
+            self._keys.flush()
+            self._sync()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": min(self._seen, self.max_entries),
+            "capacity": self.max_entries,
+            "dtype": self.dtype.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only runs the model for texts missing from the cache."""
+
+    def __init__(self, embeddings: Embeddings, cache: MemmapEmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def _embed(self, kind: str, texts: List[str], compute, store: bool = True) -> List[List[float]]:
+        keys = [self.cache.digest(kind, text) for text in texts]
+        found = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            computed = dict(zip(missing, compute(list(missing.values()))))
+            if store:
+                self.cache.put_many(computed)
+            found.update(computed)
+        return [list(found[key]) for key in keys]
+
+    def embed_documents(self, texts: List[str], store: bool = True) -> List[List[float]]:
+        """`store=False` still reads the cache but keeps one-off texts out of it."""
+        return self._embed("doc", texts, self.embeddings.embed_documents, store=store)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("query", texts, lambda missing: embed_queries(self.embeddings, missing))
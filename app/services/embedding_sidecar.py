@@ -0,0 +1,194 @@
+"""
+Local embedding service shared by every uvicorn worker.
+
+The sidecar loads the embedding model once and serves it over a Unix
+socket; workers started with EMBEDDING_SIDECAR_SOCKET use SidecarEmbeddings
+instead of loading their own copy. Requests that arrive while the model is
+busy are encoded together in the next call, so single-query encodes from
+many workers share one forward pass.
+
+Protocol, per request on a persistent connection:
+    -> uint32 length + JSON {"kind": "query" | "documents", "texts": [...]}
+    <- uint32 rows + uint32 dim + rows * dim float32
+       (rows = 0xFFFFFFFF on error, followed by `dim` bytes of message)
+
+Usage:
+    python -m app.services.embedding_sidecar [--socket PATH]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from app.config import settings
+from app.services.query_batcher import embed_queries
+
+HEADER = struct.Struct("!I")
+SHAPE = struct.Struct("!II")
+ERROR_ROWS = 0xFFFFFFFF
+
+
+def _encode(embeddings: Embeddings, kind: str, texts: List[str]) -> np.ndarray:
+    if kind == "query":
+        vectors = embed_queries(embeddings, texts)
+    else:
+        vectors = embeddings.embed_documents(texts)
+    return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+
+class EmbeddingServer:
+    """Serves `embeddings` on a Unix socket, merging concurrent requests into batches."""
+
+    def __init__(self, embeddings: Embeddings, socket_path: str, max_batch: int = 256):
+        self.embeddings = embeddings
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        # One model, one thread: batching replaces parallel encodes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-sidecar")
+        self._queue = None
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][1])
+            while not self._queue.empty() and size < self.max_batch:
+                batch.append(self._queue.get_nowait())
+                size += len(batch[-1][1])
+
+            for kind in ("query", "documents"):
+                requests = [r for r in batch if r[0] == kind]
+                if not requests:
+                    continue
+                texts = [text for _, request_texts, _ in requests for text in request_texts]
+                try:
+                    vectors = await loop.run_in_executor(self._executor, _encode, self.embeddings, kind, texts)
+                except Exception as e:
+                    for _, _, future in requests:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                start = 0
+                for _, request_texts, future in requests:
+                    if not future.done():
+                        future.set_result(vectors[start:start + len(request_texts)])
+                    start += len(request_texts)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                except asyncio.IncompleteReadError:
+                    return
+                request = json.loads(await reader.readexactly(length))
+                future = loop.create_future()
+                await self._queue.put((request["kind"], request["texts"], future))
+                try:
+                    vectors = await future
+                    writer.write(SHAPE.pack(*vectors.shape) + vectors.astype("<f4", copy=False).tobytes())
+                except Exception as e:
+                    message = str(e).encode("utf-8")
+                    writer.write(SHAPE.pack(ERROR_ROWS, len(message)) + message)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, ready: threading.Event = None):
+        self._queue = asyncio.Queue()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        batcher = asyncio.create_task(self._batcher())
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+class SidecarEmbeddings(Embeddings):
+    """Embeddings client for the sidecar; one persistent connection per thread."""
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+            self._local.conn = conn
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _read(conn: socket.socket, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("El servicio de embeddings cerró la conexión")
+            data += chunk
+        return bytes(data)
+
+    def _request(self, kind: str, texts: List[str]) -> np.ndarray:
+        payload = json.dumps({"kind": kind, "texts": texts}).encode("utf-8")
+        # A worker may hold a connection from before a sidecar restart: retry once on a new one
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.sendall(HEADER.pack(len(payload)) + payload)
+                rows, dim = SHAPE.unpack(self._read(conn, SHAPE.size))
+                body = self._read(conn, dim if rows == ERROR_ROWS else rows * dim * 4)
+                break
+            except (ConnectionError, socket.timeout, OSError):
+                self._close()
+                if attempt:
+                    raise
+        if rows == ERROR_ROWS:
+            raise RuntimeError(f"Error del servicio de embeddings: {body.decode('utf-8')}")
+        return np.frombuffer(body, dtype="<f4").reshape(rows, dim)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._request("documents", list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._request("query", [text])[0].tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._request("query", list(texts)).tolist()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servicio local de embeddings compartido por los workers")
+    parser.add_argument("--socket", default=settings.embedding_sidecar_socket or "/tmp/testpilot-embeddings.sock")
+    args = parser.parse_args()
+
+    model = HuggingFaceEmbeddings(model_name=settings.embeddings_model)
+    server = EmbeddingServer(model, args.socket, settings.embedding_sidecar_max_batch)
+    print(f"Sirviendo {settings.embeddings_model} en {args.socket}")
+    asyncio.run(server.serve())
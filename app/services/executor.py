@@ -0,0 +1,105 @@
+import asyncio
+import multiprocessing
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from langchain_core.exceptions import OutputParserException
+from pydantic import ValidationError
+
+from app.config import settings
+
+
+# Bounded pool for blocking work (embeddings, Chroma, sync DB sessions)
+blocking_executor = ThreadPoolExecutor(
+    max_workers=settings.blocking_pool_size,
+    thread_name_prefix="blocking"
+)
+
+# CPU-bound PDF parsing runs in worker processes, started on first use
+_parse_pool = None
+
+
+def get_parse_pool():
+    """Returns the PDF parsing process pool, or None when parsing runs in-process."""
+    global _parse_pool
+    if _parse_pool is None and settings.pdf_parse_workers > 1:
+        # spawn: forking a process that holds the embedding model and its threads is unsafe
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=settings.pdf_parse_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _parse_pool
+
+
+# Process-wide cap on in-flight LLM calls, shared by every request
+llm_semaphore = asyncio.Semaphore(settings.llm_max_concurrency)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking call on the bounded pool so the event loop stays free."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, partial(func, *args, **kwargs))
+
+
+async def run_llm(chain, inputs: dict):
+    """Invokes a LangChain runnable through its async path under the global LLM limit."""
+    async with llm_semaphore:
+        return await chain.ainvoke(inputs)
+
+
+async def stream_llm(stream):
+    """
+    Iterates an LLM stream (e.g. chain.astream(...)) under the global LLM
+    limit. The slot is only held while waiting for the next chunk and is
+    released before each yield, so a slow consumer never keeps other
+    requests from reaching the model. Closing this generator closes `stream`.
+    """
+    try:
+        while True:
+            async with llm_semaphore:
+                try:
+                    chunk = await anext(stream)
+                except StopAsyncIteration:
+                    return
+            yield chunk
+    finally:
+        await stream.aclose()
+
+
+async def stream_llm_items(chain, inputs: dict, schema, key: str = "preguntas"):
+    """
+    Streams a chain ending in JsonOutputParser and yields each element of the
+    `key` list as soon as the model has moved past it. Valid elements are yielded
+    as dicts validated against `schema`; invalid ones are yielded as None so the
+    caller can drop or regenerate them without losing the rest.
+    """
+    emitted = 0
+    items = []
+
+    def validate(item):
+        try:
+            return schema.model_validate(item).model_dump()
+        except ValidationError:
+            return None
+
+    try:
+        async with aclosing(stream_llm(chain.astream(inputs))) as stream:
+            async for parsed in stream:
+                if isinstance(parsed, dict):
+                    items = parsed.get(key) or []
+                elif isinstance(parsed, list):
+                    items = parsed
+                # Every element but the last one being written is complete
+                while emitted < len(items) - 1:
+                    yield validate(items[emitted])
+                    emitted += 1
+    except OutputParserException:
+        # The output broke off inside the last element: report it as invalid
+        # instead of validating whatever prefix of it was parsed
+        if emitted < len(items):
+            yield None
+        return
+
+    while emitted < len(items):
+        yield validate(items[emitted])
+        emitted += 1
@@ -0,0 +1,35 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no cross-process lock, which is fine for a single worker
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive lock on `path` (a sidecar file, created if missing) shared by every process on the host."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def file_version(path: str):
+    """
+    (mtime in ns, inode, size) of `path`, or None if it does not exist. Files
+    replaced with os.replace get a new inode, so two writes within the same
+    timestamp tick still give different versions.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino, stat.st_size
@@ -0,0 +1,136 @@
+import threading
+from typing import List, Tuple
+
+import numpy as np
+
+from app.services.embedding_cache import CachedEmbeddings
+from app.services.rag_service import vector_manager
+
+
+def _unit(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not len(vectors):
+        return vectors.reshape(0, 0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def embed_texts(texts) -> np.ndarray:
+    """Unit-length embeddings of one-off texts (questions), kept out of the persistent embedding cache."""
+    embeddings = vector_manager.embeddings
+    if isinstance(embeddings, CachedEmbeddings):
+        return _unit(embeddings.embed_documents(list(texts), store=False))
+    return _unit(embeddings.embed_documents(list(texts)))
+
+
+def chunk_vectors(chunks, topic: str = None) -> np.ndarray:
+    """
+    Unit-length vectors of retrieved chunks, read from the vector DB by
+    Document.id. Only chunks without a stored vector (topic digests, results
+    of the numpy backend) are embedded.
+    """
+    ids = [chunk.id for chunk in chunks if getattr(chunk, "id", None)]
+    stored = vector_manager.get_embeddings(ids, topic) if ids else {}
+    missing = [chunk.page_content for chunk in chunks if getattr(chunk, "id", None) not in stored]
+    computed = iter(embed_texts(missing)) if missing else iter(())
+    return _unit([
+        stored[chunk.id] if getattr(chunk, "id", None) in stored else next(computed)
+        for chunk in chunks
+    ])
+
+
+def diverse_batches(vectors: np.ndarray, batches: int, per_batch: int, balance: float = 0.5) -> Tuple[List[List[int]], List[int]]:
+    """
+    Splits chunks (rows of `vectors`, most relevant first) into `batches`
+    disjoint groups of up to `per_batch` and returns them with the indices
+    left over.
+
+    One seed per batch is picked MMR-style: relevance (retrieval rank)
+    against similarity to the seeds already chosen, weighted by `balance`.
+    Batches then take turns claiming the unused chunk closest to their own
+    seed, so each batch covers a different part of the material.
+    """
+    total = len(vectors)
+    if total == 0 or batches == 0:
+        return [[] for _ in range(batches)], []
+    if total < batches:
+        # Not enough material for disjoint batches: spread what there is
+        return [[i % total] for i in range(batches)], []
+    per_batch = max(1, min(per_batch, total // batches))
+
+    relevance = 1.0 - np.arange(total) / total
+    similarity = vectors @ vectors.T
+    seeds = [0]
+    closest = similarity[0].copy()
+    for _ in range(1, batches):
+        score = balance * relevance - (1 - balance) * closest
+        score[seeds] = -np.inf
+        seed = int(np.argmax(score))
+        seeds.append(seed)
+        closest = np.maximum(closest, similarity[seed])
+
+    used = np.zeros(total, dtype=bool)
+    used[seeds] = True
+    groups = [[seed] for seed in seeds]
+    for _ in range(per_batch - 1):
+        for group in groups:
+            candidates = np.where(used, -np.inf, similarity[group[0]])
+            best = int(np.argmax(candidates))
+            if used[best]:
+                break
+            used[best] = True
+            group.append(best)
+    return groups, [i for i in range(total) if not used[i]]
+
+
+class QuestionDeduper:
+    """Keeps the questions of one test and rejects those too similar to one already kept."""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._vectors = []
+
+    def filter(self, questions: list) -> Tuple[list, int]:
+        """Returns (new questions, number of duplicates), also dropping repeats within `questions`."""
+        texts = [question_text(q) for q in questions]
+        vectors = embed_texts(texts) if texts else []
+        kept, duplicates = [], 0
+        for question, text, vector in zip(questions, texts, vectors):
+            if text and self._vectors and float(np.max(np.stack(self._vectors) @ vector)) >= self.threshold:
+                duplicates += 1
+                continue
+            self._vectors.append(vector)
+            kept.append(question)
+        return kept, duplicates
+
+
+def question_text(question) -> str:
+    if isinstance(question, dict):
+        return question.get("pregunta") or ""
+    return getattr(question, "pregunta", "") or ""
+
+
+class FullTestStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {"tests": 0, "llm_calls": 0, "questions_generated": 0, "duplicates_dropped": 0, "questions_accepted": 0}
+
+    def record(self, llm_calls: int, generated: int, duplicates: int, accepted: int):
+        with self._lock:
+            self._metrics["tests"] += 1
+            self._metrics["llm_calls"] += llm_calls
+            self._metrics["questions_generated"] += generated
+            self._metrics["duplicates_dropped"] += duplicates
+            self._metrics["questions_accepted"] += accepted
+
+    def stats(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+        generated, accepted = metrics["questions_generated"], metrics["questions_accepted"]
+        metrics["duplicate_rate"] = round(metrics["duplicates_dropped"] / generated, 4) if generated else 0.0
+        metrics["llm_calls_per_question"] = round(metrics["llm_calls"] / accepted, 4) if accepted else None
+        return metrics
+
+
+full_test_stats = FullTestStats()
@@ -0,0 +1,295 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Literal, Optional
+from pydantic import BaseModel
+
+from app.config import settings
+from app.services.executor import run_blocking
+from app.services.rag_service import process_pdf_to_vector_db, rollback_ingestion, IngestionCancelled
+from app.services.topic_digests import topic_digests
+
+
+class IngestionJob(BaseModel):
+    id: str
+    filename: str
+    topic: str
+    file_path: str
+    replace_source: bool = False
+    status: Literal["queued", "running", "completed", "failed", "cancelled", "interrupted"] = "queued"
+    total_pages: Optional[int] = None
+    pages_parsed: int = 0
+    chunks_embedded: int = 0
+    chunks_written: int = 0
+    chunks_skipped: int = 0
+    chunks_removed: int = 0
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class IngestionQueueFull(Exception):
+    pass
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IngestionJobManager:
+    """
+    Runs PDF ingestion in background workers fed by a bounded queue.
+
+    Job state lives in a SQLite file shared by every uvicorn worker on the
+    host, so any worker can report or cancel a job accepted by another one.
+    Each job records the pid of the process running it; a job still marked
+    queued or running whose process is gone was cut short, so it is reported
+    as `interrupted` along with how many chunks it had already written.
+    Cancelling a job running in another worker sets a flag that the owner
+    checks after each batch.
+    """
+
+    def __init__(self, journal_path: str, queue_size: int, workers: int):
+        self.journal_path = journal_path
+        self.queue_size = queue_size
+        self.workers = workers
+        self._jobs = {}
+        self._cancel_events = {}
+        self._queue = None
+        self._worker_tasks = []
+        self._local = threading.local()
+        self._recover()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.journal_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, owner INTEGER NOT NULL, status TEXT NOT NULL, created_at REAL NOT NULL, "
+                "cancel_requested INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _recover(self):
+        """Marks as interrupted the unfinished jobs whose process is no longer running."""
+        if not os.path.exists(self.journal_path):
+            return
+        conn = self._connection()
+        rows = conn.execute("SELECT data, owner FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        for data, owner in rows:
+            if owner != os.getpid() and _process_alive(owner):
+                continue
+            job = IngestionJob.model_validate_json(data)
+            job.status = "interrupted"
+            job.error = "El proceso se detuvo antes de terminar la ingesta"
+            self._save_journal(job)
+
+    def _save_journal(self, job: IngestionJob):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # The owner and a pending cancel request survive updates
+            conn.execute(
+                "INSERT INTO jobs (id, owner, status, created_at, data) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status, data = excluded.data",
+                (job.id, os.getpid(), job.status, job.created_at, job.model_dump_json())
+            )
+            # Keep every unfinished job plus the most recent finished ones
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') AND id NOT IN ("
+                "SELECT id FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') "
+                "ORDER BY created_at DESC LIMIT ?)",
+                (settings.ingestion_job_history,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _transition(self, job: IngestionJob, expected: str) -> bool:
+        """Saves `job` only if its stored status is still `expected`, so two workers never both act on it."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, data = ? WHERE id = ? AND status = ?",
+            (job.status, job.model_dump_json(), job.id, expected)
+        )
+        return cursor.rowcount == 1
+
+    def _load(self, job_id: str) -> Optional[IngestionJob]:
+        row = self._connection().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return IngestionJob.model_validate_json(row[0]) if row else None
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        row = self._connection().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def submit(
+        self,
+        file_path: str,
+        filename: str,
+        topic: str,
+        job_id: str = None,
+        replace_source: bool = False
+    ) -> IngestionJob:
+        """Queues a PDF for ingestion; raises IngestionQueueFull when the queue is at capacity."""
+        self._ensure_workers()
+        job = IngestionJob(
+            id=job_id or uuid.uuid4().hex,
+            filename=filename,
+            topic=topic,
+            file_path=file_path,
+            replace_source=replace_source,
+            created_at=time.time()
+        )
+        if self._queue.full():
+            raise IngestionQueueFull()
+        # Stored before it is queued, so the worker can claim it
+        await run_blocking(self._save_journal, job)
+        try:
+            self._queue.put_nowait(job.id)
+        except asyncio.QueueFull:
+            await run_blocking(self._delete, job.id)
+            raise IngestionQueueFull()
+        self._jobs[job.id] = job
+        self._cancel_events[job.id] = threading.Event()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self._load(job_id)
+
+    def list(self):
+        rows = self._connection().execute("SELECT data FROM jobs ORDER BY created_at DESC").fetchall()
+        return [IngestionJob.model_validate_json(data) for data, in rows]
+
+    def incomplete_topics(self):
+        """Topics with an interrupted ingestion that may have left partial data."""
+        rows = self._connection().execute("SELECT data FROM jobs WHERE status = 'interrupted'").fetchall()
+        return sorted({IngestionJob.model_validate_json(data).topic for data, in rows})
+
+    async def cancel(self, job_id: str) -> Optional[IngestionJob]:
+        """
+        Cancels a queued or running job, whichever worker holds it. For an
+        interrupted job, removes the chunks it had written so the topic is
+        consistent again.
+        """
+        job = self._jobs.get(job_id) or await run_blocking(self._load, job_id)
+        if job is None:
+            return None
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            if await run_blocking(self._transition, job, "queued"):
+                self._remove_upload(job)
+                return job
+            # A worker started it in the meantime
+            job = await run_blocking(self._load, job_id)
+        if job.status == "running":
+            if job_id in self._cancel_events:
+                self._cancel_events[job_id].set()
+            else:
+                await run_blocking(self._request_cancel, job_id)
+        elif job.status == "interrupted":
+            await run_blocking(rollback_ingestion, job.id, job.topic)
+            job.status = "cancelled"
+            job.chunks_written = 0
+            job.finished_at = time.time()
+            self._remove_upload(job)
+            await run_blocking(self._save_journal, job)
+        return job
+
+    def _delete(self, job_id: str):
+        self._connection().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _request_cancel(self, job_id: str):
+        self._connection().execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = self._jobs.get(job_id)
+                if job is not None and job.status == "queued":
+                    job.status = "running"
+                    job.started_at = time.time()
+                    # Another worker may have cancelled it while it was queued
+                    if await run_blocking(self._transition, job, "queued"):
+                        await self._run(job)
+            finally:
+                self._jobs.pop(job_id, None)
+                self._cancel_events.pop(job_id, None)
+                self._queue.task_done()
+
+    async def _run(self, job: IngestionJob):
+        cancel_event = self._cancel_events[job.id]
+
+        def progress(**counters):
+            for name, value in counters.items():
+                setattr(job, name, value)
+            self._save_journal(job)
+            if self._cancel_requested(job.id):
+                cancel_event.set()
+
+        try:
+            await run_blocking(
+                process_pdf_to_vector_db,
+                job.file_path,
+                job.topic,
+                progress=progress,
+                should_cancel=cancel_event.is_set,
+                job_id=job.id,
+                replace_source=job.replace_source
+            )
+            job.status = "completed"
+            if settings.topic_digests_enabled:
+                topic_digests.schedule_refresh(job.topic)
+        except IngestionCancelled:
+            await run_blocking(rollback_ingestion, job.id, job.topic)
+            job.chunks_written = 0
+            job.status = "cancelled"
+        except Exception as e:
+            # Do not leave a half-indexed topic behind
+            try:
+                await run_blocking(rollback_ingestion, job.id, job.topic)
+                job.chunks_written = 0
+            except Exception:
+                pass
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            self._remove_upload(job)
+            await run_blocking(self._save_journal, job)
+
+    def _remove_upload(self, job: IngestionJob):
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        job_dir = os.path.dirname(job.file_path)
+        if os.path.isdir(job_dir) and not os.listdir(job_dir):
+            os.rmdir(job_dir)
+
+
+ingestion_jobs = IngestionJobManager(
+    journal_path=settings.ingestion_journal_path,
+    queue_size=settings.ingestion_queue_size,
+    workers=settings.ingestion_workers
+)
@@ -0,0 +1,93 @@
+import threading
+import httpx
+
+from app.config import settings
+
+
+class LLMRegistry:
+    """
+    Registry of long-lived LLM clients, one per provider.
+    Every service reuses the same client, and therefore the same keep-alive
+    connection pool, instead of opening new connections on each request.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _limits(self):
+        return httpx.Limits(
+            max_connections=settings.llm_pool_max_connections,
+            max_keepalive_connections=settings.llm_pool_max_keepalive,
+            keepalive_expiry=settings.llm_keepalive_expiry
+        )
+
+    def _timeout(self):
+        return httpx.Timeout(settings.llm_timeout, connect=settings.llm_connect_timeout)
+
+    def _build(self, provider: str):
+        if provider == "groq":
+            from langchain_groq import ChatGroq
+            return ChatGroq(
+                model=settings.groq_model,
+                api_key=settings.groq_api_key,
+                temperature=settings.llm_temperature,
+                request_timeout=settings.llm_timeout,
+                http_client=httpx.Client(limits=self._limits(), timeout=self._timeout()),
+                http_async_client=httpx.AsyncClient(limits=self._limits(), timeout=self._timeout())
+            )
+        from langchain_ollama import ChatOllama
+        return ChatOllama(
+            model=settings.llm_model,
+            temperature=settings.llm_temperature,
+            base_url=settings.ollama_base_url or None,
+            client_kwargs={"limits": self._limits(), "timeout": self._timeout()}
+        )
+
+    def get(self, json_mode: bool = False):
+        """
+        Returns the shared client for the configured provider.
+        With json_mode, Ollama is asked for JSON output on the same client.
+        """
+        provider = settings.llm_provider
+        key = (provider, json_mode and provider == "ollama")
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                base = self._clients.get((provider, False))
+                if base is None:
+                    base = self._clients[(provider, False)] = self._build(provider)
+                client = self._clients[key] = base.bind(format="json") if key[1] else base
+        return client
+
+    async def ping(self) -> str:
+        """
+        Checks that the configured backend answers and knows the model; with
+        Ollama an empty prompt also loads the model into memory. Returns the
+        model name and raises on failure.
+        """
+        self.get()
+        async with httpx.AsyncClient(timeout=self._timeout()) as client:
+            if settings.llm_provider == "groq":
+                response = await client.get(
+                    f"https://api.groq.com/openai/v1/models/{settings.groq_model}",
+                    headers={"Authorization": f"Bearer {settings.groq_api_key}"}
+                )
+                response.raise_for_status()
+                return settings.groq_model
+            base_url = (settings.ollama_base_url or "http://localhost:11434").rstrip("/")
+            response = await client.post(f"{base_url}/api/generate", json={"model": settings.llm_model})
+            response.raise_for_status()
+            return settings.llm_model
+
+    def reset(self):
+        """Drops every client; the next get() builds new ones from current settings."""
+        with self._lock:
+            self._clients.clear()
+
+
+llm_registry = LLMRegistry()
+
+
+def get_shared_llm(json_mode: bool = False):
+    return llm_registry.get(json_mode)
@@ -1,9 +1,13 @@
+from contextlib import aclosing
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
 from typing import List
 
 from app.config import settings
+from app.services.context_builder import build_context
+from app.services.executor import run_llm, stream_llm, stream_llm_items
+from app.services.llm_provider import get_shared_llm
 
 
 class QuestionSchema(BaseModel):
@@ -13,123 +17,53 @@ class QuestionSchema(BaseModel):
     explicacion: str = Field(description="Breve explicación de por qué esa es la correcta")
 
 
+class TestSchema(BaseModel):
+    preguntas: List[QuestionSchema] = Field(description="Lista de preguntas de test generadas")
+
+
 def get_llm():
-    if settings.llm_provider == "groq":
-        from langchain_groq import ChatGroq
-        return ChatGroq(
-            model=settings.groq_model,
-            api_key=settings.groq_api_key,
-            temperature=settings.llm_temperature
-        )
-    from langchain_ollama import ChatOllama
-    return ChatOllama(
-        model=settings.llm_model,
-        format="json",
-        temperature=settings.llm_temperature
-    )
-
-
-llm = get_llm()
-
-def generate_test_from_chunks(chunks, topic_name: str):
-    context = "\n\n".join([c.page_content for c in chunks])
-    
-    parser = JsonOutputParser(pydantic_object=QuestionSchema)
-
-    prompt = ChatPromptTemplate.from_template(
-        """Eres un profesor de autoescuela experto. Tu tarea es generar una pregunta de test profesional para el carnet tipo B.
-        
+    return get_shared_llm(json_mode=True)
+
+
+def get_chat_llm():
+    return get_shared_llm()
+
+
+# Prompts and parsers are built once; format instructions are baked in as partials
+question_parser = JsonOutputParser(pydantic_object=QuestionSchema)
+bulk_parser = JsonOutputParser(pydantic_object=TestSchema)
+
+QUESTION_PROMPT = ChatPromptTemplate.from_template(
+    """Eres un profesor de autoescuela experto. Tu tarea es generar una pregunta de test profesional para el carnet tipo B.
+
         CONTEXTO (Manual de la DGT - {topic}):
         {context}
-        
+
         INSTRUCCIONES:
         1. Crea 1 pregunta basada EXCLUSIVAMENTE en el contexto anterior.
         2. Proporciona 3 opciones de respuesta claras.
         3. Indica la respuesta correcta.
         4. Escribe una breve explicación basada en el manual.
-        
-        {format_instructions}"""
-    )
 
-    chain = prompt | llm | parser
-
-    response = chain.invoke({
-        "topic": topic_name,
-        "context": context,
-        "format_instructions": parser.get_format_instructions()
-    })
-    
-    return response
-
-class TestSchema(BaseModel):
-    preguntas: List[QuestionSchema] = Field(description="Lista de preguntas de test generadas")
+        {format_instructions}"""
+).partial(format_instructions=question_parser.get_format_instructions())
 
-def generate_bulk_questions(chunks, topic_name: str, count: int):
-    context = "\n\n".join([c.page_content for c in chunks])
-    parser = JsonOutputParser(pydantic_object=TestSchema)
+BULK_PROMPT = ChatPromptTemplate.from_template(
+    """Eres un profesor de autoescuela. Genera {count} preguntas de test distintas.
 
-    prompt = ChatPromptTemplate.from_template(
-        """Eres un profesor de autoescuela. Genera {count} preguntas de test distintas.
-        
         CONTEXTO:
         {context}
-        
+
         INSTRUCCIONES:
         1. No repitas conceptos. Si una pregunta es sobre velocidad, la siguiente debe ser sobre otro detalle del texto.
         2. Usa un lenguaje claro y profesional.
         3. Formato estrictamente JSON.
-        
-        {format_instructions}"""
-    )
-
-    chain = prompt | llm | parser
-    return chain.invoke({
-        "topic": topic_name, 
-        "context": context, 
-        "count": count,
-        "format_instructions": parser.get_format_instructions()
-    })
-
-
-def get_chat_llm():
-    if settings.llm_provider == "groq":
-        from langchain_groq import ChatGroq
-        return ChatGroq(
-            model=settings.groq_model,
-            api_key=settings.groq_api_key,
-            temperature=settings.llm_temperature
-        )
-    from langchain_ollama import ChatOllama
-    return ChatOllama(
-        model=settings.llm_model,
-        temperature=settings.llm_temperature
-    )
-
-
-TONE_INSTRUCTIONS = {
-    "formal": "Sé formal, profesional y cortés.",
-    "informal": "Sé cercano y amigable, tutea al alumno.",
-    "conciso": "Responde de forma muy breve y directa, solo lo esencial.",
-    "detallado": "Proporciona explicaciones completas con ejemplos cuando sea posible."
-}
 
+        {format_instructions}"""
+).partial(format_instructions=bulk_parser.get_format_instructions())
 
-def chat_with_tutor(question: str, chunks, tone: str = "formal", 
-                    user_name: str = None, history: list = None) -> str:
-    context = "\n\n".join([c.page_content for c in chunks])
-    chat_llm = get_chat_llm()
-    
-    greeting = f"Dirígete al alumno como {user_name}. " if user_name else ""
-    tone_instruction = TONE_INSTRUCTIONS.get(tone, TONE_INSTRUCTIONS["formal"])
-    
-    history_text = ""
-    if history:
-        for msg in history[-6:]:
-            role = "Alumno" if msg.get("role") == "user" else "Tutor"
-            history_text += f"{role}: {msg.get('content')}\n"
-    
-    prompt = ChatPromptTemplate.from_template(
-        """Eres un tutor virtual de autoescuela en España. Tu rol es ayudar a estudiantes 
+CHAT_PROMPT = ChatPromptTemplate.from_template(
+    """Eres un tutor virtual de autoescuela en España. Tu rol es ayudar a estudiantes
 a preparar el examen teórico del carnet de conducir tipo B.
 
 ESTILO: {tone_instruction}
@@ -152,14 +86,125 @@ PREGUNTA ACTUAL DEL ALUMNO:
 {question}
 
 RESPUESTA:"""
-    )
-    
-    chain = prompt | chat_llm
-    response = chain.invoke({
-        "context": context, 
+)
+
+
+DIGEST_PROMPT = ChatPromptTemplate.from_template(
+    """Eres un profesor de autoescuela experto. Resume el siguiente fragmento del manual de la DGT
+para que sirva como base para preguntas de test del carnet tipo B.
+
+        TEMA: {topic}
+
+        TEXTO:
+        {context}
+
+        INSTRUCCIONES:
+        1. Escribe una lista de hechos concretos, uno por línea, empezando cada uno por "- ".
+        2. Conserva todas las normas, cifras (velocidades, distancias, plazos, edades, sanciones) y excepciones.
+        3. No añadas nada que no esté en el texto ni explicaciones generales.
+        4. Sé breve: como máximo {max_facts} hechos.
+
+        HECHOS:"""
+)
+
+
+async def summarize_section(text: str, topic_name: str, max_facts: int) -> str:
+    """Condenses a section of the manual into a list of facts to generate questions from."""
+    chain = DIGEST_PROMPT | get_chat_llm()
+    response = await run_llm(chain, {
+        "topic": topic_name,
+        "context": text,
+        "max_facts": max_facts
+    })
+    return response.content.strip()
+
+
+async def generate_test_from_chunks(chunks, topic_name: str):
+    context = build_context(chunks, settings.context_budget_question, "question")
+
+    chain = QUESTION_PROMPT | get_llm() | question_parser
+
+    response = await run_llm(chain, {
+        "topic": topic_name,
+        "context": context
+    })
+
+    return response
+
+
+def _build_bulk_chain(chunks, topic_name: str, count: int):
+    context = build_context(chunks, settings.context_budget_bulk, "bulk")
+
+    chain = BULK_PROMPT | get_llm() | bulk_parser
+    inputs = {
+        "topic": topic_name,
+        "context": context,
+        "count": count
+    }
+    return chain, inputs
+
+
+async def generate_bulk_questions(chunks, topic_name: str, count: int):
+    chain, inputs = _build_bulk_chain(chunks, topic_name, count)
+    return await run_llm(chain, inputs)
+
+
+def stream_bulk_questions(chunks, topic_name: str, count: int):
+    """
+    Async generator yielding each generated question as soon as it is complete
+    and valid against QuestionSchema, or None for an invalid one.
+    """
+    chain, inputs = _build_bulk_chain(chunks, topic_name, count)
+    return stream_llm_items(chain, inputs, QuestionSchema)
+
+
+TONE_INSTRUCTIONS = {
+    "formal": "Sé formal, profesional y cortés.",
+    "informal": "Sé cercano y amigable, tutea al alumno.",
+    "conciso": "Responde de forma muy breve y directa, solo lo esencial.",
+    "detallado": "Proporciona explicaciones completas con ejemplos cuando sea posible."
+}
+
+
+def _build_chat_chain(question: str, chunks, tone: str = "formal",
+                      user_name: str = None, history: list = None):
+    context = build_context(chunks, settings.context_budget_chat, "chat")
+
+    greeting = f"Dirígete al alumno como {user_name}. " if user_name else ""
+    tone_instruction = TONE_INSTRUCTIONS.get(tone, TONE_INSTRUCTIONS["formal"])
+
+    history_text = ""
+    if history:
+        for msg in history[-6:]:
+            role = "Alumno" if msg.get("role") == "user" else "Tutor"
+            history_text += f"{role}: {msg.get('content')}\n"
+
+    chain = CHAT_PROMPT | get_chat_llm()
+    inputs = {
+        "context": context,
         "question": question,
         "tone_instruction": tone_instruction,
         "greeting": greeting,
         "history_text": history_text if history_text else "(Sin historial previo)"
-    })
-    return response.content
\ No newline at end of file
+    }
+    return chain, inputs
+
+
+async def chat_with_tutor(question: str, chunks, tone: str = "formal",
+                    user_name: str = None, history: list = None) -> str:
+    chain, inputs = _build_chat_chain(question, chunks, tone, user_name, history)
+    response = await run_llm(chain, inputs)
+    return response.content
+
+
+async def stream_chat_with_tutor(question: str, chunks, tone: str = "formal",
+                                 user_name: str = None, history: list = None):
+    """
+    Yields the tutor's answer as text fragments while the model generates it.
+    Closing the generator early stops the upstream generation.
+    """
+    chain, inputs = _build_chat_chain(question, chunks, tone, user_name, history)
+    async with aclosing(stream_llm(chain.astream(inputs))) as stream:
+        async for chunk in stream:
+            if chunk.content:
+                yield chunk.content
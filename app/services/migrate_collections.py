@@ -0,0 +1,65 @@
+"""
+Moves the chunks of the shared collection into one collection per topic.
+
+Stored embeddings, documents, metadata and ids are copied as they are, so
+nothing is re-embedded, and re-running it after an interruption is safe.
+Once it finishes, set VECTOR_LAYOUT=per_topic and restart the service.
+
+Usage:
+    python -m app.services.migrate_collections [--drop-shared]
+"""
+import argparse
+from collections import defaultdict
+
+from app.services.rag_service import vector_manager, topic_catalog, _notify_invalidation
+
+# Chunks read from the shared collection per call
+PAGE_SIZE = 1000
+
+
+def migrate_to_topic_collections(drop_shared: bool = False, progress=print) -> dict:
+    """Copies every chunk into its topic's collection; returns {topic: chunks copied}."""
+    shared = vector_manager.db._collection
+    copied = defaultdict(int)
+    offset = 0
+    while True:
+        page = shared.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=PAGE_SIZE,
+            offset=offset
+        )
+        by_topic = defaultdict(lambda: {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+        for id_, embedding, document, meta in zip(page["ids"], page["embeddings"], page["documents"], page["metadatas"]):
+            if not meta or "topic" not in meta:
+                continue
+            batch = by_topic[meta["topic"]]
+            batch["ids"].append(id_)
+            batch["embeddings"].append(embedding)
+            batch["documents"].append(document)
+            batch["metadatas"].append(meta)
+        for topic, batch in by_topic.items():
+            vector_manager.topic_db(topic)._collection.upsert(**batch)
+            copied[topic] += len(batch["ids"])
+
+        offset += len(page["ids"])
+        progress(f"{offset} chunks leídos")
+        if len(page["ids"]) < PAGE_SIZE:
+            break
+
+    if drop_shared:
+        vector_manager.db.delete_collection()
+        vector_manager.reset_connection()
+    topic_catalog.rebuild([store._collection for store in vector_manager.topic_dbs(refresh=True).values()])
+    _notify_invalidation(None)
+    return dict(copied)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migra la colección compartida a una colección por tema")
+    parser.add_argument("--drop-shared", action="store_true", help="Elimina la colección compartida al terminar")
+    args = parser.parse_args()
+
+    result = migrate_to_topic_collections(drop_shared=args.drop_shared)
+    for topic, count in sorted(result.items()):
+        print(f"  {topic}: {count} chunks")
+    print("Migración completada. Configura VECTOR_LAYOUT=per_topic y reinicia el servicio.")
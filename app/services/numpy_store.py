@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from langchain_core.documents import Document
+
+DTYPES = ("float32", "float16", "int8")
+# float16/int8 rows widened to float32 at a time while scoring
+BLOCK_ROWS = 1024
+
+
+class TopicMatrix:
+    """Normalized embeddings of one topic plus the documents they belong to."""
+
+    def __init__(self, fingerprint, matrix, scales, documents, metadatas):
+        self.fingerprint = fingerprint
+        self.matrix = matrix
+        self.scales = scales
+        self.documents = documents
+        self.metadatas = metadatas
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        if self.matrix.dtype == np.float32:
+            scores = self.matrix @ query
+        else:
+            # NumPy has no fast float16/int8 product: widen a block of rows at a
+            # time instead of a float32 copy of the whole matrix per search
+            scores = np.empty(len(self.matrix), dtype=np.float32)
+            for start in range(0, len(self.matrix), BLOCK_ROWS):
+                block = self.matrix[start:start + BLOCK_ROWS].astype(np.float32)
+                np.dot(block, query, out=scores[start:start + len(block)])
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+
+class NumpyVectorIndex:
+    """
+    In-process brute-force search over per-topic matrices of normalized
+    embeddings, for corpora small enough that a matrix-vector product beats
+    going through Chroma's client, SQLite and HNSW layers.
+
+    Chroma stays the store of record: a topic's matrix is built from its
+    chunks the first time it is searched and rebuilt whenever its fingerprint
+    (chunk count and last update in the topic catalog) changes, which also
+    picks up ingestions made by other workers. Matrices are saved as .npy
+    files under `directory` and memory-mapped, optionally as float16 or as
+    int8 with one scale per row.
+    """
+
+    def __init__(self, directory: str, dtype: str, mmap: bool, fetch_topic, fingerprints):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}")
+        self.directory = directory
+        self.dtype = dtype
+        self.mmap = mmap
+        # fetch_topic(topic) -> (embeddings, documents, metadatas)
+        self.fetch_topic = fetch_topic
+        # fingerprints() -> {topic: fingerprint} for every topic with chunks
+        self.fingerprints = fingerprints
+        self._topics = {}
+        self._lock = threading.Lock()
+
+    def _paths(self, topic: str):
+        name = hashlib.sha256(topic.encode("utf-8")).hexdigest()[:16]
+        base = os.path.join(self.directory, f"{name}.{self.dtype}")
+        return f"{base}.npy", f"{base}.json"
+
+    def _quantize(self, vectors: np.ndarray):
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(self.dtype), None
+
+    def _build(self, topic: str, fingerprint) -> TopicMatrix:
+        embeddings, documents, metadatas = self.fetch_topic(topic)
+        if not documents:
+            return TopicMatrix(fingerprint, np.zeros((0, 0), dtype=np.float32), None, [], [])
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(documents), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix, scales = self._quantize(vectors / norms)
+
+        matrix_path, meta_path = self._paths(topic)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{matrix_path}.tmp", "wb") as f:
+            np.save(f, matrix)
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+        with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "fingerprint": fingerprint,
+                "scales": scales.tolist() if scales is not None else None,
+                "documents": documents,
+                "metadatas": metadatas
+            }, f, ensure_ascii=False)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        return self._load(topic, fingerprint)
+
+    def _load(self, topic: str, fingerprint):
+        """Loads a saved matrix if it matches `fingerprint`, else returns None."""
+        matrix_path, meta_path = self._paths(topic)
+        if not os.path.exists(meta_path) or not os.path.exists(matrix_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["fingerprint"] != fingerprint:
+            return None
+        matrix = np.load(matrix_path, mmap_mode="r" if self.mmap else None)
+        scales = np.asarray(meta["scales"], dtype=np.float32) if meta["scales"] is not None else None
+        return TopicMatrix(fingerprint, matrix, scales, meta["documents"], meta["metadatas"])
+
+    def _topic(self, topic: str, fingerprint) -> TopicMatrix:
+        current = self._topics.get(topic)
+        if current is not None and current.fingerprint == fingerprint:
+            return current
+        with self._lock:
+            current = self._topics.get(topic)
+            if current is None or current.fingerprint != fingerprint:
+                current = self._load(topic, fingerprint) or self._build(topic, fingerprint)
+                self._topics[topic] = current
+        return current
+
+    def search(self, embedding, topic: str = None, k: int = 4):
+        """Top-k documents by cosine similarity, restricted to `topic` unless it is None."""
+        fingerprints = self.fingerprints()
+        topics = [topic] if topic else sorted(fingerprints)
+        # A copy: the caller's embedding (e.g. a cached query vector) must not be normalized in place
+        query = np.array(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+
+        candidates = []
+        for name in topics:
+            if name not in fingerprints:
+                continue
+            matrix = self._topic(name, fingerprints[name])
+            if not matrix.documents:
+                continue
+            scores = matrix.scores(query)
+            top = min(k, len(scores))
+            for row in np.argpartition(-scores, top - 1)[:top]:
+                candidates.append((float(scores[row]), matrix, int(row)))
+
+        candidates.sort(key=lambda item: item[0], reverse=True)
+        return [
+            Document(page_content=matrix.documents[row], metadata=dict(matrix.metadatas[row]))
+            for _, matrix, row in candidates[:k]
+        ]
+
+    def preload(self) -> int:
+        """Loads or builds the matrix of every topic; returns the rows loaded."""
+        return sum(len(self._topic(name, fp).documents) for name, fp in self.fingerprints().items())
+
+    def invalidate(self, topic: str = None):
+        """Drops in-memory matrices; other workers notice the change through the catalog fingerprint."""
+        with self._lock:
+            if topic is None:
+                self._topics.clear()
+            else:
+                self._topics.pop(topic, None)
+
+    def stats(self) -> dict:
+        return {
+            "dtype": self.dtype,
+            "topics": {name: len(m.documents) for name, m in self._topics.items()},
+            "bytes": int(sum(m.matrix.nbytes for m in self._topics.values()))
+        }
@@ -0,0 +1,65 @@
+"""
+PDF page text extraction.
+
+Only depends on pypdf so that worker processes started with `spawn` import
+it quickly, without pulling in the embedding model or Chroma.
+"""
+import os
+from collections import deque
+from pypdf import PdfReader
+
+
+def read_page_labels(file_path: str):
+    """Page labels of every page; its length is the page count."""
+    # Resolves the whole page tree, so it is read once instead of per range
+    return PdfReader(file_path).page_labels
+
+
+# Opening a reader resolves the whole page tree, so each worker process keeps
+# the reader of the file it is currently parsing instead of reopening it per range
+_current_reader = (None, None)
+
+
+def _get_reader(file_path: str) -> PdfReader:
+    global _current_reader
+    key = (file_path, os.stat(file_path).st_mtime_ns)
+    if _current_reader[0] != key:
+        _current_reader = (key, PdfReader(file_path))
+    return _current_reader[1]
+
+
+def extract_pages(file_path: str, start: int, end: int, reader: PdfReader = None):
+    """Returns [(page_number, text), ...] for pages [start, end)."""
+    reader = reader or _get_reader(file_path)
+    return [
+        (number, reader.pages[number].extract_text().strip())
+        for number in range(start, end)
+    ]
+
+
+def iter_page_ranges(file_path: str, total_pages: int, pages_per_task: int, executor=None, max_in_flight: int = 4):
+    """
+    Yields the pages of a PDF in order, one extracted range at a time.
+    With an executor, up to `max_in_flight` ranges are parsed ahead in parallel;
+    the window keeps memory bounded no matter how large the PDF is.
+    """
+    ranges = deque(
+        (start, min(start + pages_per_task, total_pages))
+        for start in range(0, total_pages, pages_per_task)
+    )
+    if executor is None:
+        reader = PdfReader(file_path)
+        for start, end in ranges:
+            yield extract_pages(file_path, start, end, reader)
+        return
+
+    pending = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < max_in_flight:
+                start, end = ranges.popleft()
+                pending.append(executor.submit(extract_pages, file_path, start, end))
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,103 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embeds several queries in one model call where that gives the same vectors as embed_query."""
+    if hasattr(type(embeddings), "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if isinstance(embeddings, HuggingFaceEmbeddings) and not embeddings.query_encode_kwargs:
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class QueryBatcher:
+    """
+    Micro-batcher for query embeddings. Concurrent callers are queued; a
+    background thread takes the first waiting query, gathers whatever else
+    arrives within `window` seconds (up to `max_batch`), encodes them in one
+    call and resolves each caller's future. Queries that arrive while a
+    batch is being encoded form the next batch, so under load batches grow
+    on their own; when idle, a single query skips the window.
+    """
+
+    def __init__(self, embed_many, max_batch: int = 32, window: float = 0.002):
+        # embed_many(texts) -> one vector per text
+        self.embed_many = embed_many
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = queue.Queue()
+        self._thread = None
+        self._last_batch_size = 0
+        self._lock = threading.Lock()
+        self._metrics = {"batches": 0, "queries": 0, "max_batch_size": 0, "errors": 0}
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        self._ensure_thread()
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        # Waits without holding a thread, so more callers than pool threads can share a batch
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        # A lone query with no recent concurrency goes straight to the model
+        if self._last_batch_size <= 1 and self._queue.empty():
+            return batch
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.perf_counter()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Identical questions asked at the same time are encoded once
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            self._last_batch_size = len(batch)
+            try:
+                vectors = list(self.embed_many(texts))
+                if len(vectors) != len(texts):
+                    raise ValueError(f"Se esperaban {len(texts)} embeddings y se recibieron {len(vectors)}")
+                vectors = dict(zip(texts, vectors))
+            except Exception as e:
+                self._metrics["errors"] += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for text, future in batch:
+                future.set_result(vectors[text])
+            self._metrics["batches"] += 1
+            self._metrics["queries"] += len(batch)
+            self._metrics["max_batch_size"] = max(self._metrics["max_batch_size"], len(batch))
+
+    def stats(self) -> dict:
+        batches = self._metrics["batches"]
+        return {
+            **self._metrics,
+            "avg_batch_size": round(self._metrics["queries"] / batches, 2) if batches else 0.0
+        }
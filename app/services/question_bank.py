@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from pydantic import ValidationError
+
+from app.config import settings
+from app.services.executor import run_blocking
+from app.services.llm_service import generate_bulk_questions, QuestionSchema
+from app.services.full_test_planner import embed_texts
+from app.services.rag_service import asearch_in_vector_db, on_topic_invalidated
+
+
+class QuestionBank:
+    """
+    Per-topic pool of pre-generated questions.
+    `pop` serves a stored question instantly and, when a topic drops below the
+    low-water mark, schedules a background refill up to the target depth.
+    Questions live in a SQLite file shared by every uvicorn worker, together
+    with their embeddings so near-duplicate detection spans workers and
+    restarts. A per-topic version, bumped by `flush`, keeps refills started
+    before a flush (in any worker) from writing stale questions back.
+    """
+
+    def __init__(self, path: str, target: int, low_water: int, dedupe_threshold: float):
+        self.path = path
+        self.target = target
+        self.low_water = low_water
+        self.dedupe_threshold = dedupe_threshold
+        self._refills = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._metrics = {
+            "served": 0,
+            "empty": 0,
+            "generated": 0,
+            "duplicates_skipped": 0,
+            "refills": 0,
+            "refill_errors": 0,
+            "last_refill_seconds": None,
+            "total_refill_seconds": 0.0
+        }
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS questions ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, question TEXT NOT NULL, vector BLOB NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS questions_topic ON questions (topic, id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (topic TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def depth(self, topic: str) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return self._connection().execute("SELECT COUNT(*) FROM questions WHERE topic = ?", (topic,)).fetchone()[0]
+
+    def version(self, topic: str) -> int:
+        row = self._connection().execute("SELECT version FROM versions WHERE topic = ?", (topic,)).fetchone()
+        return row[0] if row else 0
+
+    def _take(self, topic: str):
+        """Removes and returns the oldest question of `topic` with the number left, atomically across workers."""
+        if not os.path.exists(self.path):
+            return None, 0
+        with self._transaction() as conn:
+            row = conn.execute("SELECT id, question FROM questions WHERE topic = ? ORDER BY id LIMIT 1", (topic,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM questions WHERE id = ?", (row[0],))
+            remaining = conn.execute("SELECT COUNT(*) FROM questions WHERE topic = ?", (topic,)).fetchone()[0]
+        return (json.loads(row[1]) if row else None), remaining
+
+    async def pop(self, topic: str):
+        """Returns a stored question for `topic`, or None if the bank is empty."""
+        question, remaining = await run_blocking(self._take, topic)
+        with self._lock:
+            self._metrics["served" if question else "empty"] += 1
+
+        if remaining < self.low_water:
+            self.schedule_refill(topic)
+        return question
+
+    def schedule_refill(self, topic: str):
+        """Starts a background refill for `topic` unless one is already running."""
+        task = self._refills.get(topic)
+        if task is None or task.done():
+            self._refills[topic] = asyncio.create_task(self._refill(topic))
+
+    async def _refill(self, topic: str):
+        start = time.perf_counter()
+        try:
+            version = await run_blocking(self.version, topic)
+            chunks = await asearch_in_vector_db(query="normas generales", topic=topic, k=100)
+            if not chunks:
+                return
+            # Give up after a few rounds that only produce duplicates or invalid output
+            stale_rounds = 0
+            while stale_rounds < 3:
+                depth = await run_blocking(self.depth, topic)
+                if depth >= self.target:
+                    break
+                batch = random.sample(chunks, min(10, len(chunks)))
+                count = min(5, self.target - depth)
+                result = await generate_bulk_questions(batch, topic, count)
+                added = await self._add_questions(topic, result, version)
+                if added is None:
+                    # Flushed since the refill started
+                    return
+                stale_rounds = 0 if added else stale_rounds + 1
+        except Exception:
+            with self._lock:
+                self._metrics["refill_errors"] += 1
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._metrics["refills"] += 1
+                self._metrics["last_refill_seconds"] = round(elapsed, 3)
+                self._metrics["total_refill_seconds"] += elapsed
+
+    async def _add_questions(self, topic: str, result, version: int):
+        """Stores the new, non-duplicate questions; returns how many, or None if the topic was flushed."""
+        items = result.get("preguntas", []) if isinstance(result, dict) else result
+        questions = []
+        for item in items or []:
+            try:
+                questions.append(QuestionSchema.model_validate(item).model_dump())
+            except ValidationError:
+                continue
+        if not questions:
+            return 0
+
+        # Questions are one-off texts: keep them out of the persistent embedding cache
+        vectors = await run_blocking(embed_texts, [q["pregunta"] for q in questions])
+        return await run_blocking(self._store, topic, questions, vectors, version)
+
+    def _store(self, topic: str, questions: list, vectors, version: int):
+        added = duplicates = 0
+        with self._transaction() as conn:
+            if self.version(topic) != version:
+                return None
+            rows = conn.execute("SELECT vector FROM questions WHERE topic = ?", (topic,)).fetchall()
+            # Other workers may be refilling the same topic
+            room = self.target - len(rows)
+            stored = [np.frombuffer(row[0], dtype=np.float32) for row in rows]
+            for question, vector in zip(questions, vectors):
+                if added >= room:
+                    break
+                vector = np.asarray(vector, dtype=np.float32)
+                vector = vector / (np.linalg.norm(vector) or 1.0)
+                if stored and float(np.max(np.stack(stored) @ vector)) >= self.dedupe_threshold:
+                    duplicates += 1
+                    continue
+                conn.execute(
+                    "INSERT INTO questions (topic, question, vector) VALUES (?, ?, ?)",
+                    (topic, json.dumps(question, ensure_ascii=False), vector.tobytes())
+                )
+                stored.append(vector)
+                added += 1
+        with self._lock:
+            self._metrics["duplicates_skipped"] += duplicates
+            self._metrics["generated"] += added
+        return added
+
+    def flush(self, topic: str = None):
+        """Drops stored questions for `topic` (all topics when None), in every worker."""
+        if not os.path.exists(self.path):
+            # Nothing stored and no refill has started yet
+            return
+        with self._transaction() as conn:
+            if topic is None:
+                # Also covers topics whose first refill is still running
+                topics = {row[0] for row in conn.execute("SELECT topic FROM questions UNION SELECT topic FROM versions")}
+                topics |= set(self._refills)
+                conn.execute("DELETE FROM questions")
+            else:
+                topics = {topic}
+                conn.execute("DELETE FROM questions WHERE topic = ?", (topic,))
+            # Refills started before the flush must not write back
+            conn.executemany(
+                "INSERT INTO versions (topic, version) VALUES (?, 1) "
+                "ON CONFLICT(topic) DO UPDATE SET version = version + 1",
+                [(name,) for name in topics]
+            )
+
+    def stats(self) -> dict:
+        # Reading stats alone does not create the file
+        depth = dict(self._connection().execute(
+            "SELECT topic, COUNT(*) FROM questions GROUP BY topic"
+        ).fetchall()) if os.path.exists(self.path) else {}
+        with self._lock:
+            metrics = dict(self._metrics)
+        refills = metrics.pop("refills")
+        total = metrics.pop("total_refill_seconds")
+        return {
+            "depth": depth,
+            "target": self.target,
+            "low_water": self.low_water,
+            "refills": refills,
+            "avg_refill_seconds": round(total / refills, 3) if refills else None,
+            "refilling": sorted(t for t, task in self._refills.items() if not task.done()),
+            **metrics
+        }
+
+
+question_bank = QuestionBank(
+    path=settings.question_bank_path,
+    target=settings.question_bank_target,
+    low_water=settings.question_bank_low_water,
+    dedupe_threshold=settings.question_bank_dedupe_threshold
+)
+
+on_topic_invalidated(question_bank.flush)
@@ -1,20 +1,66 @@
+import asyncio
+import hashlib
 import os
-from langchain_community.document_loaders import PyPDFLoader
+import re
+import unicodedata
+import uuid
+from collections import Counter
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 
 from app.config import settings
+from app.services.executor import run_blocking, get_parse_pool
+from app.services.pdf_pages import read_page_labels, iter_page_ranges
+from app.services.cache import TTLCache
+from app.services.embedding_cache import MemmapEmbeddingCache, CachedEmbeddings
+from app.services.embedding_sidecar import SidecarEmbeddings
+from app.services.query_batcher import QueryBatcher, embed_queries
+from app.services.topic_catalog import TopicCatalog
+from app.services.numpy_store import NumpyVectorIndex
+
+
+# Survives reset_vector_db and chroma_path changes, so rebuilding the DB barely runs the model
+embedding_cache = MemmapEmbeddingCache(
+    directory=settings.embedding_cache_dir,
+    model_name=settings.embeddings_model,
+    max_entries=settings.embedding_cache_max_entries,
+    dtype=settings.embedding_cache_dtype
+)
+
+
+TOPIC_COLLECTION_PREFIX = "topic-"
+
+
+def topic_collection_name(topic: str) -> str:
+    """
+    Chroma collection of a topic in the per_topic layout. Chroma names only
+    allow [a-zA-Z0-9._-], so accents are stripped and a hash of the original
+    topic keeps names that sanitize to the same text apart.
+    """
+    ascii_topic = unicodedata.normalize("NFKD", topic).encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", ascii_topic).strip("._-")[:40]
+    digest = hashlib.sha256(topic.encode("utf-8")).hexdigest()[:8]
+    return f"{TOPIC_COLLECTION_PREFIX}{slug}-{digest}"
 
 
 class VectorDBManager:
     """
     Singleton manager for ChromaDB connections.
     Maintains a persistent connection to avoid expensive reconnections on each request.
+
+    With vector_layout=shared every topic lives in one collection and searches
+    filter on the `topic` metadata; with vector_layout=per_topic each topic has
+    its own collection and `store(topic)` routes to it.
     """
     _instance = None
     _db = None
     _embeddings = None
+    _topic_dbs = None
+    # Cached topic_dbs() result and the catalog topics it was built for
+    _topic_map = None
+    _topic_map_key = None
 
     def __new__(cls):
         if cls._instance is None:
@@ -24,9 +70,16 @@ class VectorDBManager:
     @property
     def embeddings(self):
         if self._embeddings is None:
-            self._embeddings = HuggingFaceEmbeddings(
-                model_name=settings.embeddings_model
-            )
+            if settings.embedding_sidecar_socket:
+                # One model in the sidecar process serves every worker
+                embeddings = SidecarEmbeddings(settings.embedding_sidecar_socket, settings.embedding_sidecar_timeout)
+            else:
+                embeddings = HuggingFaceEmbeddings(
+                    model_name=settings.embeddings_model
+                )
+            if settings.embedding_cache_enabled:
+                embeddings = CachedEmbeddings(embeddings, embedding_cache)
+            self._embeddings = embeddings
         return self._embeddings
 
     @property
@@ -38,72 +91,536 @@ class VectorDBManager:
             )
         return self._db
 
+    @property
+    def partitioned(self) -> bool:
+        return settings.vector_layout == "per_topic"
+
+    def topic_db(self, topic: str, create: bool = True):
+        """The collection of one topic, or None if it does not exist and `create` is False."""
+        if self._topic_dbs is None:
+            self._topic_dbs = {}
+        if topic not in self._topic_dbs:
+            name = topic_collection_name(topic)
+            if not create and name not in self._collection_names():
+                return None
+            self._topic_dbs[topic] = Chroma(
+                collection_name=name,
+                persist_directory=settings.chroma_path,
+                embedding_function=self.embeddings,
+                collection_metadata={"topic": topic}
+            )
+        return self._topic_dbs[topic]
+
+    def _collection_names(self):
+        # Older chromadb versions list names, newer ones Collection objects
+        return {c if isinstance(c, str) else c.name for c in self.db._client.list_collections()}
+
+    def topic_dbs(self, refresh: bool = False) -> dict:
+        """
+        {topic: store} for every per-topic collection on disk, including other
+        workers' new ones. Listing collections costs more than searching a small
+        one, so the map is reused until the set of topics in the shared catalog
+        changes; refresh=True always rescans (resets, migrations, catalog rebuilds).
+        """
+        key = None if refresh else tuple(sorted(topic_catalog.topics()))
+        if refresh or self._topic_map is None or key != self._topic_map_key:
+            self._topic_map = self._scan_topic_dbs()
+            self._topic_map_key = key
+        return dict(self._topic_map)
+
+    def _scan_topic_dbs(self) -> dict:
+        names = self._collection_names()
+        known = {topic_collection_name(topic): topic for topic in self._topic_dbs or {}}
+        stores = {}
+        for name in sorted(names):
+            if not name.startswith(TOPIC_COLLECTION_PREFIX):
+                continue
+            topic = known.get(name) or (self.db._client.get_collection(name).metadata or {}).get("topic")
+            if topic:
+                stores[topic] = self.topic_db(topic)
+        return stores
+
+    def store(self, topic: str = None, create: bool = True):
+        """Chroma store holding `topic` in the configured layout."""
+        if not self.partitioned:
+            return self.db
+        return self.topic_db(topic, create=create)
+
+    def collections(self):
+        """Raw Chroma collections holding chunks in the configured layout."""
+        if not self.partitioned:
+            return [self.db._collection]
+        return [store._collection for store in self.topic_dbs(refresh=True).values()]
+
     def reset_connection(self):
         """Forces a new connection on next access. Use after reset_db."""
         self._db = None
+        self._topic_dbs = None
+        self._topic_map = None
 
-    def add_documents(self, chunks):
-        """Adds documents to the existing collection."""
-        self.db.add_documents(chunks)
+    def add_embedded_documents(self, chunks, embeddings, ids=None, topic: str = None):
+        """Adds documents whose embeddings were already computed."""
+        self.store(topic)._collection.add(
+            ids=ids or [str(uuid.uuid4()) for _ in chunks],
+            embeddings=embeddings,
+            documents=[c.page_content for c in chunks],
+            metadatas=[c.metadata for c in chunks]
+        )
         return len(chunks)
 
+    def get_metadatas(self, ids, topic: str = None):
+        """Returns {id: metadata} for the ids that already exist."""
+        results = self.store(topic)._collection.get(ids=ids, include=["metadatas"])
+        return dict(zip(results["ids"], results["metadatas"]))
+
+    def get_embeddings(self, ids, topic: str = None):
+        """Returns {id: stored embedding} for the ids that exist."""
+        store = self.store(topic, create=False)
+        if store is None:
+            return {}
+        results = store._collection.get(ids=ids, include=["embeddings"])
+        return dict(zip(results["ids"], results["embeddings"]))
+
+    def update_metadatas(self, ids, metadatas, topic: str = None):
+        """Merges the given keys into the metadata of existing documents."""
+        self.store(topic)._collection.update(ids=ids, metadatas=metadatas)
+
+    def metadatas_where(self, where: dict, topic: str = None):
+        store = self.store(topic, create=False)
+        if store is None:
+            return []
+        return store._collection.get(where=where, include=["metadatas"])["metadatas"]
+
+    def ids_where(self, where: dict, topic: str = None):
+        return self.store(topic)._collection.get(where=where, include=[])["ids"]
+
+    def delete_ids(self, ids, topic: str = None):
+        self.store(topic)._collection.delete(ids=ids)
+
+    def delete_where(self, where: dict, topic: str = None):
+        """Deletes every document whose metadata matches `where`."""
+        store = self.store(topic, create=False)
+        if store is not None:
+            store._collection.delete(where=where)
+
 
 vector_manager = VectorDBManager()
 
+topic_catalog = TopicCatalog(
+    settings.topic_catalog_path or os.path.join(settings.chroma_path, "topic_catalog.json"),
+    get_collections=lambda: vector_manager.collections()
+)
+
+def _iter_topic_pages(topic: str, include):
+    """Reads every chunk of a topic from Chroma in pages of 5000."""
+    store = vector_manager.store(topic, create=False)
+    offset = 0
+    while store is not None:
+        page = store._collection.get(where={"topic": topic}, include=include, limit=5000, offset=offset)
+        yield page
+        if len(page["ids"]) < 5000:
+            break
+        offset += 5000
+
+
+def _fetch_topic_chunks(topic: str):
+    """(embeddings, documents, metadatas) of every chunk of a topic, read from Chroma."""
+    embeddings, documents, metadatas = [], [], []
+    for page in _iter_topic_pages(topic, ["embeddings", "documents", "metadatas"]):
+        embeddings.extend(page["embeddings"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+    return embeddings, documents, metadatas
+
+
+def topic_documents(topic: str):
+    """Every chunk of a topic as Documents, without embeddings."""
+    return [
+        Document(page_content=text, metadata=metadata)
+        for page in _iter_topic_pages(topic, ["documents", "metadatas"])
+        for text, metadata in zip(page["documents"], page["metadatas"])
+    ]
+
+
+def topic_fingerprints() -> dict:
+    """{topic: [chunks, last_updated]} for every topic, as recorded in the shared catalog."""
+    return {
+        topic: [entry["chunks"], entry["last_updated"]]
+        for topic, entry in topic_catalog.topics().items()
+    }
+
+
+def content_fingerprint(topic: str = None):
+    """
+    Changes whenever `topic` (any topic when None) is written to by any
+    worker, so per-process caches can tell that an entry is stale even when
+    the invalidation happened in another process.
+    """
+    fingerprints = {name: tuple(fingerprint) for name, fingerprint in topic_fingerprints().items()}
+    if topic:
+        return fingerprints.get(topic)
+    return tuple(sorted(fingerprints.items()))
+
+
+# Brute-force search used instead of Chroma's when vector_backend=numpy
+numpy_index = NumpyVectorIndex(
+    directory=settings.numpy_index_dir or os.path.join(settings.chroma_path, "numpy_index"),
+    dtype=settings.numpy_index_dtype,
+    mmap=settings.numpy_index_mmap,
+    fetch_topic=_fetch_topic_chunks,
+    fingerprints=topic_fingerprints
+)
+
+# Query embeddings only depend on the model, so they never need invalidation
+query_embedding_cache = TTLCache(maxsize=settings.query_embedding_cache_size)
+# (query, topic, k) -> (content fingerprint, documents); cleared locally whenever
+# a topic changes here, and ignored on read once the fingerprint moves elsewhere
+retrieval_cache = TTLCache(maxsize=settings.retrieval_cache_size)
+
+# Callbacks notified when a topic's content changes; topic=None means every topic
+_invalidation_listeners = []
+
+
+def on_topic_invalidated(listener):
+    """Registers listener(topic) to run after ingestion into a topic or a reset."""
+    _invalidation_listeners.append(listener)
+    return listener
+
+
+def _notify_invalidation(topic: str = None):
+    numpy_index.invalidate(topic)
+    if topic is None:
+        retrieval_cache.invalidate()
+    else:
+        # Cross-topic searches (topic=None) may also include the changed topic
+        retrieval_cache.invalidate(lambda key: key[1] is None or key[1] == topic)
+    for listener in _invalidation_listeners:
+        listener(topic)
+
+
+class IngestionCancelled(Exception):
+    pass
+
+
+def chunk_id(topic: str, source: str, text: str) -> str:
+    """
+    Stable document id for a chunk. It only depends on the chunk text and
+    where it belongs, not on its page, so re-uploading a revised manual keeps
+    the ids of every chunk whose text did not change.
+    """
+    return hashlib.sha256(f"{topic}\x00{source}\x00{text}".encode("utf-8")).hexdigest()
+
+
+# Chroma rejects deletes with more ids than its max batch size
+REPLACE_DELETE_BATCH = 5000
+
+# Metadata that can move between revisions without the chunk text changing
+POSITION_KEYS = ("page", "page_label", "start_index", "total_pages")
+
+
+def process_pdf_to_vector_db(
+    file_path: str,
+    topic: str,
+    progress=None,
+    should_cancel=None,
+    job_id: str = None,
+    replace_source: bool = False
+):
+    """
+    Streams a PDF into the vector DB: page text is extracted in ranges on the
+    parse process pool, each page is split on its own and chunks are embedded
+    and written in batches of embedding_batch_size, so memory stays bounded
+    by the parse window and one batch regardless of the PDF size.
+
+    Chunks are stored under a content hash (see chunk_id): chunks already in
+    the DB are not embedded again, only their page position is refreshed.
+    With `replace_source`, chunks of the same source and topic that are no
+    longer in the PDF are deleted once every new chunk has been written.
 
-def process_pdf_to_vector_db(file_path: str, topic: str):
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
+    `progress(**counters)` receives pages_parsed, total_pages, chunks_embedded,
+    chunks_written, chunks_skipped and chunks_removed as they advance;
+    `should_cancel()` is checked between page ranges and batches and raises
+    IngestionCancelled. New chunks are tagged with `ingest_job` so a partial
+    ingestion can be rolled back.
+    """
+    report = progress or (lambda **counters: None)
+    cancelled = should_cancel or (lambda: False)
+
+    page_labels = read_page_labels(file_path)
+    total_pages = len(page_labels)
+    report(pages_parsed=0, total_pages=total_pages)
 
+    source = os.path.basename(file_path)
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=settings.chunk_size,
         chunk_overlap=settings.chunk_overlap,
         add_start_index=True
     )
-    chunks = text_splitter.split_documents(documents)
+    base_metadata = {
+        "topic": topic,
+        "source": source,
+        "total_pages": total_pages
+    }
+    if job_id:
+        base_metadata["ingest_job"] = job_id
 
-    for chunk in chunks:
-        chunk.metadata["topic"] = topic
-        chunk.metadata["source"] = os.path.basename(file_path)
+    parsed = 0
+    embedded = 0
+    written = 0
+    skipped = 0
+    removed = 0
+    moved = 0
+    seen_ids = set()
+    pending = []
 
-    return vector_manager.add_documents(chunks)
+    def write(batch):
+        nonlocal embedded, written, skipped, moved
+        if cancelled():
+            raise IngestionCancelled()
+        ids = [chunk_id(topic, source, c.page_content) for c in batch]
+        existing = vector_manager.get_metadatas(ids, topic=topic)
 
+        new_chunks, new_ids = [], []
+        moved_ids, moved_metadatas = [], []
+        for chunk, id_ in zip(batch, ids):
+            if id_ in seen_ids:
+                # Repeated text inside the same PDF (headers, footers...)
+                skipped += 1
+                continue
+            seen_ids.add(id_)
+            if id_ not in existing:
+                new_chunks.append(chunk)
+                new_ids.append(id_)
+                continue
+            skipped += 1
+            position = {key: chunk.metadata[key] for key in POSITION_KEYS if key in chunk.metadata}
+            if any(existing[id_].get(key) != value for key, value in position.items()):
+                moved_ids.append(id_)
+                moved_metadatas.append(position)
 
-def search_in_vector_db(query: str, topic: str = None, k: int = None):
+        if moved_ids:
+            vector_manager.update_metadatas(moved_ids, moved_metadatas, topic=topic)
+            moved += len(moved_ids)
+        if new_chunks:
+            vectors = vector_manager.embeddings.embed_documents([c.page_content for c in new_chunks])
+            embedded += len(new_chunks)
+            report(chunks_embedded=embedded)
+            written += vector_manager.add_embedded_documents(new_chunks, vectors, ids=new_ids, topic=topic)
+        report(chunks_written=written, chunks_skipped=skipped)
+
+    pool = get_parse_pool()
+    pages = iter_page_ranges(
+        file_path,
+        total_pages,
+        settings.pdf_pages_per_task,
+        executor=pool,
+        max_in_flight=settings.pdf_parse_workers * 2
+    )
+    try:
+        for page_range in pages:
+            if cancelled():
+                raise IngestionCancelled()
+            for number, text in page_range:
+                page = Document(
+                    page_content=text,
+                    metadata={**base_metadata, "page": number, "page_label": page_labels[number]}
+                )
+                pending.extend(text_splitter.split_documents([page]))
+            parsed += len(page_range)
+            report(pages_parsed=parsed)
+
+            while len(pending) >= settings.embedding_batch_size:
+                write(pending[:settings.embedding_batch_size])
+                pending = pending[settings.embedding_batch_size:]
+        if pending:
+            write(pending)
+
+        if replace_source:
+            if cancelled():
+                raise IngestionCancelled()
+            current = vector_manager.ids_where({"$and": [{"topic": topic}, {"source": source}]}, topic=topic)
+            stale = [id_ for id_ in current if id_ not in seen_ids]
+            for start in range(0, len(stale), REPLACE_DELETE_BATCH):
+                vector_manager.delete_ids(stale[start:start + REPLACE_DELETE_BATCH], topic=topic)
+            removed = len(stale)
+            report(chunks_removed=removed)
+    finally:
+        pages.close()
+        changed = bool(written or removed or moved)
+        topic_catalog.apply(topic, {source: written - removed}, touched=changed)
+        if changed:
+            _notify_invalidation(topic)
+    return written
+
+
+def rollback_ingestion(job_id: str, topic: str):
+    """Removes the chunks written by an unfinished ingestion job."""
+    metadatas = vector_manager.metadatas_where({"ingest_job": job_id}, topic=topic)
+    sources = Counter(m.get("source", "desconocido") for m in metadatas if m)
+    vector_manager.delete_where({"ingest_job": job_id}, topic=topic)
+    topic_catalog.apply(topic, {source: -count for source, count in sources.items()})
+    _notify_invalidation(topic)
+
+
+def warm_up_embeddings() -> int:
+    """Loads the embedding model and runs it once, bypassing the caches; returns the dimension."""
+    embeddings = vector_manager.embeddings
+    model = getattr(embeddings, "embeddings", embeddings)
+    return len(model.embed_query("calentamiento del modelo de embeddings"))
+
+
+def warm_up_vector_db() -> int:
+    """Opens Chroma and every collection it serves, plus the NumPy matrices if enabled; returns the chunk count."""
+    chunks = sum(collection.count() for collection in vector_manager.collections())
+    if settings.vector_backend == "numpy":
+        numpy_index.preload()
+    return chunks
+
+
+def _embed_query_batch(queries):
+    return embed_queries(vector_manager.embeddings, queries)
+
+
+# Concurrent query encodes share one model call
+query_batcher = QueryBatcher(
+    _embed_query_batch,
+    max_batch=settings.query_batch_max_size,
+    window=settings.query_batch_window_ms / 1000
+)
+
+
+def embed_query(query: str):
+    embedding = query_embedding_cache.get(query)
+    if embedding is None:
+        if settings.query_batch_enabled:
+            embedding = query_batcher.embed(query)
+        else:
+            embedding = vector_manager.embeddings.embed_query(query)
+        query_embedding_cache.set(query, embedding)
+    return embedding
+
+
+async def aembed_query(query: str):
+    """Non-blocking embed_query: waits for its batch without holding a pool thread."""
+    embedding = query_embedding_cache.get(query)
+    if embedding is None:
+        if settings.query_batch_enabled:
+            embedding = await query_batcher.aembed(query)
+        else:
+            embedding = await run_blocking(vector_manager.embeddings.embed_query, query)
+        query_embedding_cache.set(query, embedding)
+    return embedding
+
+
+def search_by_vector(embedding, topic: str = None, k: int = None):
+    """Searches with a precomputed query embedding, so callers can reuse it."""
     if k is None:
         k = settings.default_search_k
 
+    if settings.vector_backend == "numpy":
+        return numpy_index.search(embedding, topic, k)
+
+    if vector_manager.partitioned:
+        if topic:
+            store = vector_manager.topic_db(topic, create=False)
+            return store.similarity_search_by_vector(embedding, k=k) if store else []
+        return _fan_out_search(embedding, k)
+
     if topic:
-        return vector_manager.db.similarity_search(
-            query,
+        return vector_manager.db.similarity_search_by_vector(
+            embedding,
             k=k,
             filter={"topic": topic}
         )
-    return vector_manager.db.similarity_search(query, k=k)
+    return vector_manager.db.similarity_search_by_vector(embedding, k=k)
 
 
-def reset_vector_db():
-    vector_manager.db.delete_collection()
-    vector_manager.reset_connection()
-    return True
+def _fan_out_search(embedding, k: int):
+    """Cross-topic search in the per_topic layout: top k of every collection, merged by distance."""
+    scored = []
+    for store in vector_manager.topic_dbs().values():
+        scored.extend(store.similarity_search_by_vector_with_relevance_scores(embedding, k=k))
+    return _merge_scored(scored, k)
+
 
+def _merge_scored(scored, k: int):
+    scored.sort(key=lambda pair: pair[1])
+    return [doc for doc, _ in scored[:k]]
 
-def get_all_topics():
+
+async def asearch_by_vector(embedding, topic: str = None, k: int = None):
     """
-    Retrieves all unique topics from the vector database.
-    Returns a list of distinct topic names stored in document metadata.
+    Non-blocking search_by_vector. Cross-topic searches in the per_topic layout
+    query every collection concurrently on the blocking pool instead of one
+    after another.
     """
-    collection = vector_manager.db._collection
-    
-    if collection.count() == 0:
-        return []
-    
-    results = collection.get(include=["metadatas"])
-    metadatas = results.get("metadatas", [])
-    
-    topics = set()
-    for meta in metadatas:
-        if meta and "topic" in meta:
-            topics.add(meta["topic"])
-    
-    return sorted(list(topics))
\ No newline at end of file
+    if k is None:
+        k = settings.default_search_k
+    if topic or settings.vector_backend == "numpy" or not vector_manager.partitioned:
+        return await run_blocking(search_by_vector, embedding, topic, k)
+
+    stores = await run_blocking(vector_manager.topic_dbs)
+    results = await asyncio.gather(*(
+        run_blocking(store.similarity_search_by_vector_with_relevance_scores, embedding, k=k)
+        for store in stores.values()
+    ))
+    return _merge_scored([pair for scored in results for pair in scored], k)
+
+
+def _cached_search(query: str, topic: str, k: int, fingerprint):
+    cached = retrieval_cache.get((query, topic, k))
+    if cached is None or cached[0] != fingerprint:
+        return None
+    # Callers may shuffle or slice the list, so hand out a copy
+    return list(cached[1])
+
+
+def search_in_vector_db(query: str, topic: str = None, k: int = None):
+    if k is None:
+        k = settings.default_search_k
+
+    fingerprint = content_fingerprint(topic)
+    cached = _cached_search(query, topic, k, fingerprint)
+    if cached is not None:
+        return cached
+    generation = retrieval_cache.generation
+    results = search_by_vector(embed_query(query), topic, k)
+    retrieval_cache.set((query, topic, k), (fingerprint, results), generation=generation)
+    return list(results)
+
+
+async def asearch_in_vector_db(query: str, topic: str = None, k: int = None):
+    """Non-blocking variant of search_in_vector_db; cache hits skip the thread pool."""
+    if k is None:
+        k = settings.default_search_k
+
+    fingerprint = content_fingerprint(topic)
+    cached = _cached_search(query, topic, k, fingerprint)
+    if cached is not None:
+        return cached
+    generation = retrieval_cache.generation
+    embedding = await aembed_query(query)
+    results = await asearch_by_vector(embedding, topic, k)
+    retrieval_cache.set((query, topic, k), (fingerprint, results), generation=generation)
+    return list(results)
+
+
+def reset_vector_db(topic: str = None):
+    """Deletes every chunk, or only those of `topic`."""
+    if topic is None:
+        for store in vector_manager.topic_dbs(refresh=True).values():
+            store.delete_collection()
+        vector_manager.db.delete_collection()
+        vector_manager.reset_connection()
+        topic_catalog.clear()
+    else:
+        if vector_manager.partitioned:
+            store = vector_manager.topic_db(topic, create=False)
+            if store:
+                store.delete_collection()
+            vector_manager.reset_connection()
+        else:
+            vector_manager.delete_where({"topic": topic})
+        topic_catalog.drop(topic)
+    _notify_invalidation(topic)
+    return True
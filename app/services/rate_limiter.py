@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from app.config import settings
+
+
+class InMemoryRateLimiter:
+    """
+    Sliding-window limiter: allows `limit` hits per key in any `window`
+    seconds. State is per process, so with several uvicorn workers each one
+    enforces the limit on its own.
+    """
+
+    shared = False
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._hits = {}
+        self._next_prune = time.monotonic() + window
+        self._lock = threading.Lock()
+
+    def hit(self, key) -> bool:
+        """Records a hit and returns True, or returns False if the key is over the limit."""
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.setdefault(key, deque())
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+            if len(hits) >= self.limit:
+                return False
+            hits.append(now)
+            # Forget keys that have gone quiet so the dict does not grow forever;
+            # once per window, so the full scan is amortized over every hit in it
+            if now >= self._next_prune:
+                self._hits = {k: v for k, v in self._hits.items() if v and v[-1] > now - self.window}
+                self._next_prune = now + self.window
+            return True
+
+
+class SQLiteRateLimiter:
+    """
+    Sliding-window limiter shared by every worker on the host through a
+    SQLite file. `BEGIN IMMEDIATE` serializes the count-and-insert across
+    processes, and each check prunes the key's expired hits, so the table
+    only ever holds one window of traffic.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, limit: int, window: float):
+        self.path = path
+        self.limit = limit
+        self.window = window
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS hits (key TEXT NOT NULL, ts REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS hits_key_ts ON hits (key, ts)")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key) -> bool:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM hits WHERE key = ? AND ts <= ?", (str(key), now - self.window))
+            count = conn.execute("SELECT COUNT(*) FROM hits WHERE key = ?", (str(key),)).fetchone()[0]
+            allowed = count < self.limit
+            if allowed:
+                conn.execute("INSERT INTO hits (key, ts) VALUES (?, ?)", (str(key), now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+def create_rate_limiter():
+    if settings.rate_limit_backend == "sqlite":
+        return SQLiteRateLimiter(
+            settings.rate_limit_sqlite_path,
+            settings.rate_limit_requests,
+            settings.rate_limit_window_seconds
+        )
+    return InMemoryRateLimiter(settings.rate_limit_requests, settings.rate_limit_window_seconds)
+
+
+rate_limiter = create_rate_limiter()
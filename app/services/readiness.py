@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import engine
+from app.services.executor import run_blocking
+from app.services.llm_provider import llm_registry
+from app.services.rag_service import warm_up_embeddings, warm_up_vector_db
+
+
+class Readiness:
+    """
+    Warms up the worker's components at startup and tracks their state.
+
+    `probes` maps a component name to an async callable that loads it and
+    returns a short detail (model name, chunk count...). Probes listed in
+    `after` wait for another component first. A probe that fails is retried
+    every `retry_seconds`, so a worker started before Ollama or MySQL comes
+    up turns ready on its own.
+    """
+
+    def __init__(self, probes: dict, after: dict = None, retry_seconds: float = 30.0):
+        self.probes = probes
+        self.after = after or {}
+        self.retry_seconds = retry_seconds
+        self.components = {name: {"status": "pending"} for name in probes}
+        self._done = {name: asyncio.Event() for name in probes}
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return all(c["status"] == "ready" for c in self.components.values())
+
+    async def _warm(self, name: str):
+        dependency = self.after.get(name)
+        if dependency:
+            await self._done[dependency].wait()
+        while True:
+            self.components[name] = {"status": "loading"}
+            start = time.perf_counter()
+            try:
+                detail = await self.probes[name]()
+                self.components[name] = {
+                    "status": "ready",
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "detail": detail
+                }
+                self._done[name].set()
+                return
+            except Exception as e:
+                self.components[name] = {
+                    "status": "failed",
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "error": str(e) or type(e).__name__
+                }
+            await asyncio.sleep(self.retry_seconds)
+
+    async def warm_up(self):
+        await asyncio.gather(*[self._warm(name) for name in self.probes])
+
+    def start(self):
+        """Starts the warm-up in the background; readiness turns true when it finishes."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.warm_up())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def snapshot(self) -> dict:
+        return {"ready": self.ready, "components": dict(self.components)}
+
+
+async def _probe_embeddings():
+    return f"{settings.embeddings_model} ({await run_blocking(warm_up_embeddings)} dimensiones)"
+
+
+async def _probe_vector_db():
+    return f"{await run_blocking(warm_up_vector_db)} chunks"
+
+
+async def _probe_llm():
+    return await llm_registry.ping()
+
+
+async def _probe_database():
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+    return engine.dialect.name
+
+
+readiness = Readiness(
+    {
+        "embeddings": _probe_embeddings,
+        "vector_db": _probe_vector_db,
+        "llm": _probe_llm,
+        "database": _probe_database
+    },
+    # Opening Chroma builds its embedding function, so let the model load first
+    after={"vector_db": "embeddings"},
+    retry_seconds=settings.warmup_retry_seconds
+)
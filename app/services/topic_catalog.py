@@ -0,0 +1,151 @@
+"""
+Topic catalog: chunk count, source files and last update time per topic.
+
+Kept up to date by every ingestion, rollback and reset, so listing topics
+does not have to scan the metadata of every chunk in Chroma. To regenerate
+it from the collection (older databases, or after manual edits to Chroma):
+
+    python -m app.services.topic_catalog rebuild
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from app.services.file_lock import file_lock, file_version
+
+# Metadatas fetched per Chroma call while rebuilding, to keep memory bounded
+PAGE_SIZE = 5000
+
+
+class TopicCatalog:
+    """
+    JSON-backed catalog of {topic: {"chunks", "sources", "last_updated"}}.
+    `sources` maps each source file to its chunk count. Every worker process
+    keeps the catalog in memory and reloads it when another process has
+    rewritten the file; writes re-read and replace the file under a lock on
+    a sidecar file, so concurrent ingestions in different workers do not
+    lose each other's changes. When the file does not exist yet it is
+    rebuilt from the collections returned by `get_collections`.
+    """
+
+    def __init__(self, path: str, get_collections):
+        self.path = path
+        self.get_collections = get_collections
+        self._topics = None
+        self._version = None
+        self._lock = threading.Lock()
+        self._lock_path = f"{path}.lock"
+
+    def _save(self):
+        data = json.dumps(self._topics, ensure_ascii=False)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+        self._version = file_version(self.path)
+
+    def _load(self, force: bool = False) -> bool:
+        """
+        Loads the latest catalog; returns True if it had to be rebuilt. Call
+        with the file lock held; writers pass force=True so they never build
+        on a copy that another worker replaced within the same timestamp tick.
+        """
+        version = file_version(self.path)
+        if version is None:
+            # Database created before the catalog existed: build it once
+            self._rebuild()
+            return True
+        if force or self._topics is None or version != self._version:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._topics = json.load(f)
+            self._version = version
+        return False
+
+    def _rebuild(self, collections=None):
+        sources = {}
+        for collection in collections if collections is not None else self.get_collections():
+            offset = 0
+            while True:
+                page = collection.get(include=["metadatas"], limit=PAGE_SIZE, offset=offset)
+                metadatas = page.get("metadatas") or []
+                for meta in metadatas:
+                    if meta and "topic" in meta:
+                        sources.setdefault(meta["topic"], Counter())[meta.get("source", "desconocido")] += 1
+                if len(metadatas) < PAGE_SIZE:
+                    break
+                offset += PAGE_SIZE
+
+        now = time.time()
+        self._topics = {
+            topic: {"chunks": sum(counts.values()), "sources": dict(counts), "last_updated": now}
+            for topic, counts in sources.items()
+        }
+        self._save()
+
+    def rebuild(self, collections=None) -> dict:
+        """Regenerates the catalog from a full scan of `collections` (the current layout by default)."""
+        with self._lock, file_lock(self._lock_path):
+            self._rebuild(collections)
+            return dict(self._topics)
+
+    def apply(self, topic: str, changes: dict, touched: bool = False):
+        """
+        Adds {source: chunk delta} to a topic after its chunks were written or
+        deleted; topics left without chunks are dropped. `touched` marks the
+        topic as updated even when the counts did not change (chunks that only
+        moved, or were replaced one for one), so fingerprints built on
+        last_updated still change.
+        """
+        if not any(changes.values()) and not touched:
+            return
+        with self._lock, file_lock(self._lock_path):
+            if self._load(force=True):
+                # The rebuild already counted these changes
+                return
+            entry = self._topics.setdefault(topic, {"chunks": 0, "sources": {}, "last_updated": None})
+            for source, delta in changes.items():
+                count = entry["sources"].get(source, 0) + delta
+                if count > 0:
+                    entry["sources"][source] = count
+                else:
+                    entry["sources"].pop(source, None)
+            entry["chunks"] = sum(entry["sources"].values())
+            entry["last_updated"] = time.time()
+            if not entry["sources"]:
+                del self._topics[topic]
+            self._save()
+
+    def drop(self, topic: str):
+        with self._lock, file_lock(self._lock_path):
+            self._load(force=True)
+            if self._topics.pop(topic, None) is not None:
+                self._save()
+
+    def clear(self):
+        with self._lock, file_lock(self._lock_path):
+            self._topics = {}
+            self._save()
+
+    def topics(self) -> dict:
+        with self._lock:
+            if file_version(self.path) is not None:
+                # Readers skip the file lock: the file is only ever replaced whole
+                self._load()
+            else:
+                with file_lock(self._lock_path):
+                    self._load()
+            return dict(self._topics)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("Uso: python -m app.services.topic_catalog rebuild")
+        sys.exit(1)
+    from app.services.rag_service import topic_catalog
+
+    rebuilt = topic_catalog.rebuild()
+    print(f"Catálogo regenerado: {len(rebuilt)} temas, {sum(t['chunks'] for t in rebuilt.values())} chunks")
@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from functools import partial
+
+from langchain_core.documents import Document
+
+from app.config import settings
+from app.services.context_builder import merge_chunks
+from app.services.executor import run_blocking
+from app.services.file_lock import file_lock, file_version
+from app.services.llm_service import summarize_section
+from app.services.rag_service import on_topic_invalidated, topic_documents
+
+
+def _section_key(metadata: dict, pages_per_section: int) -> str:
+    page = metadata.get("page") or 0
+    return f"{metadata.get('source', '')}#{page // pages_per_section}"
+
+
+def _store_section(digests: dict, topic: str, key: str, entry: dict):
+    digests.setdefault(topic, {})[key] = entry
+
+
+class TopicDigests:
+    """
+    Per-topic digests: short lists of facts (rules, figures, exceptions) made
+    by the LLM once per section of the manual, so questions can be generated
+    from a few hundred tokens instead of several raw chunks.
+
+    A section is `pages_per_section` consecutive pages of one source. Each
+    digest stores a fingerprint of the chunk texts it was built from; a
+    refresh only calls the LLM for sections whose fingerprint changed and
+    drops sections that no longer exist. Digests are persisted to a JSON file
+    next to the vector DB, shared by every worker: each process reloads it
+    when the file changes, and writes re-read it under a file lock so
+    workers never overwrite each other's sections.
+    """
+
+    def __init__(self, path: str, pages_per_section: int, max_facts: int):
+        self.path = path
+        self.pages_per_section = pages_per_section
+        self.max_facts = max_facts
+        self._digests = {}
+        self._dirty = set()
+        self._refreshes = {}
+        self._lock = threading.Lock()
+        self._version = None
+        self._metrics = {
+            "refreshes": 0,
+            "sections_built": 0,
+            "sections_unchanged": 0,
+            "sections_removed": 0,
+            "build_errors": 0,
+            "last_refresh_seconds": None
+        }
+
+    def _reload(self, force: bool = False):
+        """Picks up the file if another process rewrote it. Call with self._lock held."""
+        version = file_version(self.path)
+        if version is not None and (force or version != self._version):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._digests = json.load(f)
+            self._version = version
+
+    def _load(self):
+        with self._lock:
+            self._reload()
+
+    def _update(self, change):
+        """Applies change(digests) to the latest version on disk and saves it, atomically across workers."""
+        with self._lock, file_lock(f"{self.path}.lock"):
+            # Always re-read: the version check alone could miss a write from another worker
+            self._reload(force=True)
+            change(self._digests)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(self._digests, ensure_ascii=False))
+            os.replace(tmp_path, self.path)
+            self._version = file_version(self.path)
+
+    def mark_stale(self, topic: str = None):
+        """Invalidation listener: the topic's chunks changed, so its next refresh must look at them."""
+        with self._lock:
+            self._reload()
+            if topic is None:
+                self._dirty.update(self._digests)
+            else:
+                self._dirty.add(topic)
+
+    def drop(self, topic: str = None):
+        """Removes the digests of `topic` (all topics when None), e.g. after a reset."""
+        def change(digests):
+            if topic is None:
+                digests.clear()
+            else:
+                digests.pop(topic, None)
+
+        self._update(change)
+        with self._lock:
+            if topic is None:
+                self._dirty.clear()
+            else:
+                self._dirty.discard(topic)
+
+    def _sections(self, topic: str):
+        """Groups the topic's chunks into sections: key -> (chunks in reading order, fingerprint)."""
+        grouped = {}
+        for chunk in topic_documents(topic):
+            grouped.setdefault(_section_key(chunk.metadata, self.pages_per_section), []).append(chunk)
+        sections = {}
+        for key, chunks in grouped.items():
+            chunks.sort(key=lambda c: (c.metadata.get("page") or 0, c.metadata.get("start_index") or 0))
+            fingerprint = hashlib.sha256("\x00".join(c.page_content for c in chunks).encode("utf-8")).hexdigest()
+            sections[key] = (chunks, fingerprint)
+        return sections
+
+    def _refreshing(self, topic: str) -> bool:
+        task = self._refreshes.get(topic)
+        return task is not None and not task.done()
+
+    def schedule_refresh(self, topic: str):
+        """Starts a background refresh of `topic`, or makes the running one go over it again."""
+        with self._lock:
+            self._dirty.add(topic)
+        if not self._refreshing(topic):
+            self._refreshes[topic] = asyncio.create_task(self.refresh(topic))
+
+    async def refresh(self, topic: str):
+        """Rebuilds the digests of the sections of `topic` that changed since the last refresh."""
+        await run_blocking(self._load)
+        while True:
+            with self._lock:
+                self._dirty.discard(topic)
+            start = time.perf_counter()
+            try:
+                await self._refresh_once(topic)
+            except Exception:
+                with self._lock:
+                    self._metrics["build_errors"] += 1
+            with self._lock:
+                self._metrics["refreshes"] += 1
+                self._metrics["last_refresh_seconds"] = round(time.perf_counter() - start, 3)
+                # Another upload finished while we were building
+                if topic not in self._dirty:
+                    return
+
+    async def _refresh_once(self, topic: str):
+        sections = await run_blocking(self._sections, topic)
+        await run_blocking(self._load)
+        with self._lock:
+            stored = dict(self._digests.get(topic, {}))
+
+        removed = [key for key in stored if key not in sections]
+        if removed or not sections:
+            def drop_removed(digests):
+                entries = digests.get(topic, {})
+                for key in removed:
+                    entries.pop(key, None)
+                if not sections:
+                    digests.pop(topic, None)
+
+            await run_blocking(self._update, drop_removed)
+            with self._lock:
+                self._metrics["sections_removed"] += len(removed)
+
+        for key, (chunks, fingerprint) in sorted(sections.items()):
+            if stored.get(key, {}).get("fingerprint") == fingerprint:
+                with self._lock:
+                    self._metrics["sections_unchanged"] += 1
+                continue
+            try:
+                digest = await summarize_section(merge_chunks(chunks), topic, self.max_facts)
+            except Exception:
+                with self._lock:
+                    self._metrics["build_errors"] += 1
+                continue
+            pages = [c.metadata.get("page") or 0 for c in chunks]
+            entry = {
+                "source": chunks[0].metadata.get("source"),
+                "pages": [min(pages), max(pages)],
+                "chunks": len(chunks),
+                "fingerprint": fingerprint,
+                "digest": digest,
+                "built_at": time.time()
+            }
+            # Persist as we go so a restart keeps the sections already paid for
+            await run_blocking(self._update, partial(_store_section, topic=topic, key=key, entry=entry))
+            with self._lock:
+                self._metrics["sections_built"] += 1
+
+    async def documents(self, topic: str, limit: int = None):
+        """
+        The digests of `topic` as Documents, shuffled and cut to `limit`, or
+        [] when there are none yet. A stale topic gets a background refresh
+        and is served from its previous digests meanwhile.
+        """
+        await run_blocking(self._load)
+        with self._lock:
+            stale = topic in self._dirty or topic not in self._digests
+            entries = list(self._digests.get(topic, {}).values())
+        if stale and not self._refreshing(topic):
+            self.schedule_refresh(topic)
+        random.shuffle(entries)
+        return [
+            Document(
+                page_content=entry["digest"],
+                metadata={"topic": topic, "source": entry["source"], "pages": entry["pages"], "digest": True}
+            )
+            for entry in entries[:limit]
+        ]
+
+    def get(self, topic: str) -> dict:
+        self._load()
+        with self._lock:
+            return dict(self._digests.get(topic, {}))
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._reload()
+            sections = {topic: len(entries) for topic, entries in self._digests.items()}
+            stale = sorted(self._dirty)
+            metrics = dict(self._metrics)
+        return {
+            "sections": sections,
+            "stale": stale,
+            "refreshing": sorted(t for t in self._refreshes if self._refreshing(t)),
+            **metrics
+        }
+
+
+topic_digests = TopicDigests(
+    path=settings.topic_digests_path,
+    pages_per_section=settings.topic_digest_pages_per_section,
+    max_facts=settings.topic_digest_max_facts
+)
+
+on_topic_invalidated(topic_digests.mark_stale)
@@ -0,0 +1,91 @@
+"""
+Prompt size of the old context (every retrieved chunk joined as is) versus
+build_context (overlapping chunks of a page merged, cut at the endpoint's
+token budget), plus the time spent assembling it.
+
+Pages of synthetic manual text (short lines, as extracted from a PDF) are
+split exactly as during ingestion (chunk_size / chunk_overlap,
+add_start_index). Retrieval is simulated: each request takes k chunks around
+a few random hits, since a query about one rule tends to match several
+consecutive chunks of the same section.
+
+Usage:
+    python -m benchmarks.bench_context_packing [--pages 200] [--requests 500]
+"""
+import argparse
+import random
+import time
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.config import settings
+from app.services.context_builder import build_context, estimate_tokens
+
+WORDS = (
+    "el conductor deberá respetar la señalización vertical y horizontal "
+    "adecuando la velocidad a las condiciones de la vía y del vehículo "
+    "manteniendo la distancia de seguridad con el vehículo que le precede "
+    "en los adelantamientos se comprobará que el carril contrario está libre"
+).split()
+
+ENDPOINTS = (
+    ("question", 10, "context_budget_question"),
+    ("bulk", 10, "context_budget_bulk"),
+    ("chat", settings.default_search_k, "context_budget_chat")
+)
+
+
+def make_chunks(pages: int, rng):
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.chunk_size,
+        chunk_overlap=settings.chunk_overlap,
+        add_start_index=True
+    )
+    chunks = []
+    for number in range(pages):
+        # Extracted PDF text: short lines, one per row of the page
+        lines = [" ".join(rng.choices(WORDS, k=rng.randint(8, 14))) for _ in range(45)]
+        page = Document(page_content="\n".join(lines), metadata={"source": "manual.pdf", "page": number})
+        chunks.extend(splitter.split_documents([page]))
+    return chunks
+
+
+def retrieve(chunks, k: int, rng):
+    picked = []
+    while len(picked) < k:
+        hit = rng.randrange(len(chunks))
+        for index in range(hit, min(hit + rng.randint(1, 4), len(chunks))):
+            if index not in picked and len(picked) < k:
+                picked.append(index)
+    return [chunks[i] for i in picked]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    chunks = make_chunks(args.pages, rng)
+    print(f"{len(chunks)} chunks de {settings.chunk_size} caracteres con solape {settings.chunk_overlap}")
+    print(f"{'endpoint':<9} {'k':>3} {'presupuesto':>11} {'tokens antes':>13} {'tokens después':>15} {'ahorro':>7} {'tiempo':>9}")
+    for name, k, budget_field in ENDPOINTS:
+        budget = getattr(settings, budget_field)
+        before = after = elapsed = 0
+        for _ in range(args.requests):
+            retrieved = retrieve(chunks, k, rng)
+            before += estimate_tokens("\n\n".join(c.page_content for c in retrieved))
+            start = time.perf_counter()
+            context = build_context(retrieved, budget, name)
+            elapsed += time.perf_counter() - start
+            after += estimate_tokens(context)
+        print(
+            f"{name:<9} {k:>3} {budget:>11} {before / args.requests:>13.0f} {after / args.requests:>15.0f} "
+            f"{1 - after / before:>6.0%} {elapsed / args.requests * 1e6:>7.0f}µs"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Latency and completeness of /custom-test/generate: one call asking for all
+10 questions (the previous behaviour) versus concurrent per-topic shards.
+
+The LLM is simulated: a call takes a fixed prefill time plus a decode time
+per question, and fails with a given probability, like a local model that
+occasionally returns broken JSON. A failed single call loses the whole test;
+a failed shard is retried once and otherwise loses only its own questions.
+Retrieval returns immediately, so the numbers are about generation.
+
+Usage:
+    python -m benchmarks.bench_custom_test [--tests 20] [--per-question 0.3] [--prefill 0.2] [--failure-rate 0.1]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from app.config import settings
+from app.services.custom_test_service import generate_custom_test
+
+PROFILE = {"fallos_por_tema": {"señales": 5, "prioridad": 3, "alcohol": 2}}
+
+
+def make_llm(args, rng):
+    async def fake_llm(chain, inputs):
+        count = inputs["count"]
+        await asyncio.sleep(args.prefill + args.per_question * count)
+        if rng.random() < args.failure_rate:
+            raise ValueError("JSON inválido")
+        return {"preguntas": [
+            {"pregunta": f"{inputs['topic']} {n}", "opciones": ["A", "B", "C"], "respuesta_correcta": "A",
+             "explicacion": "Según el manual", "tema": inputs["topic"], "dificultad": "medio"}
+            for n in range(count)
+        ]}
+    return fake_llm
+
+
+async def single_call(fake_llm):
+    """The old path: one generation of all the questions, all or nothing."""
+    try:
+        result = await fake_llm(None, {"topic": "general", "count": 10})
+        return len(result["preguntas"])
+    except ValueError:
+        return 0
+
+
+async def run(mode: str, args, rng):
+    fake_llm = make_llm(args, rng)
+    latencies, delivered = [], []
+    for _ in range(args.tests):
+        start = time.perf_counter()
+        if mode == "una llamada":
+            delivered.append(await single_call(fake_llm))
+        else:
+            with patch("app.services.custom_test_service.run_llm", side_effect=fake_llm):
+                try:
+                    result = await generate_custom_test(PROFILE)
+                    delivered.append(len(result["preguntas"]))
+                except RuntimeError:
+                    delivered.append(0)
+        latencies.append(time.perf_counter() - start)
+    return latencies, delivered
+
+
+async def search(query, topic=None, k=None):
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tests", type=int, default=20)
+    parser.add_argument("--per-question", type=float, default=0.3)
+    parser.add_argument("--prefill", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    print(f"LLM simulado: {args.prefill}s + {args.per_question}s/pregunta, {args.failure_rate:.0%} de fallos, "
+          f"fragmentos de {settings.custom_test_shard_size}, concurrencia {settings.custom_test_concurrency}")
+    print(f"{'modo':<12} {'p50':>7} {'p95':>7} {'preguntas medias':>17} {'tests vacíos':>13}")
+    catalog = SimpleNamespace(topics=lambda: {"señales": {"chunks": 1}, "prioridad": {"chunks": 1}, "alcohol": {"chunks": 1}})
+    with patch("app.services.custom_test_service.topic_catalog", catalog), \
+         patch("app.services.custom_test_service.asearch_in_vector_db", side_effect=search):
+        for mode in ("una llamada", "fragmentos"):
+            latencies, delivered = asyncio.run(run(mode, args, random.Random(0)))
+            latencies.sort()
+            print(
+                f"{mode:<12} {statistics.median(latencies):>6.2f}s {latencies[int(len(latencies) * 0.95) - 1]:>6.2f}s "
+                f"{statistics.mean(delivered):>17.1f} {delivered.count(0):>13}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Memory per worker and query-embedding throughput with and without the
+embedding sidecar, for several worker counts.
+
+Each "worker" is a separate process, as with `uvicorn --workers N`. In the
+`local` mode every worker loads its own model; in the `sidecar` mode one
+EmbeddingServer process holds the model and workers connect through
+SidecarEmbeddings. All workers then embed distinct single queries as fast
+as they can, like the /chat and search endpoints do.
+
+Without --stand-in-mb the real EMBEDDINGS_MODEL is loaded (needs torch and
+the downloaded model). With --stand-in-mb N a NumPy model with N MB of
+weights and a small dense network stands in for it, which keeps the memory
+comparison meaningful on machines without the model.
+
+Usage:
+    python -m benchmarks.bench_embedding_sidecar [--workers 1,4,8] [--queries 200] [--stand-in-mb 90]
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+import statistics
+import tempfile
+import time
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.config import settings
+from app.services.embedding_sidecar import EmbeddingServer, SidecarEmbeddings
+
+DIM = 384
+
+
+class StandInEmbeddings(Embeddings):
+    """Token table of `mb` megabytes plus six dense layers, roughly MiniLM's shape."""
+
+    def __init__(self, mb: int):
+        rng = np.random.default_rng(0)
+        vocab = mb * 2**20 // (DIM * 4)
+        self.table = rng.standard_normal((vocab, DIM), dtype=np.float32)
+        self.layers = [
+            (rng.standard_normal((DIM, 4 * DIM), dtype=np.float32) / 20,
+             rng.standard_normal((4 * DIM, DIM), dtype=np.float32) / 40)
+            for _ in range(6)
+        ]
+
+    def embed_documents(self, texts):
+        rows = [[zlib.crc32(word.encode()) % len(self.table) for word in text.split()] or [0] for text in texts]
+        x = np.stack([self.table[ids].mean(axis=0) for ids in rows])
+        for up, down in self.layers:
+            x = x + np.tanh(x @ up) @ down
+        x /= np.linalg.norm(x, axis=1, keepdims=True)
+        return x.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
+
+
+def load_model(stand_in_mb: int) -> Embeddings:
+    if stand_in_mb:
+        return StandInEmbeddings(stand_in_mb)
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=settings.embeddings_model)
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_sidecar(socket_path, stand_in_mb, ready, rss):
+    model = load_model(stand_in_mb)
+    model.embed_query("calentamiento")
+    rss.value = rss_mb()
+    asyncio.run(EmbeddingServer(model, socket_path).serve(ready))
+
+
+def run_worker(index, socket_path, stand_in_mb, queries, barrier, results):
+    model = SidecarEmbeddings(socket_path) if socket_path else load_model(stand_in_mb)
+    model.embed_query("calentamiento")
+    memory = rss_mb()
+    barrier.wait()
+    latencies = []
+    start = time.perf_counter()
+    for i in range(queries):
+        t = time.perf_counter()
+        model.embed_query(f"pregunta {index} número {i} sobre señales de tráfico y prioridad de paso")
+        latencies.append(time.perf_counter() - t)
+    results.put((memory, time.perf_counter() - start, latencies))
+
+
+def measure(workers: int, mode: str, queries: int, stand_in_mb: int, tmp: str):
+    ctx = mp.get_context("spawn")
+    sidecar, sidecar_rss, socket_path = None, ctx.Value("d", 0.0), None
+    if mode == "sidecar":
+        socket_path = os.path.join(tmp, "embeddings.sock")
+        ready = ctx.Event()
+        sidecar = ctx.Process(target=run_sidecar, args=(socket_path, stand_in_mb, ready, sidecar_rss))
+        sidecar.start()
+        ready.wait()
+
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=run_worker, args=(i, socket_path, stand_in_mb, queries, barrier, results))
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    outcomes = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    if sidecar is not None:
+        sidecar.terminate()
+        sidecar.join()
+
+    worker_rss = statistics.mean(o[0] for o in outcomes)
+    wall = max(o[1] for o in outcomes)
+    latencies = sorted(l for o in outcomes for l in o[2])
+    return {
+        "worker_rss": worker_rss,
+        "sidecar_rss": sidecar_rss.value,
+        "total_rss": worker_rss * workers + sidecar_rss.value,
+        "throughput": workers * queries / wall,
+        "p50": latencies[len(latencies) // 2] * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,4,8")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--stand-in-mb", type=int, default=0)
+    args = parser.parse_args()
+
+    model = f"stand-in de {args.stand_in_mb} MB" if args.stand_in_mb else settings.embeddings_model
+    print(f"Modelo: {model}, {args.queries} consultas por worker, {os.cpu_count()} CPU")
+    print(f"{'workers':>7} {'modo':<8} {'RSS/worker':>11} {'RSS sidecar':>12} {'RSS total':>10} {'consultas/s':>12} {'p50':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            for mode in ("local", "sidecar"):
+                r = measure(workers, mode, args.queries, args.stand_in_mb, tmp)
+                print(
+                    f"{workers:>7} {mode:<8} {r['worker_rss']:>9.0f}MB {r['sidecar_rss']:>10.0f}MB "
+                    f"{r['total_rss']:>8.0f}MB {r['throughput']:>12.0f} {r['p50']:>7.2f}ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
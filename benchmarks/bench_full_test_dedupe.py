@@ -0,0 +1,124 @@
+"""
+LLM calls per accepted unique question in /admin/ai/generate-full-test,
+before (shuffled chunks in overlapping windows of 10, no dedupe: the whole
+test is generated again until it has enough distinct questions) and after
+(disjoint MMR batches, embedding dedupe, regeneration of just the missing
+questions).
+
+The manual is synthetic: pages from several areas with their own
+vocabulary, split exactly as during ingestion. The LLM is simulated: for a
+batch it asks about the `count` most "salient" lines of its chunks (a fixed
+hash order), so batches that share chunks repeat questions, like a real
+model drawn to the same rules. Embeddings come from the NumPy stand-in
+model of bench_embedding_sidecar.
+
+Usage:
+    python -m benchmarks.bench_full_test_dedupe [--questions 10,30,50] [--trials 20]
+"""
+import argparse
+import asyncio
+import random
+import zlib
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.config import settings
+from app.routes.admin_ai import get_full_test
+from app.services.full_test_planner import full_test_stats
+from benchmarks.bench_embedding_sidecar import StandInEmbeddings
+
+AREAS = 6
+
+
+def make_chunks(pages: int, rng):
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.chunk_size,
+        chunk_overlap=settings.chunk_overlap,
+        add_start_index=True
+    )
+    vocabularies = [[f"área{a}_término{i}" for i in range(60)] for a in range(AREAS)]
+    chunks = []
+    for number in range(pages):
+        words = vocabularies[number % AREAS]
+        lines = [" ".join(rng.choices(words, k=rng.randint(5, 9))) for _ in range(45)]
+        page = Document(page_content="\n".join(lines), metadata={"topic": "normas", "source": "manual.pdf", "page": number})
+        chunks.extend(splitter.split_documents([page]))
+    return chunks
+
+
+async def fake_bulk(chunks, topic, count):
+    lines = {line for chunk in chunks for line in chunk.page_content.split("\n") if line}
+    salient = sorted(lines, key=lambda line: zlib.crc32(line.encode()))[:count]
+    return {"preguntas": [
+        {"pregunta": f"¿{line}?", "opciones": ["A", "B", "C"], "respuesta_correcta": "A", "explicacion": line}
+        for line in salient
+    ]}
+
+
+def old_plan(all_chunks, num_questions: int):
+    """The previous planner: shuffled chunks, windows of 10 every 5."""
+    all_chunks = list(all_chunks)
+    random.shuffle(all_chunks)
+    batches = -(-num_questions // 5)
+    jobs = []
+    for i in range(batches):
+        start = (i * 5) % len(all_chunks)
+        jobs.append((all_chunks[start:start + 10] or all_chunks[:10], min(5, num_questions - i * 5)))
+    return jobs
+
+
+async def run_old(retrieved, num_questions: int, max_rounds: int = 5):
+    unique, calls = set(), 0
+    for _ in range(max_rounds):
+        for batch, count in old_plan(retrieved, num_questions):
+            calls += 1
+            result = await fake_bulk(batch, "normas", count)
+            unique.update(q["pregunta"] for q in result["preguntas"])
+        if len(unique) >= num_questions:
+            break
+    return calls, min(len(unique), num_questions)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", default="10,30,50")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=120)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    random.seed(0)
+    chunks = make_chunks(args.pages, rng)
+    fake_manager = SimpleNamespace(embeddings=StandInEmbeddings(20))
+
+    print(f"{len(chunks)} chunks en {AREAS} áreas, k=100, {args.trials} tests por fila, umbral {settings.full_test_dedupe_threshold}")
+    print(f"{'preguntas':>9} {'modo':<7} {'llamadas':>9} {'únicas':>7} {'llamadas/única':>15} {'duplicados':>11}")
+    for num_questions in [int(q) for q in args.questions.split(",")]:
+        old_calls = old_unique = 0
+        before = full_test_stats.stats()
+        for _ in range(args.trials):
+            retrieved = rng.sample(chunks, 100)
+            calls, unique = asyncio.run(run_old(retrieved, num_questions))
+            old_calls += calls
+            old_unique += unique
+
+            with patch("app.routes.admin_ai.asearch_in_vector_db", return_value=retrieved), \
+                 patch("app.routes.admin_ai.generate_bulk_questions", side_effect=fake_bulk), \
+                 patch("app.services.full_test_planner.vector_manager", fake_manager):
+                asyncio.run(get_full_test("normas", num_questions, use_digests=False))
+        after = full_test_stats.stats()
+        new_calls = after["llm_calls"] - before["llm_calls"]
+        new_unique = after["questions_accepted"] - before["questions_accepted"]
+        generated = after["questions_generated"] - before["questions_generated"]
+        duplicates = after["duplicates_dropped"] - before["duplicates_dropped"]
+        print(f"{num_questions:>9} {'antes':<7} {old_calls / args.trials:>9.1f} {old_unique / args.trials:>7.1f} "
+              f"{old_calls / max(old_unique, 1):>15.3f} {'-':>11}")
+        print(f"{num_questions:>9} {'después':<7} {new_calls / args.trials:>9.1f} {new_unique / args.trials:>7.1f} "
+              f"{new_calls / max(new_unique, 1):>15.3f} {duplicates / max(generated, 1):>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
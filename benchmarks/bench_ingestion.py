@@ -0,0 +1,174 @@
+"""
+Ingestion throughput and peak memory of the old load-everything path
+(PyPDFLoader.load -> split everything -> Chroma.add_documents) versus the streaming
+pipeline in process_pdf_to_vector_db (parallel page parsing, page-by-page
+splitting, batched embedding and writes), plus the cost of re-uploading the
+same PDF once its chunks are already stored under their content hash.
+
+A synthetic text PDF is generated on the fly and each mode runs in its own
+subprocess against a throwaway Chroma directory, so peak RSS is measured
+independently. Embeddings are a deterministic fake to keep the numbers about
+parsing, splitting and storage rather than the model.
+
+Usage:
+    python -m benchmarks.bench_ingestion [--pages 400] [--workers 4] [--batch-size 64]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+WORDS = (
+    "el conductor debera respetar la señalizacion vertical y horizontal "
+    "adecuando la velocidad a las condiciones de la via y del vehiculo "
+    "manteniendo la distancia de seguridad con el vehiculo que le precede"
+).split()
+
+
+def make_text_pdf(path: str, pages: int, lines_per_page: int = 45):
+    """Writes a minimal multi-page PDF with plain Helvetica text."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    page_ids = []
+    for number in range(pages):
+        lines = []
+        for i in range(lines_per_page):
+            words = [WORDS[(number * 7 + i * 3 + j) % len(WORDS)] for j in range(12)]
+            lines.append(f"Pagina {number + 1} linea {i + 1}: " + " ".join(words))
+        text = "".join(f"({line}) Tj T* " for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text}ET".encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def run_mode(mode: str, pdf_path: str, chroma_path: str):
+    """Runs one ingestion in this process and prints its stats as JSON."""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from app.config import settings
+
+    settings.chroma_path = chroma_path
+    from app.services.rag_service import vector_manager, process_pdf_to_vector_db
+    vector_manager._embeddings = DeterministicFakeEmbedding(size=384)
+
+    start = time.perf_counter()
+    if mode == "legacy":
+        from langchain_community.document_loaders import PyPDFLoader
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        documents = PyPDFLoader(pdf_path).load()
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.chunk_size,
+            chunk_overlap=settings.chunk_overlap,
+            add_start_index=True
+        )
+        chunks = splitter.split_documents(documents)
+        pages = len(documents)
+        vector_manager.db.add_documents(chunks)
+        written = len(chunks)
+    else:
+        progress = {}
+        written = process_pdf_to_vector_db(pdf_path, "bench", progress=lambda **c: progress.update(c))
+        pages = progress["pages_parsed"]
+    elapsed = time.perf_counter() - start
+
+    # Uploading the same manual again only hashes and looks up its chunks
+    reupload_start = time.perf_counter()
+    if mode == "streaming":
+        process_pdf_to_vector_db(pdf_path, "bench", replace_source=True)
+    reupload = time.perf_counter() - reupload_start
+
+    # Reap the parse workers so their peak RSS shows up in RUSAGE_CHILDREN
+    from app.services import executor
+    if executor._parse_pool is not None:
+        executor._parse_pool.shutdown()
+    # ru_maxrss is in KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(json.dumps({
+        "pages": pages,
+        "chunks": written,
+        "seconds": elapsed,
+        "reupload_seconds": reupload,
+        "peak_rss_mb": own / 1024,
+        "peak_child_rss_mb": children / 1024
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pages-per-task", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--run", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    parser.add_argument("--chroma", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_mode(args.run, args.pdf, args.chroma)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "synthetic.pdf")
+        make_text_pdf(pdf_path, args.pages)
+        print(f"PDF sintético: {args.pages} páginas, {os.path.getsize(pdf_path) / 1e6:.1f} MB")
+
+        runs = [("legacy", 1), ("streaming", 1), ("streaming", args.workers)]
+        for mode, workers in runs:
+            env = dict(
+                os.environ,
+                PDF_PARSE_WORKERS=str(workers),
+                PDF_PAGES_PER_TASK=str(args.pages_per_task),
+                EMBEDDING_BATCH_SIZE=str(args.batch_size)
+            )
+            chroma_path = os.path.join(tmp, f"chroma_{mode}_{workers}")
+            result = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_ingestion",
+                 "--run", mode, "--pdf", pdf_path, "--chroma", chroma_path],
+                env=env, capture_output=True, text=True
+            )
+            label = mode if mode == "legacy" else f"{mode} ({workers} proc)"
+            if result.returncode != 0:
+                # e.g. the legacy path exceeding Chroma's max batch size on large PDFs
+                print(f"{label:<22} error: {result.stderr.strip().splitlines()[-1]}")
+                continue
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(
+                f"{label:<22} {stats['pages'] / stats['seconds']:8.1f} pág/s  "
+                f"{stats['chunks']:6d} chunks  "
+                f"pico RSS {stats['peak_rss_mb']:7.1f} MB  "
+                f"(workers {stats['peak_child_rss_mb']:.1f} MB)"
+            )
+            if mode == "streaming":
+                print(f"{'':<22} re-subida del mismo PDF: {stats['reupload_seconds']:.2f} s "
+                      f"frente a {stats['seconds']:.2f} s de la ingesta completa")
+
+
+if __name__ == "__main__":
+    main()
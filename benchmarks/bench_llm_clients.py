@@ -0,0 +1,126 @@
+"""
+Per-request overhead of building a new LLM client on every call (old behaviour)
+versus reusing the shared client from the LLM registry.
+
+A local stub HTTP server answers Ollama's /api/chat instantly, so the timings
+only reflect client construction, connection setup and prompt/parser work.
+The stub also counts TCP connections to show keep-alive reuse.
+
+Usage:
+    python -m benchmarks.bench_llm_clients [--requests 200] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from app.config import settings
+from app.services.llm_provider import llm_registry
+from app.services.llm_service import QuestionSchema, generate_test_from_chunks
+
+
+QUESTION = json.dumps({
+    "pregunta": "¿Velocidad máxima en vía urbana?",
+    "opciones": ["30 km/h", "50 km/h", "80 km/h"],
+    "respuesta_correcta": "50 km/h",
+    "explicacion": "Reglamento General de Circulación"
+})
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        StubOllamaHandler.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        lines = [
+            {"model": "stub", "created_at": "2024-01-01T00:00:00Z",
+             "message": {"role": "assistant", "content": QUESTION}, "done": False},
+            {"model": "stub", "created_at": "2024-01-01T00:00:00Z",
+             "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop"}
+        ]
+        body = "".join(json.dumps(line) + "\n" for line in lines).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+async def per_call_client(chunks, topic):
+    """Baseline: what the services did before the registry."""
+    from langchain_ollama import ChatOllama
+    llm = ChatOllama(model=settings.llm_model, format="json", base_url=settings.ollama_base_url)
+    parser = JsonOutputParser(pydantic_object=QuestionSchema)
+    prompt = ChatPromptTemplate.from_template("{topic}\n{context}\n{format_instructions}")
+    chain = prompt | llm | parser
+    return await chain.ainvoke({
+        "topic": topic,
+        "context": "\n\n".join(c.page_content for c in chunks),
+        "format_instructions": parser.get_format_instructions()
+    })
+
+
+async def run_mode(func, requests: int, concurrency: int):
+    chunks = [Document(page_content="En vías urbanas el límite es 50 km/h.")] * 4
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await func(chunks, "velocidad")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    StubOllamaHandler.connections = 0
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed, StubOllamaHandler.connections
+
+
+def report(name, latencies, elapsed, connections):
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{name:<22} mean={statistics.mean(ordered):6.2f} ms  p95={p95:6.2f} ms  "
+          f"throughput={len(ordered) / elapsed:7.1f} req/s  tcp_connections={connections}")
+
+
+async def main(requests: int, concurrency: int):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with patch.object(settings, "llm_provider", "ollama"), patch.object(settings, "ollama_base_url", base_url):
+        llm_registry.reset()
+        # Warm-up both paths once
+        await per_call_client([Document(page_content="x")], "x")
+        await generate_test_from_chunks([Document(page_content="x")], "x")
+
+        report("per-call client", *await run_mode(per_call_client, requests, concurrency))
+        report("shared registry client", *await run_mode(generate_test_from_chunks, requests, concurrency))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,113 @@
+"""
+Recall and latency of the NumPy vector backend against Chroma.
+
+A corpus shaped like ours (a few thousand chunks over a handful of topics,
+384-dimensional unit vectors clustered by topic) is written to a throwaway
+Chroma directory through VectorDBManager. search_by_vector is then timed
+with vector_backend=chroma and with vector_backend=numpy for each matrix
+dtype, and recall@k is measured against an exact float64 search.
+
+Usage:
+    python -m benchmarks.bench_numpy_backend [--chunks 3000] [--topics 5] [--queries 300] [--k 4]
+"""
+import argparse
+import tempfile
+import time
+from unittest.mock import patch
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.config import settings
+from app.services.numpy_store import NumpyVectorIndex
+from app.services.rag_service import vector_manager, search_by_vector, _fetch_topic_chunks
+from app.services.topic_catalog import TopicCatalog
+
+DIM = 384
+# Spread of chunks and queries around their topic's center
+NOISE = 3.6 / np.sqrt(DIM)
+
+
+def unit(vectors):
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def make_corpus(chunks: int, topics: int, rng):
+    centers = unit(rng.standard_normal((topics, DIM)))
+    labels = rng.integers(0, topics, chunks)
+    vectors = unit(centers[labels] + NOISE * rng.standard_normal((chunks, DIM)))
+    return centers, labels, vectors.astype(np.float32)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=3000)
+    parser.add_argument("--topics", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    centers, labels, vectors = make_corpus(args.chunks, args.topics, rng)
+    query_topics = rng.integers(0, args.topics, args.queries)
+    queries = unit(centers[query_topics] + NOISE * 1.1 * rng.standard_normal((args.queries, DIM))).astype(np.float32)
+
+    # Exact answers: brute force in float64 within the query's topic
+    exact = []
+    for query, topic in zip(queries, query_topics):
+        rows = np.flatnonzero(labels == topic)
+        scores = vectors[rows].astype(np.float64) @ query.astype(np.float64)
+        exact.append({f"chunk {i}" for i in rows[np.argsort(-scores)[:args.k]]})
+
+    vector_manager._embeddings = DeterministicFakeEmbedding(size=DIM)
+    with tempfile.TemporaryDirectory() as tmp, \
+         patch.object(settings, "chroma_path", tmp), \
+         patch.object(settings, "vector_layout", "shared"):
+        vector_manager.reset_connection()
+        catalog = TopicCatalog(f"{tmp}/catalog.json", lambda: vector_manager.collections())
+        for topic in range(args.topics):
+            rows = np.flatnonzero(labels == topic)
+            docs = [
+                Document(page_content=f"chunk {i}", metadata={"topic": f"tema_{topic}", "source": "bench.pdf"})
+                for i in rows
+            ]
+            for start in range(0, len(docs), 2000):
+                vector_manager.add_embedded_documents(
+                    docs[start:start + 2000], vectors[rows[start:start + 2000]].tolist(), topic=f"tema_{topic}"
+                )
+        catalog.rebuild()
+
+        def fingerprints():
+            return {t: [e["chunks"], e["last_updated"]] for t, e in catalog.topics().items()}
+
+        runs = [("chroma", None)] + [("numpy", dtype) for dtype in ("float32", "float16", "int8")]
+        print(f"{args.chunks} chunks, {args.topics} temas, {args.queries} consultas, k={args.k}")
+        print(f"{'backend':<16} {'recall@k':>9} {'p50':>9} {'p99':>9}")
+        for backend, dtype in runs:
+            index = NumpyVectorIndex(f"{tmp}/numpy", dtype or "float32", True, _fetch_topic_chunks, fingerprints)
+            with patch.object(settings, "vector_backend", backend), \
+                 patch("app.services.rag_service.numpy_index", index):
+                # Warm-up: loads the HNSW segments or builds the matrices
+                for query, topic in zip(queries[:20], query_topics[:20]):
+                    search_by_vector(query.tolist(), f"tema_{topic}", args.k)
+
+                timings, hits = [], 0
+                for query, topic, expected in zip(queries, query_topics, exact):
+                    start = time.perf_counter()
+                    results = search_by_vector(query.tolist(), f"tema_{topic}", args.k)
+                    timings.append(time.perf_counter() - start)
+                    hits += len(expected & {doc.page_content for doc in results})
+
+            label = backend if dtype is None else f"{backend} {dtype}"
+            recall = hits / (args.k * args.queries)
+            print(f"{label:<16} {recall:>9.3f} {percentile(timings, 50):>7.2f}ms {percentile(timings, 99):>7.2f}ms")
+        vector_manager.reset_connection()
+
+
+if __name__ == "__main__":
+    main()
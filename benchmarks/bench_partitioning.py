@@ -0,0 +1,101 @@
+"""
+Query latency of the shared collection with a topic filter versus one
+collection per topic, as the number of topics grows.
+
+Both layouts are filled with the same random unit vectors through
+VectorDBManager in throwaway Chroma directories, then search_by_vector is
+timed for single-topic queries and asearch_by_vector for cross-topic
+(topic=None) queries, which fan out over every collection in the per_topic
+layout in parallel on the blocking pool.
+
+Usage:
+    python -m benchmarks.bench_partitioning [--topics 1,4,16,64] [--chunks-per-topic 200] [--queries 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from unittest.mock import patch
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.config import settings
+from app.services.rag_service import vector_manager, search_by_vector, asearch_by_vector
+from app.services.topic_catalog import TopicCatalog
+
+DIM = 384
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1000
+
+
+def fill(topic_count: int, chunks_per_topic: int, rng):
+    for t in range(topic_count):
+        topic = f"tema_{t}"
+        vectors = rng.standard_normal((chunks_per_topic, DIM)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        docs = [
+            Document(page_content=f"{topic} chunk {i}", metadata={"topic": topic, "source": "bench.pdf"})
+            for i in range(chunks_per_topic)
+        ]
+        vector_manager.add_embedded_documents(docs, vectors.tolist(), topic=topic)
+
+
+def time_queries(topic_count: int, queries: int, rng, cross_topic: bool):
+    timings = []
+    loop = asyncio.new_event_loop()
+    for _ in range(queries):
+        query = rng.standard_normal(DIM).astype(np.float32)
+        query = (query / np.linalg.norm(query)).tolist()
+        start = time.perf_counter()
+        if cross_topic:
+            # As the API runs it: from the event loop, fanned out on the pool
+            loop.run_until_complete(asearch_by_vector(query, None, 4))
+        else:
+            search_by_vector(query, f"tema_{random.randrange(topic_count)}", 4)
+        timings.append(time.perf_counter() - start)
+    loop.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--topics", default="1,4,16,64")
+    parser.add_argument("--chunks-per-topic", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    # Vectors are supplied directly; the embedding function is never called
+    vector_manager._embeddings = DeterministicFakeEmbedding(size=DIM)
+    print(f"{'temas':>6} {'layout':<10} {'p50 tema':>10} {'p95 tema':>10} {'p50 todos':>10} {'p95 todos':>10}")
+
+    for topic_count in [int(t) for t in args.topics.split(",")]:
+        for layout in ("shared", "per_topic"):
+            rng = np.random.default_rng(topic_count)
+            random.seed(topic_count)
+            with tempfile.TemporaryDirectory() as tmp, \
+                 patch.object(settings, "chroma_path", tmp), \
+                 patch.object(settings, "vector_layout", layout), \
+                 patch("app.services.rag_service.topic_catalog",
+                       TopicCatalog(os.path.join(tmp, "topic_catalog.json"), vector_manager.collections)):
+                vector_manager.reset_connection()
+                fill(topic_count, args.chunks_per_topic, rng)
+                single = time_queries(topic_count, args.queries, rng, cross_topic=False)
+                cross = time_queries(topic_count, args.queries, rng, cross_topic=True)
+                vector_manager.reset_connection()
+
+            print(
+                f"{topic_count:>6} {layout:<10} "
+                f"{percentile(single, 0.5):>8.2f}ms {percentile(single, 0.95):>8.2f}ms "
+                f"{percentile(cross, 0.5):>8.2f}ms {percentile(cross, 0.95):>8.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Throughput and latency of query embeddings with and without the
+micro-batcher, for several numbers of concurrent clients.
+
+Each client is an asyncio task that embeds distinct questions back to back,
+like concurrent /chat requests. Without batching every question goes
+through the blocking thread pool and calls embed_query on its own (the old
+path); with batching the clients await QueryBatcher.aembed and share model
+calls.
+
+Without --stand-in-mb the real EMBEDDINGS_MODEL is used (needs torch and
+the downloaded model); with it, the NumPy stand-in model of
+bench_embedding_sidecar.
+
+Usage:
+    python -m benchmarks.bench_query_batching [--clients 1,16,64] [--queries 20] [--stand-in-mb 90]
+"""
+import argparse
+import asyncio
+import time
+
+from app.config import settings
+from app.services.executor import run_blocking
+from app.services.query_batcher import QueryBatcher, embed_queries
+from benchmarks.bench_embedding_sidecar import load_model
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1000
+
+
+async def run_clients(embed, clients: int, queries: int):
+    latencies = []
+
+    async def client(index):
+        for i in range(queries):
+            start = time.perf_counter()
+            await embed(f"cliente {index}: ¿qué indica la señal número {i} en una intersección?")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(c) for c in range(clients)])
+    return clients * queries / (time.perf_counter() - start), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default="1,16,64")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--stand-in-mb", type=int, default=0)
+    parser.add_argument("--window-ms", type=float, default=settings.query_batch_window_ms)
+    parser.add_argument("--max-batch", type=int, default=settings.query_batch_max_size)
+    args = parser.parse_args()
+
+    model = load_model(args.stand_in_mb)
+    model.embed_query("calentamiento")
+    batcher = QueryBatcher(lambda texts: embed_queries(model, texts), args.max_batch, args.window_ms / 1000)
+
+    async def unbatched(text):
+        return await run_blocking(model.embed_query, text)
+
+    name = f"stand-in de {args.stand_in_mb} MB" if args.stand_in_mb else settings.embeddings_model
+    print(f"Modelo: {name}, ventana {args.window_ms} ms, lote máximo {args.max_batch}, {args.queries} consultas por cliente")
+    print(f"{'clientes':>8} {'modo':<10} {'consultas/s':>12} {'p50':>9} {'p99':>9} {'lote medio':>11}")
+    for clients in [int(c) for c in args.clients.split(",")]:
+        for mode, embed in (("individual", unbatched), ("lotes", batcher.aembed)):
+            before = batcher.stats()
+            throughput, latencies = asyncio.run(run_clients(embed, clients, args.queries))
+            after = batcher.stats()
+            batches = after["batches"] - before["batches"]
+            avg_batch = (after["queries"] - before["queries"]) / batches if batches else 1.0
+            print(
+                f"{clients:>8} {mode:<10} {throughput:>12.0f} {percentile(latencies, 0.5):>7.2f}ms "
+                f"{percentile(latencies, 0.99):>7.2f}ms {avg_batch:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
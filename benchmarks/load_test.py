@@ -0,0 +1,139 @@
+"""
+Load test: latency of `/` and `/chat/` while long `/admin/ai/generate-full-test`
+calls are in flight.
+
+The LLM and the vector DB are replaced by stubs with realistic behaviour: the
+LLM stub sleeps asynchronously on `ainvoke` (and blocks on `invoke`, like a
+real HTTP client would), and the search stub blocks its thread like Chroma.
+If any route still blocks the event loop, the latencies of the cheap endpoints
+jump to the duration of the slow calls.
+
+`/chat/` also goes through the process-wide LLM_MAX_CONCURRENCY limit, so
+once the full tests alone saturate it, chat calls queue for a slot. Keep
+`full_tests * FULL_TEST_BATCH_CONCURRENCY` under that limit to measure the
+event loop in isolation.
+
+Usage:
+    python -m benchmarks.load_test [--llm-seconds 2.0] [--full-tests 2]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from unittest.mock import patch
+
+import httpx
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from app.main import app
+from app.services.executor import run_blocking
+
+
+def make_fake_llm(seconds: float):
+    payload = json.dumps({"preguntas": [{
+        "pregunta": "¿Velocidad máxima en vía urbana?",
+        "opciones": ["30 km/h", "50 km/h", "80 km/h"],
+        "respuesta_correcta": "50 km/h",
+        "explicacion": "Reglamento General de Circulación"
+    }] * 5})
+
+    def invoke(_):
+        time.sleep(seconds)
+        return AIMessage(content=payload)
+
+    async def ainvoke(_):
+        await asyncio.sleep(seconds)
+        return AIMessage(content=payload)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+
+def fake_search(query, topic=None, k=None):
+    # Chroma + embedding cost, blocking the calling thread
+    time.sleep(0.02)
+    return [Document(page_content=f"Norma {i}", metadata={"topic": topic or "general"}) for i in range(k or 4)]
+
+
+async def fake_asearch(query, topic=None, k=None):
+    # Like asearch_in_vector_db: the blocking search runs on the pool
+    return await run_blocking(fake_search, query, topic, k)
+
+
+def fake_embed_texts(texts):
+    # Vectors for chunks without a stored embedding and for questions: random, so nothing is a duplicate
+    vectors = np.random.default_rng().normal(size=(len(texts), 64)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+async def fake_embed(query):
+    # Like aembed_query: waits on the batcher without blocking the loop
+    await asyncio.sleep(0.01)
+    return [0.1] * 384
+
+
+async def measure(client: httpx.AsyncClient, method: str, url: str, samples: int, **kwargs):
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.05)
+    return latencies
+
+
+def summary(latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    return f"p50={statistics.median(ordered):7.1f} ms  p95={p95:7.1f} ms  max={ordered[-1]:7.1f} ms"
+
+
+async def run(llm_seconds: float, full_tests: int, samples: int):
+    chat_body = {"question": "¿Puedo adelantar en un paso de peatones?", "topic": "normas"}
+    fake_llm = make_fake_llm(llm_seconds)
+
+    with patch("app.routes.admin_ai.asearch_in_vector_db", side_effect=fake_asearch), \
+         patch("app.services.full_test_planner.embed_texts", side_effect=fake_embed_texts), \
+         patch("app.routes.chat.aembed_query", side_effect=fake_embed), \
+         patch("app.routes.chat.asearch_by_vector", side_effect=fake_asearch), \
+         patch("app.routes.chat.settings.answer_cache_enabled", False), \
+         patch("app.services.llm_service.get_llm", return_value=fake_llm), \
+         patch("app.services.llm_service.get_chat_llm", return_value=make_fake_llm(0.05)):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+            idle_root = await measure(client, "GET", "/", samples)
+            idle_chat = await measure(client, "POST", "/chat/", samples, json=chat_body)
+
+            background = [
+                asyncio.create_task(client.get(
+                    "/admin/ai/generate-full-test",
+                    params={"topic": "normas", "num_questions": 30}
+                ))
+                for _ in range(full_tests)
+            ]
+            await asyncio.sleep(0.1)
+            busy_root = await measure(client, "GET", "/", samples)
+            busy_chat = await measure(client, "POST", "/chat/", samples, json=chat_body)
+            start = time.perf_counter()
+            await asyncio.gather(*background)
+            drain = time.perf_counter() - start
+
+    print(f"LLM latency per call: {llm_seconds:.1f}s, concurrent full tests: {full_tests}")
+    print(f"GET /      idle: {summary(idle_root)}")
+    print(f"GET /      busy: {summary(busy_root)}")
+    print(f"POST /chat idle: {summary(idle_chat)}")
+    print(f"POST /chat busy: {summary(busy_chat)}")
+    print(f"Full tests finished {drain:.2f}s after the last probe")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-seconds", type=float, default=2.0)
+    parser.add_argument("--full-tests", type=int, default=2)
+    parser.add_argument("--samples", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.llm_seconds, args.full_tests, args.samples))
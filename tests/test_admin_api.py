@@ -0,0 +1,157 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from app.main import app
+
+client = TestClient(app)
+
+fake_chunks = [Document(page_content=f"Norma {i}", metadata={"topic": "normas"}) for i in range(20)]
+
+
+@pytest.fixture(autouse=True)
+def fake_planner_embeddings():
+    # Random-looking vectors per text: distinct texts are never near-duplicates
+    fake = SimpleNamespace(embeddings=DeterministicFakeEmbedding(size=64))
+    with patch("app.services.full_test_planner.vector_manager", fake):
+        yield
+
+
+def make_question(label):
+    return {
+        "pregunta": f"Pregunta {label}",
+        "opciones": ["A", "B", "C"],
+        "respuesta_correcta": "A",
+        "explicacion": "Porque A"
+    }
+
+
+def test_full_test_batches_run_concurrently():
+    calls = []
+
+    async def slow_bulk(chunks, topic, count):
+        batch = len(calls)
+        calls.append(count)
+        await asyncio.sleep(0.3)
+        return {"preguntas": [make_question(f"{batch}-{n}") for n in range(count)]}
+
+    with patch("app.routes.admin_ai.asearch_in_vector_db", return_value=list(fake_chunks)), \
+         patch("app.routes.admin_ai.generate_bulk_questions", side_effect=slow_bulk), \
+         patch("app.routes.admin_ai.settings.full_test_batch_concurrency", 3):
+        start = time.perf_counter()
+        response = client.get("/admin/ai/generate-full-test", params={"topic": "normas", "num_questions": 12})
+        elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_questions"] == 12
+    assert calls == [5, 5, 2]
+    assert [q["pregunta"] for q in data["test"]][:2] == ["Pregunta 0-0", "Pregunta 0-1"]
+    # Three batches of 0.3s each should overlap instead of adding up
+    assert elapsed < 0.8
+
+
+def test_full_test_reports_failed_batch_and_keeps_others():
+    attempts = {"count": 0}
+
+    async def flaky_bulk(chunks, topic, count):
+        attempts["count"] += 1
+        if count == 2:
+            raise ValueError("JSON inválido")
+        return {"preguntas": [make_question(n) for n in range(count)]}
+
+    with patch("app.routes.admin_ai.asearch_in_vector_db", return_value=list(fake_chunks)), \
+         patch("app.routes.admin_ai.generate_bulk_questions", side_effect=flaky_bulk), \
+         patch("app.routes.admin_ai.settings.full_test_batch_retries", 1):
+        response = client.get("/admin/ai/generate-full-test", params={"topic": "normas", "num_questions": 7})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_questions"] == 5
+    assert data["failed_batches"][0]["batch"] == 1
+    assert "JSON inválido" in data["failed_batches"][0]["error"]
+    # One successful call plus the failing batch tried twice
+    assert attempts["count"] == 3
+
+
+def test_full_test_stream_drops_invalid_and_regenerates():
+    # Second question lacks "explicacion", so it is dropped and regenerated
+    bulk_output = json.dumps({"preguntas": [
+        make_question("uno"),
+        {"pregunta": "Incompleta", "opciones": ["A", "B", "C"], "respuesta_correcta": "A"},
+        make_question("tres")
+    ]})
+    fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content=bulk_output)]))
+
+    with patch("app.routes.admin_ai.asearch_in_vector_db", return_value=list(fake_chunks)), \
+         patch("app.services.llm_service.get_llm", return_value=fake_llm), \
+         patch("app.routes.admin_ai.generate_test_from_chunks", return_value=make_question("extra")):
+        response = client.get("/admin/ai/generate-full-test/stream", params={"topic": "normas", "num_questions": 3})
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    questions = [line["question"]["pregunta"] for line in lines if line["type"] == "question"]
+    assert questions == ["Pregunta uno", "Pregunta tres", "Pregunta extra"]
+    assert lines[-1] == {
+        "type": "done",
+        "topic": "normas",
+        "total_questions": 3,
+        "dropped": 1,
+        "duplicates": 0,
+        "failed_batches": []
+    }
+
+
+def test_full_test_drops_duplicates_and_regenerates_only_the_missing():
+    calls = []
+
+    async def repetitive_bulk(chunks, topic, count):
+        calls.append((count, {c.page_content for c in chunks}))
+        if len(calls) == 1:
+            return {"preguntas": [make_question(n) for n in range(count)]}
+        # The second batch repeats two questions of the first one
+        if len(calls) == 2:
+            return {"preguntas": [make_question(0), make_question(1)] + [make_question(f"b{n}") for n in range(count - 2)]}
+        return {"preguntas": [make_question(f"extra{n}") for n in range(count)]}
+
+    chunks = [Document(page_content=f"Norma {i}", metadata={"topic": "normas"}) for i in range(30)]
+    with patch("app.routes.admin_ai.asearch_in_vector_db", return_value=chunks), \
+         patch("app.routes.admin_ai.generate_bulk_questions", side_effect=repetitive_bulk), \
+         patch("app.routes.admin_ai.settings.full_test_batch_concurrency", 1):
+        response = client.get("/admin/ai/generate-full-test", params={"topic": "normas", "num_questions": 10})
+
+    data = response.json()
+    assert data["total_questions"] == 10
+    assert len({q["pregunta"] for q in data["test"]}) == 10
+    assert data["duplicates_removed"] == 2
+    # Two batches on disjoint chunks, then one call for just the two missing questions on unused chunks
+    assert [count for count, _ in calls] == [5, 5, 2]
+    assert not calls[0][1] & calls[1][1]
+    assert not calls[2][1] & (calls[0][1] | calls[1][1])
+
+
+def test_generate_question_with_digests_bypasses_the_bank():
+    digests = [Document(page_content="- Límite urbano: 50 km/h", metadata={"topic": "normas", "digest": True})]
+
+    async def fake_pop(topic):
+        return make_question("del banco")
+
+    async def fake_generate(chunks, topic):
+        return make_question(chunks[0].page_content)
+
+    with patch("app.routes.admin_ai.settings.question_bank_enabled", True), \
+         patch("app.routes.admin_ai.question_bank.pop", side_effect=fake_pop), \
+         patch("app.routes.admin_ai.topic_digests.documents", return_value=digests), \
+         patch("app.routes.admin_ai.generate_test_from_chunks", side_effect=fake_generate):
+        banked = client.get("/admin/ai/generate-question", params={"topic": "normas"})
+        digested = client.get("/admin/ai/generate-question", params={"topic": "normas", "use_digests": True})
+
+    assert banked.json()["pregunta"] == "Pregunta del banco"
+    assert digested.json()["pregunta"] == "Pregunta - Límite urbano: 50 km/h"
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.config import settings
+from app.database import create_engine_from_settings, pool_metrics
+from app.services.auth_service import (
+    create_user_token, verify_token, invalidate_auth_cache, auth_cache_stats
+)
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    engine = create_engine_from_settings(f"sqlite:///{tmp_path}/auth.sqlite3")
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "CREATE TABLE User (id INTEGER PRIMARY KEY, firstName TEXT, lastName TEXT, dni TEXT, email TEXT)"
+            ))
+            await conn.execute(text("CREATE TABLE ai_tokens (id INTEGER PRIMARY KEY, user_id INT, token TEXT)"))
+            await conn.execute(text("INSERT INTO User VALUES (1, 'Ana', 'Ruiz', '12345678Z', 'ana@example.com')"))
+
+    asyncio.run(setup())
+    queries = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+
+    invalidate_auth_cache()
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+    factory.queries = queries
+    yield factory
+    invalidate_auth_cache()
+    asyncio.run(engine.dispose())
+
+
+def run_with(sessions, func, *args):
+    async def run():
+        async with sessions() as db:
+            return await func(db, *args)
+    return asyncio.run(run())
+
+
+def test_verify_token_is_cached(sessions):
+    token = run_with(sessions, create_user_token, "Ana Ruiz", "12345678Z")
+    assert run_with(sessions, create_user_token, "Ana Ruiz", "12345678Z") == token
+    before = len(sessions.queries)
+
+    first = run_with(sessions, verify_token, token)
+    second = run_with(sessions, verify_token, token)
+    assert first == second
+    assert first["token_id"] == 1 and first["dni"] == "12345678Z"
+    assert len(sessions.queries) == before + 1
+    assert auth_cache_stats()["principals"]["hits"] == 1
+
+
+def test_unknown_token_and_dni_are_cached_negatively(sessions):
+    for _ in range(3):
+        with pytest.raises(HTTPException) as exc:
+            run_with(sessions, verify_token, "not-a-token")
+        assert exc.value.status_code == 401
+        with pytest.raises(HTTPException) as exc:
+            run_with(sessions, create_user_token, "Nadie", "00000000T")
+        assert exc.value.status_code == 404
+    assert len(sessions.queries) == 2
+    assert auth_cache_stats()["rejected_tokens"]["hits"] == 2
+
+
+def test_revoked_token_is_rejected_after_invalidation(sessions):
+    token = run_with(sessions, create_user_token, "Ana Ruiz", "12345678Z")
+    run_with(sessions, verify_token, token)
+
+    async def revoke(db):
+        await db.execute(text("DELETE FROM ai_tokens WHERE token = :token"), {"token": token})
+        await db.commit()
+
+    run_with(sessions, revoke)
+    # Still served from cache until it is invalidated
+    assert run_with(sessions, verify_token, token)["user_id"] == 1
+    invalidate_auth_cache(token)
+    with pytest.raises(HTTPException) as exc:
+        run_with(sessions, verify_token, token)
+    assert exc.value.status_code == 401
+    assert run_with(sessions, create_user_token, "Ana Ruiz", "12345678Z") != token
+
+
+def test_pool_reports_checkout_waits(tmp_path):
+    engine = create_engine_from_settings(f"sqlite:///{tmp_path}/pool.sqlite3")
+    before = pool_metrics.checkouts
+
+    async def query(hold: float):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await asyncio.sleep(hold)
+
+    async def run():
+        # More concurrent queries than connections: the extra ones have to wait
+        await asyncio.gather(*[query(0.05) for _ in range(settings.db_pool_size + settings.db_max_overflow + 4)])
+        stats = pool_metrics.stats(engine.pool)
+        await engine.dispose()
+        return stats
+
+    stats = asyncio.run(run())
+    assert pool_metrics.checkouts - before == settings.db_pool_size + settings.db_max_overflow + 4
+    assert stats["capacity"] == settings.db_pool_size + settings.db_max_overflow
+    assert stats["peak_checked_out"] == stats["capacity"]
+    assert stats["max_wait_ms"] >= 40
+    assert stats["checked_out"] == 0
@@ -0,0 +1,111 @@
+import asyncio
+import json
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+from app.main import app
+from app.routes.chat import ChatRequest, _stream_answer
+from app.services.answer_cache import answer_cache
+from app.services.rag_service import _notify_invalidation
+from app.services.topic_catalog import TopicCatalog
+
+client = TestClient(app)
+
+fake_chunks = [
+    Document(page_content="En vías urbanas el límite es 50 km/h.", metadata={"topic": "velocidad", "source": "manual.pdf", "page": 12})
+]
+
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_stream_sends_tokens_then_sources():
+    async def fake_stream(question, chunks, tone, user_name, history):
+        for token in ["El límite ", "es ", "50 km/h."]:
+            yield token
+
+    with patch("app.routes.chat.aembed_query", return_value=[0.1, 0.2, 0.3]), \
+         patch("app.routes.chat.asearch_by_vector", return_value=fake_chunks), \
+         patch("app.routes.chat.settings.answer_cache_enabled", False), \
+         patch("app.routes.chat.stream_chat_with_tutor", side_effect=fake_stream):
+        response = client.post("/chat/", json={"question": "¿Límite urbano?", "topic": "velocidad", "stream": True})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert [e for e, _ in events] == ["token", "token", "token", "done"]
+    assert "".join(d["content"] for e, d in events if e == "token") == "El límite es 50 km/h."
+    assert events[-1][1]["sources"] == [{"source": "manual.pdf", "page": 12, "topic": "velocidad"}]
+
+
+def test_chat_stream_closes_upstream_on_disconnect():
+    closed = {"value": False}
+
+    async def endless_stream(question, chunks, tone, user_name, history):
+        try:
+            while True:
+                yield "bla "
+        finally:
+            closed["value"] = True
+
+    class DisconnectingRequest:
+        def __init__(self):
+            self.checks = 0
+
+        async def is_disconnected(self):
+            self.checks += 1
+            return self.checks > 2
+
+    async def consume():
+        with patch("app.routes.chat.stream_chat_with_tutor", side_effect=endless_stream):
+            request = ChatRequest(question="¿Límite urbano?")
+            return [event async for event in _stream_answer(DisconnectingRequest(), request, fake_chunks, None)]
+
+    events = asyncio.run(consume())
+    assert len(events) == 2
+    assert closed["value"]
+
+
+def test_chat_reuses_cached_answer_until_topic_changes(tmp_path):
+    answer_cache.invalidate_topic(None)
+    body = {"question": "¿Límite en ciudad?", "topic": "velocidad", "tone": "conciso"}
+    embeddings = iter([[1.0, 0.0, 0.0], [0.99, 0.05, 0.0], [0.99, 0.05, 0.0]])
+
+    with patch("app.services.rag_service.topic_catalog", TopicCatalog(str(tmp_path / "catalog.json"), list)), \
+         patch("app.routes.chat.aembed_query", side_effect=lambda q: next(embeddings)), \
+         patch("app.routes.chat.asearch_by_vector", return_value=fake_chunks) as search, \
+         patch("app.routes.chat.chat_with_tutor", return_value="50 km/h") as tutor:
+        first = client.post("/chat/", json=body)
+        second = client.post("/chat/", json={**body, "question": "¿Límite en la ciudad?"})
+        _notify_invalidation("velocidad")
+        third = client.post("/chat/", json=body)
+
+    assert first.json()["response"] == "50 km/h"
+    assert second.json()["cached"] is True
+    assert "cached" not in third.json()
+    assert tutor.call_count == 2
+    assert search.call_count == 2
+
+
+def test_chat_cache_drops_answers_after_upload_in_another_worker(tmp_path):
+    answer_cache.invalidate_topic(None)
+    body = {"question": "¿Límite en ciudad?", "topic": "velocidad", "tone": "conciso"}
+    path = str(tmp_path / "catalog.json")
+
+    with patch("app.services.rag_service.topic_catalog", TopicCatalog(path, list)), \
+         patch("app.routes.chat.aembed_query", return_value=[1.0, 0.0, 0.0]), \
+         patch("app.routes.chat.asearch_by_vector", return_value=fake_chunks), \
+         patch("app.routes.chat.chat_with_tutor", return_value="50 km/h") as tutor:
+        client.post("/chat/", json=body)
+        assert client.post("/chat/", json=body).json()["cached"] is True
+        # Another worker ingests into the topic; this one gets no invalidation call
+        TopicCatalog(path, list).apply("velocidad", {"manual.pdf": 4})
+        third = client.post("/chat/", json=body)
+
+    assert "cached" not in third.json()
+    assert tutor.call_count == 2
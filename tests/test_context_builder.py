@@ -0,0 +1,41 @@
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.services.context_builder import build_context, context_stats, estimate_tokens
+
+
+def split_page(text, page=1, source="manual.pdf"):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=60, add_start_index=True)
+    return splitter.split_documents([Document(page_content=text, metadata={"source": source, "page": page})])
+
+
+PAGE = "\n".join(f"Línea {i}: el conductor respetará la señal de stop número {i}." for i in range(30))
+
+
+def test_neighbouring_chunks_are_merged_without_overlap():
+    chunks = split_page(PAGE)
+    assert len(chunks) > 3
+
+    context = build_context([chunks[2], chunks[0], chunks[1]])
+    first, last = chunks[0].metadata["start_index"], chunks[2].metadata["start_index"] + len(chunks[2].page_content)
+    assert context == PAGE[first:last]
+    assert estimate_tokens(context) < sum(estimate_tokens(c.page_content) for c in chunks[:3])
+
+
+def test_segments_follow_relevance_and_respect_the_budget():
+    chunks = split_page(PAGE)
+    other = split_page("La señal de ceda el paso obliga a detenerse si es necesario.", page=7)
+
+    context = build_context([other[0], chunks[0], chunks[3]])
+    assert context.split("\n\n") == [other[0].page_content, chunks[0].page_content, chunks[3].page_content]
+
+    before = context_stats.stats()["truncated"]
+    limited = build_context(chunks, max_tokens=60)
+    assert estimate_tokens(limited) <= 60
+    assert limited.startswith(chunks[0].page_content[:100])
+    assert context_stats.stats()["truncated"] == before + 1
+
+
+def test_chunks_without_positions_are_kept_once():
+    plain = [Document(page_content="Texto A"), Document(page_content="Texto B"), Document(page_content="Texto A")]
+    assert build_context(plain) == "Texto A\n\nTexto B"
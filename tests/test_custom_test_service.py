@@ -0,0 +1,155 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from langchain_core.documents import Document
+
+from app.services import custom_test_service
+from app.services.custom_test_service import generate_custom_test, parse_weak_topics
+
+CATALOG = {
+    "señales_trafico": {"chunks": 300},
+    "prioridad_de_paso": {"chunks": 120},
+    "alcohol_y_drogas": {"chunks": 40}
+}
+
+
+@pytest.mark.parametrize("profile, expected", [
+    ({"temas_debiles": ["Señales", "velocidad"]}, {"Señales": 0.5, "velocidad": 0.5}),
+    ({"fallos_por_tema": {"señales": 6, "velocidad": 3, "alcohol": 1}, "nivel": "principiante"},
+     {"señales": 0.6, "velocidad": 0.3, "alcohol": 0.1}),
+    ({"temas": {"señales": {"aciertos": 8, "fallos": 2}, "prioridad": {"aciertos": 2, "fallos": 8}}},
+     {"prioridad": 0.8, "señales": 0.2}),
+    ({"topics": [{"name": "luces", "accuracy": 75}, {"name": "señales", "accuracy": 25}]},
+     {"señales": 0.75, "luces": 0.25}),
+    ({"level": "beginner"}, {})
+])
+def test_profiles_are_parsed_into_weighted_weak_topics(profile, expected):
+    weights = parse_weak_topics(profile)
+    assert list(weights) == list(expected)
+    assert weights == pytest.approx(expected)
+
+
+def run_generation(profiles, fake_llm):
+    searches = []
+
+    async def fake_search(query, topic=None, k=None):
+        searches.append(topic)
+        return [Document(page_content=f"Manual de {topic}", metadata={"topic": topic})]
+
+    async def scenario():
+        return [await generate_custom_test(profile) for profile in profiles]
+
+    custom_test_service.context_cache.invalidate()
+    with patch("app.services.custom_test_service.topic_catalog", SimpleNamespace(topics=lambda: CATALOG)), \
+         patch("app.services.custom_test_service.asearch_in_vector_db", side_effect=fake_search), \
+         patch("app.services.custom_test_service.run_llm", side_effect=fake_llm):
+        return asyncio.run(scenario()), searches
+
+
+def question(topic, level, n):
+    return {
+        "pregunta": f"{topic} {level} {n}", "opciones": ["A", "B", "C"], "respuesta_correcta": "A",
+        "explicacion": "Según el manual", "tema": topic, "dificultad": level
+    }
+
+
+def test_shards_run_concurrently_grounded_and_balanced():
+    prompts = []
+
+    async def fake_llm(chain, inputs):
+        prompts.append(inputs)
+        await asyncio.sleep(0.2)
+        # More questions than asked, with other spellings of the levels: the shard keeps its planned mix
+        levels = ["Fácil", "MEDIA", "difícil"]
+        return {"preguntas": [question(inputs["topic"], levels[n % 3], n) for n in range(inputs["count"] + 3)]}
+
+    profile = {"fallos_por_tema": {"señales": 7, "Prioridad de paso": 3}}
+    start = time.perf_counter()
+    (result,), searches = run_generation([profile], fake_llm)
+    elapsed = time.perf_counter() - start
+
+    questions = result["preguntas"]
+    assert len(questions) == 10
+    assert [t["preguntas"] for t in result["temas"]] == [7, 3]
+    # Weak topics were matched to catalog topics and their shards got that topic's excerpts
+    assert sorted(set(searches)) == ["prioridad_de_paso", "señales_trafico"]
+    assert all("Manual de" in p["context"] for p in prompts)
+    assert max(p["count"] for p in prompts) <= 3
+    # Four shards of 0.2 s overlap instead of adding up
+    assert elapsed < 0.6
+    levels = [q["dificultad"] for q in questions]
+    assert levels == sorted(levels, key=["bajo", "medio", "alto"].index)
+    assert {level: levels.count(level) for level in set(levels)} == {"bajo": 3, "medio": 4, "alto": 3}
+
+
+def test_failed_shard_keeps_the_rest_and_context_is_shared_across_students():
+    async def flaky_llm(chain, inputs):
+        if inputs["topic"] == "alcohol":
+            raise ValueError("JSON inválido")
+        return {"preguntas": [question(inputs["topic"], "medio", n) for n in range(inputs["count"])]}
+
+    profile = {"temas_debiles": ["señales", "alcohol"]}
+    (first, second), searches = run_generation([profile, profile], flaky_llm)
+
+    assert len(first["preguntas"]) == 5
+    assert first["failed_shards"][0]["tema"] == "alcohol"
+    assert "JSON inválido" in first["failed_shards"][0]["error"]
+    # One retrieval per topic, reused by the second student
+    assert sorted(searches) == ["alcohol_y_drogas", "señales_trafico"]
+    assert len(second["preguntas"]) == 5
+
+
+def planned_levels(inputs):
+    # "2 de dificultad bajo, 1 de dificultad alto" -> ["bajo", "bajo", "alto"]
+    return [level for part in inputs["difficulty_plan"].split(", ")
+            for level in [part.split()[-1]] * int(part.split()[0])]
+
+
+def test_short_shards_are_topped_up_with_their_missing_levels_and_reported():
+    prompts = []
+
+    async def stingy_llm(chain, inputs):
+        prompts.append(inputs)
+        # One question per call, whatever was asked for
+        return {"preguntas": [question(inputs["topic"], planned_levels(inputs)[0], len(prompts))]}
+
+    (result,), _ = run_generation([{"temas_debiles": ["señales"]}], stingy_llm)
+
+    # Shards of 3, 3, 3 and 1: one call plus one top-up each, except the single-question shard
+    assert len(prompts) == 7
+    assert sorted(p["count"] for p in prompts) == [1, 2, 2, 2, 3, 3, 3]
+    levels = [q["dificultad"] for q in result["preguntas"]]
+    assert len(levels) == 7 and levels.count("bajo") <= 3 and levels.count("medio") <= 4 and levels.count("alto") <= 3
+    assert [f["questions"] for f in result["failed_shards"]] == [1, 1, 1]
+
+
+def test_stream_regenerates_the_levels_of_a_failed_shard():
+    async def fake_items(chain, inputs, schema):
+        if inputs["topic"] == "alcohol":
+            raise ValueError("JSON inválido")
+        for n, level in enumerate(planned_levels(inputs)):
+            yield question(inputs["topic"], level, n)
+
+    prompts = []
+
+    async def fake_llm(chain, inputs):
+        prompts.append(inputs)
+        return {"preguntas": [question("alcohol", planned_levels(inputs)[0], len(prompts))]}
+
+    async def collect():
+        return [q async for q in custom_test_service.stream_custom_test({"fallos_por_tema": {"señales": 7, "alcohol": 3}})]
+
+    custom_test_service.context_cache.invalidate()
+    with patch("app.services.custom_test_service.topic_catalog", SimpleNamespace(topics=lambda: CATALOG)), \
+         patch("app.services.custom_test_service.asearch_in_vector_db", return_value=[]), \
+         patch("app.services.custom_test_service.stream_llm_items", side_effect=fake_items), \
+         patch("app.services.custom_test_service.run_llm", side_effect=fake_llm):
+        questions = asyncio.run(collect())
+
+    levels = [q["dificultad"] for q in questions]
+    assert len(questions) == 10
+    assert {level: levels.count(level) for level in set(levels)} == {"bajo": 3, "medio": 4, "alto": 3}
+    assert [p["count"] for p in prompts] == [1, 1, 1]
@@ -0,0 +1,57 @@
+import pytest
+from unittest.mock import MagicMock
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.services.embedding_cache import MemmapEmbeddingCache, CachedEmbeddings
+
+
+def make_embeddings(cache):
+    model = MagicMock(wraps=DeterministicFakeEmbedding(size=8))
+    return CachedEmbeddings(model, cache), model
+
+
+def test_cached_texts_skip_the_model_across_processes(tmp_path):
+    embeddings, model = make_embeddings(MemmapEmbeddingCache(str(tmp_path), "mini", max_entries=10))
+    first = embeddings.embed_documents(["norma a", "norma b", "norma a"])
+    assert model.embed_documents.call_args.args[0] == ["norma a", "norma b"]
+
+    # A second instance stands in for another uvicorn worker sharing the files
+    other, other_model = make_embeddings(MemmapEmbeddingCache(str(tmp_path), "mini", max_entries=10))
+    second = other.embed_documents(["norma b", "norma a"])
+    other_model.embed_documents.assert_not_called()
+    # float16 storage keeps about three significant digits
+    assert second == [pytest.approx(first[1], abs=1e-2), pytest.approx(first[0], abs=1e-2)]
+
+    # Query embeddings are cached separately from documents
+    other.embed_query("norma a")
+    other_model.embed_query.assert_called_once_with("norma a")
+    # Rows written by the other worker are picked up without reopening
+    embeddings.embed_query("norma a")
+    model.embed_query.assert_not_called()
+
+
+def test_oldest_entries_are_evicted_beyond_capacity(tmp_path):
+    cache = MemmapEmbeddingCache(str(tmp_path), "mini", max_entries=3, dtype="float32")
+    embeddings, model = make_embeddings(cache)
+    embeddings.embed_documents(["a", "b", "c", "d"])
+
+    model.embed_documents.reset_mock()
+    embeddings.embed_documents(["b", "c", "d"])
+    model.embed_documents.assert_not_called()
+    embeddings.embed_documents(["a"])
+    model.embed_documents.assert_called_once_with(["a"])
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["entries"] == 3
+
+
+def test_files_from_another_capacity_are_recreated_not_reinterpreted(tmp_path):
+    small = MemmapEmbeddingCache(str(tmp_path), "mini", max_entries=4, dtype="float32")
+    key = small.digest("doc", "norma a")
+    small.put_many({key: [1.0, 2.0, 3.0, 4.0]})
+
+    resized = MemmapEmbeddingCache(str(tmp_path), "mini", max_entries=2, dtype="float32")
+    assert resized.get_many([key]) == {}
+    resized.put_many({key: [5.0, 6.0, 7.0, 8.0]})
+    assert resized.get_many([key]) == {key: [5.0, 6.0, 7.0, 8.0]}
+
+    # A process still on the old capacity no longer trusts the recreated files
+    assert MemmapEmbeddingCache(str(tmp_path), "mini", max_entries=4, dtype="float32").get_many([key]) == {}
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.services.embedding_sidecar import EmbeddingServer, SidecarEmbeddings
+
+
+class SlowEmbeddings(DeterministicFakeEmbedding):
+    """Records every batch and takes a while, so concurrent requests pile up."""
+
+    calls: list = []
+
+    def embed_documents(self, texts):
+        self.calls.append(len(texts))
+        if "falla" in texts:
+            raise ValueError("texto no válido")
+        time.sleep(0.05)
+        return super().embed_documents(texts)
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
+
+
+@pytest.fixture
+def sidecar(tmp_path):
+    model = SlowEmbeddings(size=16, calls=[])
+    server = EmbeddingServer(model, str(tmp_path / "emb.sock"))
+    ready = threading.Event()
+    running = {}
+
+    async def serve():
+        running["loop"] = asyncio.get_running_loop()
+        running["task"] = asyncio.current_task()
+        try:
+            await server.serve(ready)
+        except asyncio.CancelledError:
+            pass
+
+    # asyncio.run also cancels the handlers of connections still open at the end
+    thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+    thread.start()
+    ready.wait(5)
+    yield model, SidecarEmbeddings(server.socket_path, timeout=5)
+    running["loop"].call_soon_threadsafe(running["task"].cancel)
+    thread.join(5)
+
+
+def test_sidecar_matches_local_model(sidecar):
+    model, client = sidecar
+    texts = ["uno", "dos", "tres"]
+    np.testing.assert_allclose(client.embed_documents(texts), model.embed_documents(texts), rtol=1e-6)
+    np.testing.assert_allclose(client.embed_query("cuatro"), model.embed_query("cuatro"), rtol=1e-6)
+    assert client.embed_documents([]) == []
+
+
+def test_concurrent_queries_share_batches(sidecar):
+    model, client = sidecar
+    queries = [f"consulta {i}" for i in range(12)]
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        results = list(pool.map(client.embed_query, queries))
+
+    # Requests that queued while the model was busy went through in the same call
+    assert sum(model.calls) == len(queries)
+    assert len(model.calls) < len(queries)
+    np.testing.assert_allclose(results, [model.embed_query(q) for q in queries], rtol=1e-6)
+
+
+def test_model_errors_reach_the_client(sidecar):
+    _, client = sidecar
+    with pytest.raises(RuntimeError, match="texto no válido"):
+        client.embed_documents(["falla"])
+    # The connection stays usable
+    assert len(client.embed_query("otra")) == 16
@@ -0,0 +1,49 @@
+import asyncio
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel
+
+from app.services import executor
+from app.services.executor import stream_llm, stream_llm_items
+
+
+class Item(BaseModel):
+    pregunta: str
+
+
+class FakeChain:
+    def __init__(self, outputs, error=None):
+        self.outputs = outputs
+        self.error = error
+
+    async def astream(self, inputs):
+        for output in self.outputs:
+            yield output
+        if self.error:
+            raise self.error
+
+
+def test_stream_llm_frees_the_slot_while_the_consumer_holds_a_chunk(monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(executor, "llm_semaphore", asyncio.Semaphore(1))
+        chain = FakeChain(["a", "b"])
+        seen = []
+        async for chunk in stream_llm(chain.astream({})):
+            # A slow client: another request can reach the model meanwhile
+            async with executor.llm_semaphore:
+                seen.append(chunk)
+        return seen
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 1)) == ["a", "b"]
+
+
+def test_stream_llm_items_drops_the_item_cut_off_by_a_parser_error():
+    outputs = [
+        {"preguntas": [{"pregunta": "¿Uno?"}]},
+        {"preguntas": [{"pregunta": "¿Uno?"}, {"pregunta": "¿Do"}]}
+    ]
+    chain = FakeChain(outputs, error=OutputParserException("JSON cortado"))
+
+    async def collect():
+        return [item async for item in stream_llm_items(chain, {}, Item)]
+
+    assert asyncio.run(collect()) == [{"pregunta": "¿Uno?"}, None]
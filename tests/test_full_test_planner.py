@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.services.embedding_cache import CachedEmbeddings, MemmapEmbeddingCache
+from app.services.full_test_planner import QuestionDeduper, chunk_vectors, diverse_batches
+
+
+def test_batches_are_disjoint_and_cover_different_areas():
+    rng = np.random.default_rng(0)
+    # Three areas of the manual; the most relevant chunks all come from the first one
+    centers = np.eye(3, 16) * 5
+    labels = [0] * 12 + [1] * 8 + [2] * 8
+    vectors = np.stack([centers[label] + rng.normal(size=16) * 0.3 for label in labels])
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    groups, reserve = diverse_batches(vectors, batches=3, per_batch=5)
+
+    assert [len(g) for g in groups] == [5, 5, 5]
+    used = [i for g in groups for i in g]
+    assert len(set(used)) == len(used)
+    assert sorted(used + reserve) == list(range(len(labels)))
+    # Each batch stays within one area and no two batches share it
+    areas = [{labels[i] for i in g} for g in groups]
+    assert all(len(a) == 1 for a in areas)
+    assert set.union(*areas) == {0, 1, 2}
+    assert groups[0][0] == 0
+
+
+def test_small_inputs_still_produce_every_batch():
+    vectors = np.eye(2, 4)
+    groups, reserve = diverse_batches(vectors, batches=3, per_batch=10)
+    assert len(groups) == 3 and all(groups) and reserve == []
+
+    groups, reserve = diverse_batches(np.eye(5, 4), batches=2, per_batch=10)
+    assert sum(len(g) for g in groups) == 4 and len(reserve) == 1
+
+
+def test_chunk_vectors_come_from_the_vector_db_and_questions_skip_the_cache(tmp_path):
+    cache = MemmapEmbeddingCache(str(tmp_path), "mini", max_entries=10)
+    model = MagicMock(wraps=DeterministicFakeEmbedding(size=4))
+    manager = SimpleNamespace(
+        embeddings=CachedEmbeddings(model, cache),
+        get_embeddings=MagicMock(return_value={"a": [3.0, 0, 0, 4.0]})
+    )
+    chunks = [Document(id="a", page_content="norma a"), Document(page_content="resumen sin id")]
+    with patch("app.services.full_test_planner.vector_manager", manager):
+        vectors = chunk_vectors(chunks, "normas")
+        QuestionDeduper(0.9).filter([{"pregunta": "¿Norma?"}])
+
+    manager.get_embeddings.assert_called_once_with(["a"], "normas")
+    assert vectors[0].tolist() == pytest.approx([0.6, 0, 0, 0.8])
+    # Only the chunk without a stored vector reached the model
+    assert model.embed_documents.call_args_list[0].args[0] == ["resumen sin id"]
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,127 @@
+import asyncio
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import patch
+from app.services.ingestion_jobs import IngestionJob, IngestionJobManager
+from app.services.rag_service import IngestionCancelled
+
+
+def fake_process(file_path, topic, progress=None, should_cancel=None, job_id=None, replace_source=False):
+    progress(pages_parsed=3, total_pages=3)
+    for written in (10, 20):
+        if should_cancel():
+            raise IngestionCancelled()
+        progress(chunks_embedded=written, chunks_written=written)
+    return 20
+
+
+def make_upload(tmp_path, name="manual.pdf"):
+    job_dir = tmp_path / "uploads" / name.replace(".", "_")
+    job_dir.mkdir(parents=True)
+    file_path = job_dir / name
+    file_path.write_bytes(b"%PDF-1.4")
+    return str(file_path)
+
+
+def test_job_reports_progress_and_cleans_upload(tmp_path):
+    manager = IngestionJobManager(str(tmp_path / "jobs.sqlite3"), queue_size=2, workers=1)
+    file_path = make_upload(tmp_path)
+
+    async def scenario():
+        job = await manager.submit(file_path, "manual.pdf", "normas")
+        await manager._queue.join()
+        return job
+
+    with patch("app.services.ingestion_jobs.process_pdf_to_vector_db", side_effect=fake_process):
+        job = asyncio.run(scenario())
+
+    assert job.status == "completed"
+    assert (job.pages_parsed, job.chunks_embedded, job.chunks_written) == (3, 20, 20)
+    assert not (tmp_path / "uploads" / "manual_pdf").exists()
+
+
+def test_cancelling_running_job_rolls_back(tmp_path):
+    manager = IngestionJobManager(str(tmp_path / "jobs.sqlite3"), queue_size=2, workers=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_process(file_path, topic, progress=None, should_cancel=None, job_id=None, replace_source=False):
+        started.set()
+        release.wait(5)
+        return fake_process(file_path, topic, progress, should_cancel, job_id)
+
+    async def scenario():
+        job = await manager.submit(make_upload(tmp_path), "manual.pdf", "normas")
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        await manager.cancel(job.id)
+        release.set()
+        await manager._queue.join()
+        return job
+
+    with patch("app.services.ingestion_jobs.process_pdf_to_vector_db", side_effect=slow_process), \
+         patch("app.services.ingestion_jobs.rollback_ingestion") as rollback:
+        job = asyncio.run(scenario())
+
+    assert job.status == "cancelled"
+    rollback.assert_called_once_with(job.id, "normas")
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_unfinished_job_is_reported_as_interrupted_after_restart(tmp_path):
+    journal = str(tmp_path / "jobs.sqlite3")
+    IngestionJobManager(journal, queue_size=2, workers=1)._save_journal(IngestionJob(
+        id="abc", filename="manual.pdf", topic="normas", file_path=str(tmp_path / "manual.pdf"),
+        status="running", chunks_written=64, created_at=1.0
+    ))
+    with sqlite3.connect(journal) as conn:
+        conn.execute("UPDATE jobs SET owner = ?", (dead_pid(),))
+
+    manager = IngestionJobManager(journal, queue_size=2, workers=1)
+
+    job = manager.get("abc")
+    assert job.status == "interrupted"
+    assert job.chunks_written == 64
+    assert manager.incomplete_topics() == ["normas"]
+
+
+def test_jobs_are_shared_between_workers(tmp_path):
+    journal = str(tmp_path / "jobs.sqlite3")
+    # Two managers on one file stand in for two uvicorn workers
+    accepting = IngestionJobManager(journal, queue_size=2, workers=1)
+    other = IngestionJobManager(journal, queue_size=2, workers=1)
+    started = threading.Event()
+
+    def cancellable_process(file_path, topic, progress=None, should_cancel=None, job_id=None, replace_source=False):
+        started.set()
+        for _ in range(500):
+            progress(pages_parsed=1)
+            if should_cancel():
+                raise IngestionCancelled()
+            time.sleep(0.01)
+        return 0
+
+    async def scenario():
+        job = await accepting.submit(make_upload(tmp_path), "manual.pdf", "normas")
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        assert other.get(job.id).status == "running"
+        await other.cancel(job.id)
+        await accepting._queue.join()
+        return job
+
+    with patch("app.services.ingestion_jobs.process_pdf_to_vector_db", side_effect=cancellable_process), \
+         patch("app.services.ingestion_jobs.rollback_ingestion") as rollback:
+        job = asyncio.run(scenario())
+
+    assert job.status == "cancelled"
+    rollback.assert_called_once_with(job.id, "normas")
+    assert [j.status for j in other.list()] == ["cancelled"]
@@ -0,0 +1,65 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services.query_batcher import QueryBatcher
+
+
+def make_batcher(window=0.01, max_batch=32):
+    calls = []
+
+    def embed_many(texts):
+        calls.append(list(texts))
+        if "falla" in texts:
+            raise ValueError("modelo caído")
+        time.sleep(0.02)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    return QueryBatcher(embed_many, max_batch=max_batch, window=window), calls
+
+
+def test_concurrent_queries_are_encoded_together():
+    batcher, calls = make_batcher(max_batch=8)
+    queries = [f"pregunta {'x' * i}" for i in range(20)] + ["pregunta"] * 4
+    with ThreadPoolExecutor(max_workers=24) as pool:
+        results = list(pool.map(batcher.embed, queries))
+
+    assert results == [[float(len(q)), 1.0] for q in queries]
+    assert len(calls) < len(queries)
+    assert max(len(batch) for batch in calls) <= 8
+    # The repeated question is encoded once per batch at most
+    assert all(len(batch) == len(set(batch)) for batch in calls)
+    stats = batcher.stats()
+    assert stats["queries"] == len(queries)
+    assert stats["max_batch_size"] <= 8
+
+
+def test_async_callers_share_batches_without_threads():
+    batcher, calls = make_batcher(window=0.005, max_batch=64)
+
+    async def run():
+        return await asyncio.gather(*[batcher.aembed(f"consulta {i}") for i in range(64)])
+
+    results = asyncio.run(run())
+    assert results[10] == [float(len("consulta 10")), 1.0]
+    assert len(calls) <= 3
+
+
+def test_errors_reach_every_caller_of_the_batch():
+    batcher, calls = make_batcher(window=0.05)
+    # While the first query is being encoded the next two queue up and form one batch
+    first = batcher.submit("primera")
+    while not calls:
+        time.sleep(0.001)
+    failing = batcher.submit("falla")
+    other = batcher.submit("otra")
+    assert first.result() == [7.0, 1.0]
+    with pytest.raises(ValueError, match="modelo caído"):
+        failing.result()
+    with pytest.raises(ValueError):
+        other.result()
+
+    assert batcher.embed("sigue funcionando") == [17.0, 1.0]
+    assert batcher.stats()["errors"] == 1
@@ -0,0 +1,87 @@
+import asyncio
+from unittest.mock import patch
+from langchain_core.documents import Document
+from app.services.question_bank import QuestionBank
+
+fake_chunks = [Document(page_content=f"Norma {i}", metadata={"topic": "normas"}) for i in range(20)]
+
+VECTORS = {
+    "Pregunta a": [1.0, 0.0, 0.0],
+    "Pregunta a bis": [0.99, 0.05, 0.0],
+    "Pregunta b": [0.0, 1.0, 0.0],
+    "Pregunta c": [0.0, 0.0, 1.0]
+}
+
+
+def make_question(label):
+    return {
+        "pregunta": f"Pregunta {label}",
+        "opciones": ["A", "B", "C"],
+        "respuesta_correcta": "A",
+        "explicacion": "Porque A"
+    }
+
+
+def fake_embed_texts(texts):
+    return [VECTORS[t] for t in texts]
+
+
+def test_bank_refills_in_background_skips_duplicates_and_persists(tmp_path):
+    path = str(tmp_path / "bank.sqlite3")
+    bank = QuestionBank(path, target=3, low_water=1, dedupe_threshold=0.9)
+    batches = iter([
+        {"preguntas": [make_question("a"), make_question("a bis"), make_question("b")]},
+        {"preguntas": [make_question("c")]}
+    ])
+
+    async def fake_bulk(chunks, topic, count):
+        return next(batches)
+
+    async def scenario():
+        # Empty bank: nothing to serve, but a refill starts
+        assert await bank.pop("normas") is None
+        await bank._refills["normas"]
+        assert bank.depth("normas") == 3
+        return await bank.pop("normas")
+
+    with patch("app.services.question_bank.asearch_in_vector_db", return_value=fake_chunks), \
+         patch("app.services.question_bank.generate_bulk_questions", side_effect=fake_bulk), \
+         patch("app.services.question_bank.embed_texts", side_effect=fake_embed_texts):
+        served = asyncio.run(scenario())
+
+    assert served["pregunta"] == "Pregunta a"
+    stats = bank.stats()
+    assert stats["duplicates_skipped"] == 1
+    assert stats["served"] == 1
+    assert stats["refills"] == 1
+
+    restarted = QuestionBank(path, target=3, low_water=0, dedupe_threshold=0.9)
+    assert asyncio.run(restarted.pop("normas"))["pregunta"] == "Pregunta b"
+
+
+def test_bank_flush_drops_topic(tmp_path):
+    bank = QuestionBank(str(tmp_path / "bank.sqlite3"), target=3, low_water=0, dedupe_threshold=0.9)
+    bank._store("normas", [make_question("a")], [VECTORS["Pregunta a"]], version=0)
+    bank._store("senales", [make_question("b")], [VECTORS["Pregunta b"]], version=0)
+
+    bank.flush("normas")
+
+    assert bank.depth("normas") == 0
+    assert bank.depth("senales") == 1
+    # A refill that started before the flush cannot write back
+    assert bank._store("normas", [make_question("c")], [VECTORS["Pregunta c"]], version=0) is None
+
+
+def test_workers_share_the_bank(tmp_path):
+    path = str(tmp_path / "bank.sqlite3")
+    # Two instances on one file stand in for two uvicorn workers
+    first = QuestionBank(path, target=3, low_water=0, dedupe_threshold=0.9)
+    second = QuestionBank(path, target=3, low_water=0, dedupe_threshold=0.9)
+    first._store("normas", [make_question("a"), make_question("b")], [VECTORS["Pregunta a"], VECTORS["Pregunta b"]], 0)
+    # Near-duplicates of the other worker's questions are skipped, and the target is shared
+    assert second._store("normas", [make_question("a bis"), make_question("c"), make_question("b")],
+                         [VECTORS["Pregunta a bis"], VECTORS["Pregunta c"], VECTORS["Pregunta b"]], 0) == 1
+
+    served = [asyncio.run(bank.pop("normas"))["pregunta"] for bank in (second, first, second)]
+    assert served == ["Pregunta a", "Pregunta b", "Pregunta c"]
+    assert asyncio.run(first.pop("normas")) is None
@@ -0,0 +1,299 @@
+import threading
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.config import settings
+from app.services import executor, rag_service
+from app.services.topic_catalog import TopicCatalog
+from app.services.numpy_store import NumpyVectorIndex
+from app.services.rag_service import VectorDBManager, search_in_vector_db, process_pdf_to_vector_db, _notify_invalidation
+from app.services.rag_service import search_by_vector, reset_vector_db
+from app.services.migrate_collections import migrate_to_topic_collections
+from benchmarks.bench_ingestion import make_text_pdf
+
+
+def make_manager():
+    manager = MagicMock()
+    manager.partitioned = False
+    manager.embeddings.embed_query.return_value = [0.1, 0.2, 0.3]
+    manager.db.similarity_search_by_vector.return_value = [
+        Document(page_content="Norma", metadata={"topic": "normas"})
+    ]
+    return manager
+
+
+def test_retrieval_cache_skips_embedding_and_chroma_after_warmup(tmp_path):
+    rag_service.retrieval_cache.invalidate()
+    rag_service.query_embedding_cache.invalidate()
+    manager = make_manager()
+
+    with patch("app.services.rag_service.vector_manager", manager), \
+         patch("app.services.rag_service.topic_catalog", TopicCatalog(str(tmp_path / "catalog.json"), list)):
+        first = search_in_vector_db("normas generales", topic="normas", k=100)
+        first.pop()
+        second = search_in_vector_db("normas generales", topic="normas", k=100)
+
+        assert len(second) == 1
+        assert manager.embeddings.embed_query.call_count == 1
+        assert manager.db.similarity_search_by_vector.call_count == 1
+
+        _notify_invalidation("normas")
+        search_in_vector_db("normas generales", topic="normas", k=100)
+
+    # The query embedding survives invalidation; only the search is repeated
+    assert manager.embeddings.embed_query.call_count == 1
+    assert manager.db.similarity_search_by_vector.call_count == 2
+
+
+def test_invalidating_one_topic_keeps_other_topics_cached(tmp_path):
+    rag_service.retrieval_cache.invalidate()
+    manager = make_manager()
+
+    with patch("app.services.rag_service.vector_manager", manager), \
+         patch("app.services.rag_service.topic_catalog", TopicCatalog(str(tmp_path / "catalog.json"), list)):
+        search_in_vector_db("normas generales", topic="normas", k=10)
+        search_in_vector_db("normas generales", topic="senales", k=10)
+        search_in_vector_db("normas generales", topic=None, k=10)
+        _notify_invalidation("senales")
+        search_in_vector_db("normas generales", topic="normas", k=10)
+        search_in_vector_db("normas generales", topic="senales", k=10)
+        search_in_vector_db("normas generales", topic=None, k=10)
+
+    assert manager.db.similarity_search_by_vector.call_count == 5
+
+
+def test_retrieval_cache_notices_ingestion_in_another_worker(tmp_path):
+    rag_service.retrieval_cache.invalidate()
+    manager = make_manager()
+    path = str(tmp_path / "catalog.json")
+
+    with patch("app.services.rag_service.vector_manager", manager), \
+         patch("app.services.rag_service.topic_catalog", TopicCatalog(path, list)):
+        search_in_vector_db("normas generales", topic="normas", k=10)
+        search_in_vector_db("normas generales", topic="senales", k=10)
+        # Another worker ingests into "normas": this process gets no invalidation call
+        TopicCatalog(path, list).apply("normas", {"manual.pdf": 3})
+        search_in_vector_db("normas generales", topic="normas", k=10)
+        search_in_vector_db("normas generales", topic="senales", k=10)
+
+    assert manager.db.similarity_search_by_vector.call_count == 3
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_pdf_ingestion_streams_pages_in_bounded_batches(tmp_path, workers):
+    pdf_path = str(tmp_path / "manual.pdf")
+    make_text_pdf(pdf_path, pages=12)
+    manager = MagicMock()
+    manager.embeddings.embed_documents.side_effect = lambda texts: [[0.0, 1.0] for _ in texts]
+    manager.add_embedded_documents.side_effect = lambda chunks, vectors, **kwargs: len(chunks)
+    manager.get_metadatas.return_value = {}
+    progress = {}
+
+    with patch("app.services.rag_service.vector_manager", manager), \
+         patch("app.services.rag_service.topic_catalog"), \
+         patch.object(settings, "embedding_batch_size", 5), \
+         patch.object(settings, "pdf_parse_workers", workers), \
+         patch.object(settings, "pdf_pages_per_task", 4), \
+         patch.object(executor, "_parse_pool", None):
+        written = process_pdf_to_vector_db(pdf_path, "normas", progress=lambda **c: progress.update(c))
+        if executor._parse_pool is not None:
+            executor._parse_pool.shutdown()
+
+    batches = [call.args[0] for call in manager.add_embedded_documents.call_args_list]
+    assert all(len(batch) <= 5 for batch in batches)
+    chunks = [chunk for batch in batches for chunk in batch]
+    assert written == len(chunks) == progress["chunks_written"]
+    assert progress["pages_parsed"] == progress["total_pages"] == 12
+    # Pages arrive in order even when parsed in parallel
+    pages = [chunk.metadata["page"] for chunk in chunks]
+    assert pages == sorted(pages) and set(pages) == set(range(12))
+    assert chunks[0].metadata["topic"] == "normas"
+    assert chunks[0].metadata["source"] == "manual.pdf"
+
+
+def make_chroma_manager(tmp_path):
+    manager = object.__new__(VectorDBManager)
+    manager._embeddings = MagicMock(wraps=DeterministicFakeEmbedding(size=8))
+    manager._db = Chroma(persist_directory=str(tmp_path / "chroma"), embedding_function=manager._embeddings)
+    return manager
+
+
+def test_reupload_skips_unchanged_chunks_and_replace_drops_stale_ones(tmp_path):
+    manager = make_chroma_manager(tmp_path)
+    versions = {}
+    for name, pages in (("v1", 12), ("v2", 10), ("v3", 13)):
+        (tmp_path / name).mkdir()
+        versions[name] = str(tmp_path / name / "manual.pdf")
+        make_text_pdf(versions[name], pages=pages)
+
+    def ingest(version, replace_source=False):
+        progress = {}
+        manager._embeddings.embed_documents.reset_mock()
+        process_pdf_to_vector_db(
+            versions[version], "normas",
+            progress=lambda **c: progress.update(c),
+            replace_source=replace_source
+        )
+        embedded = sum(len(call.args[0]) for call in manager._embeddings.embed_documents.call_args_list)
+        return embedded, progress
+
+    catalog = TopicCatalog(str(tmp_path / "catalog.json"), lambda: [manager.db._collection])
+
+    with patch("app.services.rag_service.vector_manager", manager), \
+         patch("app.services.rag_service.topic_catalog", catalog), \
+         patch.object(settings, "pdf_parse_workers", 1):
+        embedded, _ = ingest("v1")
+        full_count = manager.db._collection.count()
+        assert embedded == full_count > 0
+        assert catalog.topics()["normas"]["sources"] == {"manual.pdf": full_count}
+
+        # Same manual again: nothing is embedded or duplicated
+        embedded, progress = ingest("v1")
+        assert embedded == 0
+        assert progress["chunks_skipped"] == full_count
+        assert manager.db._collection.count() == full_count
+
+        # Two pages removed: only their chunks are deleted
+        embedded, progress = ingest("v2", replace_source=True)
+        assert embedded == 0
+        assert progress["chunks_removed"] > 0
+        v2_count = manager.db._collection.count()
+        assert v2_count == full_count - progress["chunks_removed"]
+
+        # Three pages appended: only the new pages are embedded
+        embedded, progress = ingest("v3", replace_source=True)
+        assert embedded == manager.db._collection.count() - v2_count
+        assert embedded < v2_count
+
+        # The catalog kept in step with every change matches a full rebuild
+        assert catalog.topics()["normas"]["chunks"] == manager.db._collection.count()
+        assert catalog.rebuild()["normas"]["sources"] == {"manual.pdf": manager.db._collection.count()}
+
+
+def test_per_topic_layout_migration_fan_out_and_topic_reset(tmp_path):
+    manager = make_chroma_manager(tmp_path)
+    catalog = TopicCatalog(str(tmp_path / "catalog.json"), lambda: manager.collections())
+    embedding = DeterministicFakeEmbedding(size=8)
+    texts = {"normas": ["Norma de prioridad", "Norma de velocidad"], "senales": ["Señal de stop"]}
+
+    with patch("app.services.rag_service.vector_manager", manager), \
+         patch("app.services.migrate_collections.vector_manager", manager), \
+         patch("app.services.rag_service.topic_catalog", catalog), \
+         patch("app.services.migrate_collections.topic_catalog", catalog), \
+         patch.object(settings, "chroma_path", str(tmp_path / "chroma")):
+        for topic, chunks in texts.items():
+            docs = [Document(page_content=t, metadata={"topic": topic, "source": "manual.pdf"}) for t in chunks]
+            manager.add_embedded_documents(docs, embedding.embed_documents(chunks), topic=topic)
+
+        copied = migrate_to_topic_collections(drop_shared=True, progress=lambda message: None)
+        assert copied == {"normas": 2, "senales": 1}
+
+        with patch.object(settings, "vector_layout", "per_topic"):
+            query = embedding.embed_query("Señal de stop")
+            assert [d.page_content for d in search_by_vector(query, "senales", 4)] == ["Señal de stop"]
+            # topic=None fans out over every collection; the exact match ranks first
+            merged = search_by_vector(query, None, 4)
+            assert len(merged) == 3 and merged[0].page_content == "Señal de stop"
+            assert search_by_vector(query, "desconocido", 4) == []
+
+            reset_vector_db("normas")
+            assert set(manager.topic_dbs()) == {"senales"}
+            assert sorted(catalog.topics()) == ["senales"]
+
+            # Rolling back a job on a topic without a collection must not create one
+            rag_service.rollback_ingestion("job-perdido", "nuevo")
+            assert set(manager.topic_dbs(refresh=True)) == {"senales"}
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_numpy_backend_matches_chroma_and_follows_catalog_updates(tmp_path, dtype):
+    manager = make_chroma_manager(tmp_path)
+    catalog = TopicCatalog(str(tmp_path / "catalog.json"), lambda: manager.collections())
+    index = NumpyVectorIndex(
+        str(tmp_path / "numpy"), dtype, mmap=True,
+        fetch_topic=rag_service._fetch_topic_chunks,
+        fingerprints=lambda: {t: [e["chunks"], e["last_updated"]] for t, e in catalog.topics().items()}
+    )
+    fake = DeterministicFakeEmbedding(size=8)
+
+    def embed(text):
+        # Unit vectors, like the sentence-transformers model, so L2 and cosine rank alike
+        vector = np.asarray(fake.embed_query(text))
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def add(topic, texts):
+        docs = [Document(page_content=t, metadata={"topic": topic, "source": "manual.pdf"}) for t in texts]
+        manager.add_embedded_documents(docs, [embed(t) for t in texts], topic=topic)
+        catalog.apply(topic, {"manual.pdf": len(texts)})
+
+    with patch("app.services.rag_service.vector_manager", manager), \
+         patch("app.services.rag_service.numpy_index", index):
+        add("normas", [f"Norma {i}" for i in range(20)])
+        add("senales", [f"Señal {i}" for i in range(20)])
+        query = embed("Norma 3")
+
+        for topic in ("normas", None):
+            chroma = search_by_vector(query, topic, 5)
+            with patch.object(settings, "vector_backend", "numpy"):
+                numpy = search_by_vector(query, topic, 5)
+            assert numpy[0].page_content == chroma[0].page_content == "Norma 3"
+            assert {d.page_content for d in numpy} == {d.page_content for d in chroma}
+            assert numpy[0].metadata == chroma[0].metadata
+
+        # New chunks change the topic's catalog fingerprint and the matrix is rebuilt
+        add("normas", ["Norma nueva"])
+        with patch.object(settings, "vector_backend", "numpy"):
+            found = search_by_vector(embed("Norma nueva"), "normas", 1)
+        assert found[0].page_content == "Norma nueva"
+
+        # Chunks that only moved (same count, new page metadata) change the fingerprint too
+        stored = manager.db._collection.get(where={"topic": "normas"}, include=["documents"])
+        moved_id = stored["ids"][stored["documents"].index("Norma 3")]
+        manager.update_metadatas([moved_id], [{"page": 7}])
+        catalog.apply("normas", {"manual.pdf": 0}, touched=True)
+        index.invalidate("normas")
+        with patch.object(settings, "vector_backend", "numpy"):
+            found = search_by_vector(query, "normas", 1)
+        assert found[0].metadata["page"] == 7
+
+
+def test_topic_catalog_keeps_concurrent_updates_from_every_worker(tmp_path):
+    path = str(tmp_path / "catalog.json")
+    TopicCatalog(path, list).clear()
+    # One catalog per thread stands in for one per uvicorn worker
+    workers = [TopicCatalog(path, list) for _ in range(4)]
+
+    def ingest(catalog):
+        for _ in range(25):
+            catalog.apply("normas", {"manual.pdf": 1})
+
+    threads = [threading.Thread(target=ingest, args=(catalog,)) for catalog in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert TopicCatalog(path, list).topics()["normas"]["chunks"] == 100
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_numpy_scores_in_blocks_without_touching_the_query(tmp_path, dtype):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((10, 8)).astype(np.float32)
+    documents = [f"Norma {i}" for i in range(10)]
+    index = NumpyVectorIndex(
+        str(tmp_path / "numpy"), dtype, mmap=True,
+        fetch_topic=lambda topic: (vectors, documents, [{"topic": topic}] * 10),
+        fingerprints=lambda: {"normas": [10, 1.0]}
+    )
+    query = vectors[3] * 5
+    original = query.copy()
+
+    with patch("app.services.numpy_store.BLOCK_ROWS", 3):
+        results = index.search(query, "normas", 3)
+
+    assert results[0].page_content == "Norma 3"
+    np.testing.assert_array_equal(query, original)
@@ -0,0 +1,146 @@
+import asyncio
+import datetime
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app.services import auth_service
+from app.services.audit_log import AuditWriter, rollup_ai_requests
+from app.services.rate_limiter import InMemoryRateLimiter, SQLiteRateLimiter
+
+
+async def make_sessions(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/audit.sqlite3")
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE ai_requests (token_id INT, created_at DATETIME)"))
+    return async_sessionmaker(engine)
+
+
+async def count_rows(sessions, table="ai_requests"):
+    async with sessions() as db:
+        return (await db.execute(text(f"SELECT COUNT(*) FROM {table}"))).scalar()
+
+
+def test_memory_limiter_sliding_window():
+    limiter = InMemoryRateLimiter(limit=2, window=60)
+    with patch("app.services.rate_limiter.time.monotonic", side_effect=[0, 10, 20, 61, 65]):
+        assert limiter.hit(1)
+        assert limiter.hit(1)
+        assert not limiter.hit(1)
+        # The hit at t=0 has left the window, the one at t=10 has not
+        assert limiter.hit(1)
+        assert not limiter.hit(1)
+    assert limiter.hit(2)
+
+
+def test_memory_limiter_forgets_quiet_keys_once_per_window():
+    with patch("app.services.rate_limiter.time.monotonic", side_effect=[0, 0, 1, 59, 61, 62]):
+        limiter = InMemoryRateLimiter(limit=5, window=60)
+        limiter.hit("a")
+        limiter.hit("b")
+        limiter.hit("c")
+        # First hit past the window: "a" and "b" are gone, "c" is still active
+        limiter.hit("d")
+        assert sorted(limiter._hits) == ["c", "d"]
+        limiter.hit("e")
+    assert sorted(limiter._hits) == ["c", "d", "e"]
+
+
+def test_sqlite_limiter_is_shared(tmp_path):
+    path = str(tmp_path / "limits.sqlite3")
+    first = SQLiteRateLimiter(path, limit=3, window=3600)
+    second = SQLiteRateLimiter(path, limit=3, window=3600)
+
+    assert [first.hit(7), second.hit(7), first.hit(7), second.hit(7)] == [True, True, True, False]
+    assert first.hit(8)
+
+
+def test_check_rate_limit_uses_configured_limit():
+    async def run():
+        with patch.object(auth_service, "rate_limiter", InMemoryRateLimiter(limit=1, window=600)), \
+             patch.object(auth_service, "audit_writer") as writer:
+            await auth_service.check_rate_limit(1)
+            with pytest.raises(HTTPException) as exc:
+                await auth_service.check_rate_limit(1)
+            writer.record.assert_called_once_with(1)
+        return exc.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert error.detail == "Rate limit exceeded. Maximum 1 requests per 10 minutes."
+
+
+def test_audit_writer_batches_rows(tmp_path):
+    async def run():
+        sessions = await make_sessions(tmp_path)
+        writer = AuditWriter(sessions, batch_size=3, flush_seconds=60)
+        for token_id in range(7):
+            writer.record(token_id)
+        # A full batch wakes the writer without waiting for flush_seconds
+        await asyncio.sleep(0.2)
+        written = writer.stats()["rows_written"]
+        await writer.close()
+        return written, writer.stats(), await count_rows(sessions)
+
+    written, stats, rows = asyncio.run(run())
+    assert written == 7
+    assert stats == {"rows_written": 7, "batches": 3, "write_errors": 0, "rows_dropped": 0, "pending": 0}
+    assert rows == 7
+
+
+def test_rollup_moves_old_rows_to_daily_counts(tmp_path):
+    now = datetime.datetime.now()
+    old = now - datetime.timedelta(days=40)
+    rows = [(1, old), (1, old), (2, old), (1, now)]
+
+    async def run():
+        sessions = await make_sessions(tmp_path)
+        async with sessions() as db:
+            await db.execute(
+                text("INSERT INTO ai_requests (token_id, created_at) VALUES (:t, :c)"),
+                [{"t": t, "c": c} for t, c in rows]
+            )
+            await db.commit()
+
+        first = await rollup_ai_requests(sessions, retention_days=30)
+        # Running it again adds nothing
+        second = await rollup_ai_requests(sessions, retention_days=30)
+        async with sessions() as db:
+            daily = (await db.execute(
+                text("SELECT token_id, requests FROM ai_requests_daily ORDER BY token_id")
+            )).fetchall()
+        return first, second, await count_rows(sessions), [tuple(r) for r in daily]
+
+    first, second, remaining, daily = asyncio.run(run())
+    assert first == {"days_rolled_up": 2, "rows_deleted": 3}
+    assert second == {"days_rolled_up": 0, "rows_deleted": 0}
+    assert remaining == 1
+    assert daily == [(1, 2), (2, 1)]
+
+
+def test_audit_writer_close_keeps_the_batch_being_written(tmp_path):
+    class SlowWriter(AuditWriter):
+        calls = 0
+
+        async def _write(self, rows):
+            self.calls += 1
+            if self.calls == 1:
+                # Still writing when the app shuts down
+                await asyncio.sleep(60)
+            await super()._write(rows)
+
+    async def run():
+        sessions = await make_sessions(tmp_path)
+        writer = SlowWriter(sessions, batch_size=3, flush_seconds=60)
+        for token_id in range(3):
+            writer.record(token_id)
+        await asyncio.sleep(0.05)
+        await writer.close()
+        return writer.stats(), await count_rows(sessions)
+
+    stats, rows = asyncio.run(run())
+    assert rows == 3
+    assert stats["pending"] == 0
@@ -0,0 +1,65 @@
+import asyncio
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.readiness import Readiness
+
+
+def test_warm_up_orders_dependencies_and_retries_failures():
+    order = []
+    attempts = {"llm": 0}
+
+    async def embeddings():
+        await asyncio.sleep(0.05)
+        order.append("embeddings")
+        return "modelo"
+
+    async def vector_db():
+        order.append("vector_db")
+        return "10 chunks"
+
+    async def llm():
+        attempts["llm"] += 1
+        if attempts["llm"] == 1:
+            raise ConnectionError("Ollama no responde")
+        return "gemma2:9b"
+
+    readiness = Readiness(
+        {"embeddings": embeddings, "vector_db": vector_db, "llm": llm},
+        after={"vector_db": "embeddings"},
+        retry_seconds=0.01
+    )
+
+    async def run():
+        readiness.start()
+        await asyncio.sleep(0.005)
+        during = readiness.snapshot()
+        await readiness._task
+        return during
+
+    during = asyncio.run(run())
+    assert not during["ready"]
+    assert during["components"]["vector_db"]["status"] == "pending"
+    assert during["components"]["llm"]["status"] == "failed"
+    assert during["components"]["llm"]["error"] == "Ollama no responde"
+
+    assert order == ["embeddings", "vector_db"]
+    assert attempts["llm"] == 2
+    snapshot = readiness.snapshot()
+    assert snapshot["ready"]
+    assert snapshot["components"]["vector_db"]["detail"] == "10 chunks"
+
+
+def test_ready_endpoint_reflects_component_state():
+    readiness = Readiness({"llm": None})
+    client = TestClient(app)
+    with patch("app.main.readiness", readiness):
+        assert client.get("/ready").status_code == 503
+        assert client.get("/health-check").json()["ollama_status"] == "pending"
+
+        readiness.components["llm"] = {"status": "ready", "seconds": 0.1, "detail": "gemma2:9b"}
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["ready"]
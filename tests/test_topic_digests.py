@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+from langchain_core.documents import Document
+
+from app.services.topic_digests import TopicDigests
+
+
+def chunk(text, page, start=0, source="manual.pdf"):
+    return Document(page_content=text, metadata={"topic": "normas", "source": source, "page": page, "start_index": start})
+
+
+def run_refresh(digests, chunks, calls):
+    async def fake_summarize(text, topic, max_facts):
+        calls.append(text)
+        return f"- resumen de: {text[:20]}"
+
+    with patch("app.services.topic_digests.topic_documents", return_value=chunks), \
+         patch("app.services.topic_digests.summarize_section", side_effect=fake_summarize):
+        asyncio.run(digests.refresh("normas"))
+
+
+def test_only_changed_sections_are_rebuilt(tmp_path):
+    path = str(tmp_path / "digests.json")
+    digests = TopicDigests(path, pages_per_section=2, max_facts=10)
+    chunks = [
+        chunk("Velocidad máxima en autopista 120 km/h.", 0),
+        chunk("En vías urbanas, 50 km/h.", 1),
+        chunk("Distancia de seguridad de 2 segundos.", 2),
+        chunk("Prohibido adelantar en curvas sin visibilidad.", 5, source="anexo.pdf")
+    ]
+    calls = []
+    run_refresh(digests, chunks, calls)
+    assert len(calls) == 3
+    # Pages 0 and 1 form one section, merged into a single prompt
+    assert any("120 km/h" in text and "50 km/h" in text for text in calls)
+
+    # New upload: one section changes, another disappears
+    calls.clear()
+    updated = chunks[:2] + [chunk("Distancia de seguridad de 3 segundos.", 2)]
+    restarted = TopicDigests(path, pages_per_section=2, max_facts=10)
+    run_refresh(restarted, updated, calls)
+    assert calls == ["Distancia de seguridad de 3 segundos."]
+
+    sections = restarted.get("normas")
+    assert sorted(sections) == ["manual.pdf#0", "manual.pdf#1"]
+    assert sections["manual.pdf#0"]["pages"] == [0, 1]
+    stats = restarted.stats()
+    assert stats["sections_unchanged"] == 1
+    assert stats["sections_built"] == 1
+    assert stats["sections_removed"] == 1
+
+
+def test_documents_serve_digests_and_drop_clears_them(tmp_path):
+    digests = TopicDigests(str(tmp_path / "digests.json"), pages_per_section=1, max_facts=10)
+    chunks = [chunk(f"Norma {i}", i) for i in range(5)]
+    run_refresh(digests, chunks, [])
+
+    async def fetch():
+        return await digests.documents("normas", limit=3)
+
+    documents = asyncio.run(fetch())
+    assert len(documents) == 3
+    assert all(d.page_content.startswith("- resumen de: Norma") for d in documents)
+    assert all(d.metadata["digest"] for d in documents)
+
+    digests.drop("normas")
+    assert digests.get("normas") == {}
+
+
+def test_workers_share_digests_without_overwriting_each_other(tmp_path):
+    path = str(tmp_path / "digests.json")
+    # Two instances on one file stand in for two uvicorn workers
+    first = TopicDigests(path, pages_per_section=1, max_facts=10)
+    second = TopicDigests(path, pages_per_section=1, max_facts=10)
+    run_refresh(first, [chunk("Norma 0", 0)], [])
+    assert list(second.get("normas")) == ["manual.pdf#0"]
+
+    async def fake_summarize(text, topic, max_facts):
+        return "- stop"
+
+    other_topic = [Document(page_content="Señal de stop", metadata={"topic": "senales", "source": "s.pdf", "page": 0})]
+    with patch("app.services.topic_digests.topic_documents", return_value=other_topic), \
+         patch("app.services.topic_digests.summarize_section", side_effect=fake_summarize):
+        asyncio.run(second.refresh("senales"))
+
+    # Neither worker's write dropped the other's topic, and the first sees it without restarting
+    assert sorted(TopicDigests(path, 1, 10).stats()["sections"]) == ["normas", "senales"]
+    assert first.get("senales")["s.pdf#0"]["digest"] == "- stop"
+
+
+def test_concurrent_writes_from_every_worker_are_kept(tmp_path):
+    path = str(tmp_path / "digests.json")
+    workers = [TopicDigests(path, pages_per_section=1, max_facts=10) for _ in range(4)]
+
+    def write(index, digests):
+        for n in range(25):
+            digests._update(lambda stored: stored.setdefault("normas", {}).__setitem__(f"{index}#{n}", {}))
+
+    threads = [threading.Thread(target=write, args=pair) for pair in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert TopicDigests(path, 1, 10).stats()["sections"] == {"normas": 100}